@@ -1,25 +1,54 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
-from flask_cors import CORS
 import os
+import logging
+
+# Profil de démarrage (PANEL_PROFILE_STARTUP=1) : doit être lancé avant les autres imports
+from utils.boot_profile import BOOT_PROFILER
+BOOT_PROFILER.start()
+
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
+from flask_cors import CORS
 import json
-import pandas as pd
 from werkzeug.utils import secure_filename
+import queue
+import signal
+import threading
 import traceback
 from datetime import datetime
-import logging
 
-# Configuration du logging
-logging.basicConfig(level=logging.INFO)
+# Configuration du logging (unique point de configuration, les modules utils n'appellent pas basicConfig)
+logging.basicConfig(
+    level=os.environ.get('PANEL_LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
 logger = logging.getLogger(__name__)
 
 # Import des utilitaires
-from utils.excel_parser import load_companies_from_excel
-from utils.mistral_api import analyze_document, generate_document, get_agent_answer
-from utils.company_matcher import match_companies
+from utils.lazy_imports import get_pandas, get_pypdf2, get_docx
+from utils.excel_parser import stable_company_id
+from utils.data_sources import load_registry, load_panel, SourceWatcher
+from utils.ingest import parse_workbook, start_parse_pool
+from utils.dedupe import dedupe_new, carry_index
+from utils.mistral_api import MistralAPI, get_agent_answer, DEFAULT_API_URL
+from utils.company_matcher import match_companies, match_companies_batch, compact_matches, MATCH_RESULT_FIELDS
 from utils.document_generator import create_document
+from utils.document_writers import document_extension, write_evaluation_grid, write_docx, template_path_for
+from utils.mail_merge import MergeTemplate, letter_template, stream_zip
+from utils.panel_store import PanelStore
+from utils.panel_edits import PanelEdits
+from utils.cert_index import certification_index, filter_company_rows
+from utils.geo_index import geo_index
+from utils.gazetteer import get_gazetteer
+from utils.tracing import span
+from utils.llm_limiter import LLM_LIMITER
+from utils.circuit_breaker import PRISME_BREAKER
+from utils.analysis_jobs import AnalysisJobRegistry, DEFAULT_JOBS_DIR, LOCAL_TIER, LLM_TIER
+from utils.result_cache import MatchResultCache, criteria_fingerprint
+from utils.score_cache import CriterionScoreCache
+from utils.json_provider import FastJSONProvider
 
 # Configuration Flask
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
 # Configuration des chemins
@@ -27,73 +56,37 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['GENERATED_DOCS'] = 'generated'
 app.config['TEMPLATE_DOCS'] = 'templates_docs'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB
+app.config['MAX_BATCH_PROJECTS'] = int(os.environ.get('PANEL_MAX_BATCH_PROJECTS', '100'))
+# Tentatives d'un import quand le panel change pendant le dédoublonnage
+IMPORT_ATTEMPTS = 3
+# Attente maximale (secondes) du chargement du panel par une requête de l'API au démarrage
+app.config['PANEL_LOAD_TIMEOUT'] = float(os.environ.get('PANEL_LOAD_TIMEOUT', '60'))
+# Champs des entreprises renvoyés dans les résultats de matching (le détail complet
+# est servi par /api/companies/<id>)
+app.config['MATCH_RESULT_FIELDS'] = tuple(
+    field.strip() for field in os.environ.get('PANEL_MATCH_FIELDS', ','.join(MATCH_RESULT_FIELDS)).split(',')
+    if field.strip()
+)
 
 # Configuration API Prisme AI
 app.config['PRISME_API_KEY'] = 'cec930ebb79846da94d2cf5028177995'
 app.config['PRISME_AGENT_ID'] = '67f785d59e82260f684a217a'
+# URL du webhook (PRISME_API_URL, par exemple scripts/stub_webhook.py en test)
+app.config['PRISME_API_URL'] = DEFAULT_API_URL
 
 # Créer les dossiers nécessaires
 for folder in [app.config['UPLOAD_FOLDER'], app.config['GENERATED_DOCS'], 
                app.config['TEMPLATE_DOCS'], 'data']:
     os.makedirs(folder, exist_ok=True)
 
-def find_excel_file():
-    """Trouve automatiquement le fichier Excel des entreprises"""
-    logger.info("=== RECHERCHE FICHIER EXCEL ===")
-    
-    # Chemins possibles
-    possible_paths = [
-        'DACI GP_ORANO DS_Nettoyages des échangeurs à plaques_CNPE CHOOZ signé .xlsx',
-        'data/DACI GP_ORANO DS_Nettoyages des échangeurs à plaques_CNPE CHOOZ signé .xlsx',
-        'ACMS Publipostage FINAL V4.xlsx',
-        'data/ACMS Publipostage FINAL V4.xlsx'
-    ]
-    
-    # Chercher le fichier spécifique
-    for path in possible_paths:
-        if os.path.exists(path):
-            logger.info(f"Fichier Excel trouvé: {path}")
-            return path
-    
-    # Chercher tous les fichiers Excel
-    logger.info("Recherche de fichiers Excel dans le répertoire...")
-    
-    excel_files = []
-    for root, dirs, files in os.walk('.'):
-        for file in files:
-            if file.endswith(('.xlsx', '.xls')):
-                full_path = os.path.join(root, file)
-                excel_files.append(full_path)
-                logger.info(f"Fichier Excel trouvé: {full_path}")
-    
-    # Prioriser les fichiers avec certains mots-clés
-    priority_keywords = ['daci', 'orano', 'acms', 'publipostage', 'entreprise']
-    
-    for excel_file in excel_files:
-        file_lower = excel_file.lower()
-        if any(keyword in file_lower for keyword in priority_keywords):
-            logger.info(f"Fichier Excel prioritaire sélectionné: {excel_file}")
-            return excel_file
-    
-    # Prendre le premier fichier Excel trouvé
-    if excel_files:
-        logger.info(f"Premier fichier Excel utilisé: {excel_files[0]}")
-        return excel_files[0]
-    
-    logger.warning("Aucun fichier Excel trouvé!")
-    return None
+# Registre des fichiers sources du panel (data/sources.json)
+DATA_SOURCES = load_registry()
 
 def load_companies_safely():
-    """Charge les entreprises avec gestion d'erreurs robuste"""
+    """Charge les entreprises depuis les sources déclarées avec gestion d'erreurs robuste"""
     try:
-        excel_file = find_excel_file()
-        
-        if not excel_file:
-            logger.warning("Aucun fichier Excel trouvé, création d'entreprises de test")
-            return create_test_companies()
-        
-        logger.info(f"Chargement des entreprises depuis: {excel_file}")
-        companies = load_companies_from_excel(excel_file)
+        logger.info("=== CHARGEMENT DES SOURCES DE DONNÉES ===")
+        companies = load_panel(DATA_SOURCES['sources'])
         
         if not companies:
             logger.warning("Aucune entreprise extraite, création d'entreprises de test")
@@ -107,9 +100,7 @@ def load_companies_safely():
             domain = company.get('domain', 'Autre')
             domain_stats[domain] = domain_stats.get(domain, 0) + 1
         
-        logger.info("Répartition par domaine:")
-        for domain, count in domain_stats.items():
-            logger.info(f"  - {domain}: {count}")
+        logger.info("Répartition par domaine: %s", domain_stats)
         
         return companies
         
@@ -206,10 +197,107 @@ def create_test_companies():
     logger.info(f"✅ {len(test_companies)} entreprises de test créées")
     return test_companies
 
-# Charger les entreprises au démarrage
+# Mode préfork (gunicorn, voir gunicorn.conf.py et wsgi.py) : le panel et ses index
+# sont chargés dans le processus maître avant le fork et partagés par les workers ;
+# les sources sont surveillées par le maître, qui recharge le panel puis remplace
+# ses workers (tous servent ainsi la même version) ; il en va de même après une
+# modification par l'API (voir publish_panel_change)
+PREFORK = os.environ.get('PANEL_SERVER_MODE') == 'prefork'
+
+# Serveur à un seul processus : les processus de parsing des classeurs sont
+# forkés maintenant, avant le démarrage de tout thread, et servent ensuite le
+# chargement, les rechargements des sources et les imports (une feuille par
+# tâche). Le maître préfork, sans thread, forke les siens à chaque parsing.
+if not PREFORK:
+    start_parse_pool()
+
+# Le panel est chargé une fois le serveur démarré (voir load_initial_panel) ; les
+# modifications faites par l'API (ajouts, mises à jour, suppressions, imports) sont
+# conservées à part et réappliquées à chaque rechargement
 logger.info("=== DÉMARRAGE APPLICATION ===")
-COMPANIES = load_companies_safely()
-logger.info(f"Application démarrée avec {len(COMPANIES)} entreprises")
+PANEL = PanelStore(edits=PanelEdits())
+
+# Cache des résultats de matching, vidé à chaque modification du panel
+MATCH_CACHE = MatchResultCache()
+# Analyses à deux niveaux en cours (résultat local, puis résultat de l'IA) ; en
+# mode préfork, partagées par les workers dans un répertoire commun (un client
+# peut suivre son analyse sur n'importe quel worker)
+ANALYSIS_JOBS = AnalysisJobRegistry(directory=DEFAULT_JOBS_DIR if PREFORK else None)
+PANEL.subscribe(MATCH_CACHE.clear)
+
+# Vecteurs de scores par critère, conservés par session de recherche
+SCORE_CACHE = CriterionScoreCache()
+PANEL.subscribe(SCORE_CACHE.clear)
+
+# Surveillance des fichiers sources : le panel est reparsé en arrière-plan puis remplacé,
+# modifications de l'API réappliquées
+SOURCE_WATCHER = SourceWatcher(DATA_SOURCES['sources'], PANEL.rebase,
+                               DATA_SOURCES['watch']['intervalSeconds'])
+
+# Positionné quand le panel est chargé depuis les sources (voir wait_for_panel)
+PANEL_LOADED = threading.Event()
+# Positionné quand les index du panel sont construits (voir /api/system/ready)
+READY = threading.Event()
+
+def load_initial_panel():
+    """
+    Charge le panel depuis les sources, après le démarrage (hors du temps de
+    démarrage à froid, phase différée du profil) : dans un thread pour un
+    serveur à un seul processus, dans le maître gunicorn avant le fork des
+    workers (wsgi.prepare_master)
+    """
+    with BOOT_PROFILER.phase('load_panel'):
+        PANEL.rebase(load_companies_safely())
+    PANEL_LOADED.set()
+    logger.info(f"Application démarrée avec {len(PANEL.companies)} entreprises")
+
+def warm_up():
+    """Construit les index du panel courant (certifications, géographie, gazetteer)"""
+    companies, version = PANEL.snapshot()
+    with span('warm_up', companies=len(companies), version=version):
+        get_gazetteer()
+        certification_index(companies)
+        geo_index(companies)
+    READY.set()
+    logger.info(f"Index construits pour {len(companies)} entreprises")
+
+def start_background_tasks():
+    """Démarre la surveillance des fichiers sources (serveur à un seul processus)"""
+    if DATA_SOURCES['watch']['enabled']:
+        SOURCE_WATCHER.start()
+
+def load_in_background():
+    """Serveur à un seul processus : panel chargé, index construits, puis sources surveillées"""
+    load_initial_panel()
+    warm_up()
+    start_background_tasks()
+
+def watch_sources_in_master(request_reload):
+    """
+    Mode préfork, dans le maître gunicorn : les sources sont vérifiées par un
+    minuteur (SIGALRM, sans thread, le maître continuant à forker des
+    workers) ; une modification appelle request_reload (SIGHUP au maître),
+    le rechargement lui-même étant fait par wsgi.reload_panel
+    """
+    if not DATA_SOURCES['watch']['enabled']:
+        return
+    SOURCE_WATCHER.on_change = request_reload
+    interval = DATA_SOURCES['watch']['intervalSeconds']
+    signal.signal(signal.SIGALRM, lambda signum, frame: SOURCE_WATCHER.poll())
+    signal.setitimer(signal.ITIMER_REAL, interval, interval)
+    logger.info(f"Surveillance des sources dans le maître toutes les {interval}s")
+
+@app.before_request
+def wait_for_panel():
+    """
+    Au démarrage, les routes de l'API (hors /api/system/) attendent le
+    chargement du panel, PANEL_LOAD_TIMEOUT secondes au plus (503 au-delà)
+    """
+    if PANEL_LOADED.is_set() or not request.path.startswith('/api/') or request.path.startswith('/api/system/'):
+        return None
+    if not PANEL_LOADED.wait(app.config['PANEL_LOAD_TIMEOUT']):
+        return jsonify({"success": False, "error": "Panel en cours de chargement, réessayez dans un instant"}), 503
+    return None
 
 # Extensions de fichiers autorisées
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'doc', 'xlsx', 'xls', 'txt'}
@@ -257,8 +345,9 @@ def search():
 
 @app.route('/database')
 def database():
-    logger.info(f"Page base de données - {len(COMPANIES)} entreprises")
-    return render_template('pages/database.html', page='database', companies=COMPANIES)
+    companies = PANEL.companies
+    logger.debug("Page base de données - %d entreprises", len(companies))
+    return render_template('pages/database.html', page='database', companies=companies)
 
 @app.route('/guide')
 def guide():
@@ -319,12 +408,38 @@ def determine_document_type(filename):
 def get_all_companies():
     """Retourne toutes les entreprises"""
     try:
-        logger.info(f"API /api/companies - Retour de {len(COMPANIES)} entreprises")
-        return jsonify({"success": True, "data": COMPANIES})
+        companies = PANEL.companies
+        logger.debug("API /api/companies - Retour de %d entreprises", len(companies))
+        return jsonify({"success": True, "data": companies.to_dicts()})
     except Exception as e:
         logger.error(f"Erreur API companies: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/companies/<company_id>', methods=['GET'])
+def get_company(company_id):
+    """Récupère le détail complet d'une entreprise"""
+    companies, _ = PANEL.snapshot()
+    row = companies.row_of(company_id)
+    if row is None:
+        return jsonify({"success": False, "message": "Entreprise non trouvée"}), 404
+    return jsonify({"success": True, "data": companies[row].to_dict()})
+
+@app.route('/api/companies/filter', methods=['GET'])
+def filter_companies():
+    """Retourne les identifiants des entreprises correspondant aux filtres de la base"""
+    try:
+        companies = PANEL.companies
+        rows = filter_company_rows(
+            companies,
+            certification=request.args.get('certification'),
+            domain=request.args.get('domain'),
+            query=request.args.get('q')
+        )
+        return jsonify({"success": True, "data": [companies[row]['id'] for row in rows], "version": PANEL.version})
+    except Exception as e:
+        logger.error(f"Erreur filtre entreprises: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route('/api/files/parse-document', methods=['POST'])
 def parse_document():
     """Parse un document uploadé"""
@@ -372,7 +487,7 @@ def extract_text_from_file(file_path, filename):
         
         elif filename.endswith('.pdf'):
             try:
-                import PyPDF2
+                PyPDF2 = get_pypdf2()
                 with open(file_path, 'rb') as f:
                     pdf_reader = PyPDF2.PdfReader(f)
                     text = ""
@@ -384,15 +499,14 @@ def extract_text_from_file(file_path, filename):
         
         elif filename.endswith(('.docx', '.doc')):
             try:
-                from docx import Document
-                doc = Document(file_path)
+                doc = get_docx().Document(file_path)
                 text = "\n".join([para.text for para in doc.paragraphs])
                 return text
             except ImportError:
                 return f"[Contenu DOCX - {filename}] Module python-docx non disponible"
         
         elif filename.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(file_path)
+            df = get_pandas().read_excel(file_path)
             return df.to_string()
         
         else:
@@ -402,6 +516,10 @@ def extract_text_from_file(file_path, filename):
         logger.error(f"Erreur extraction texte: {e}")
         return f"[Erreur extraction texte du fichier {filename}]"
 
+def prisme_client():
+    """Client Prisme d'une requête (son attribut degraded indique un repli local)"""
+    return MistralAPI(app.config['PRISME_API_KEY'], None, app.config['PRISME_API_URL'])
+
 @app.route('/api/ia/analyze-document', methods=['POST'])
 def api_analyze_document():
     """Analyse un document avec l'IA"""
@@ -409,55 +527,337 @@ def api_analyze_document():
         data = request.json
         document_text = data.get('documentText', '')
         
-        logger.info(f"=== ANALYSE DOCUMENT ===")
-        logger.info(f"Longueur texte: {len(document_text)} caractères")
+        logger.debug("Analyse document: %d caractères", len(document_text))
         
         if not document_text:
             return jsonify({"success": False, "message": "Texte du document requis"}), 400
         
-        # Analyser avec l'API Mistral
-        analysis_results = analyze_document(document_text, app.config['PRISME_API_KEY'])
+        client = prisme_client()
         
-        logger.info(f"Analyse terminée: {len(analysis_results.get('keywords', []))} mots-clés")
+        # Mode à deux niveaux : résultat local immédiat, analyse IA en tâche de fond
+        if data.get('mode') == 'tiered':
+            return jsonify({"success": True, **start_tiered_analysis(client, document_text).to_dict()})
         
-        return jsonify({"success": True, "data": analysis_results})
+        # Analyser avec l'API Mistral
+        analysis_results = client.analyze_document(document_text)
+        
+        # degraded : analyse locale de secours (Prisme indisponible ou circuit ouvert)
+        return jsonify({"success": True, "data": analysis_results, "degraded": client.degraded})
         
     except Exception as e:
         logger.error(f"Erreur analyse document: {e}")
         logger.error(traceback.format_exc())
         return jsonify({"success": False, "error": str(e)}), 500
 
+def start_tiered_analysis(client, document_text):
+    """
+    Enregistre une analyse à deux niveaux : le résultat local (quelques
+    millisecondes) est disponible tout de suite, l'analyse IA tourne dans un
+    thread et le remplace à son arrivée
+    """
+    job = ANALYSIS_JOBS.create(client.local_analysis(document_text))
+    
+    if len(document_text.strip()) < 100:
+        # Document trop court : l'IA ne serait pas appelée
+        ANALYSIS_JOBS.complete(job, job.result, LOCAL_TIER)
+        return job
+    if PRISME_BREAKER.rejects(count=True):
+        # Prisme indisponible : le résultat local est définitif
+        ANALYSIS_JOBS.complete(job, job.result, LOCAL_TIER, degraded=True)
+        return job
+    
+    def refine():
+        try:
+            result = client.analyze_document(document_text)
+            if client.degraded:
+                ANALYSIS_JOBS.complete(job, job.result, LOCAL_TIER, degraded=True)
+            else:
+                ANALYSIS_JOBS.complete(job, result, LLM_TIER)
+        except Exception as e:
+            logger.error(f"Erreur analyse IA (tâche de fond): {e}")
+            logger.error(traceback.format_exc())
+            ANALYSIS_JOBS.fail(job, e)
+    
+    threading.Thread(target=refine, daemon=True).start()
+    return job
+
+@app.route('/api/ia/analysis/<analysis_id>', methods=['GET'])
+def get_analysis(analysis_id):
+    """
+    État d'une analyse à deux niveaux ; ?wait=<secondes> attend (30 s au
+    plus) que l'analyse IA se termine
+    """
+    job = ANALYSIS_JOBS.get(analysis_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Analyse inconnue ou expirée"}), 404
+    
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0.0), 30.0)
+    except ValueError:
+        return jsonify({"success": False, "message": "Paramètre wait invalide"}), 400
+    if wait:
+        job = ANALYSIS_JOBS.wait(job, wait)
+    
+    return jsonify({"success": True, **job.to_dict()})
+
+@app.route('/api/ia/analysis/<analysis_id>/stream', methods=['GET'])
+def stream_analysis(analysis_id):
+    """
+    Flux (text/event-stream) d'une analyse à deux niveaux : un événement
+    'analysis' avec l'état courant, puis 'result' quand l'analyse IA est
+    terminée
+    """
+    job = ANALYSIS_JOBS.get(analysis_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Analyse inconnue ou expirée"}), 404
+    
+    def generate():
+        current = job
+        yield sse_event('analysis', {"success": True, **current.to_dict()})
+        while True:
+            current = ANALYSIS_JOBS.wait(current, 15)
+            if current.done.is_set():
+                break
+            # Commentaire SSE périodique : garde la connexion ouverte derrière les proxys
+            yield ": keep-alive\n\n"
+        yield sse_event('result', {"success": True, **current.to_dict()})
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def match_parameters(data):
+    """
+    Paramètres communs des routes de matching : (maxResults, minScore)
+    
+    Raises:
+        ValueError: requête qui n'est pas un objet JSON ou paramètre qui
+            n'est pas un entier (la route répond 400)
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Requête JSON invalide")
+    try:
+        return int(data.get('maxResults', 10)), int(data.get('minScore', 60))
+    except (TypeError, ValueError):
+        raise ValueError("Paramètres invalides : maxResults et minScore doivent être des entiers")
+
+def check_criteria(criteria):
+    """
+    Vérifie les critères d'une recherche : liste non vide d'objets ayant un
+    'id' et un 'name'
+    
+    Raises:
+        ValueError: critères absents ou mal formés (la route répond 400)
+    """
+    if not isinstance(criteria, list) or not criteria:
+        raise ValueError("Critères requis")
+    if not all(isinstance(criterion, dict) and 'id' in criterion and 'name' in criterion for criterion in criteria):
+        raise ValueError("Critères invalides : chaque critère doit avoir un 'id' et un 'name'")
+
 @app.route('/api/ia/find-matching-companies', methods=['POST'])
 def api_find_matching_companies():
     """Trouve les entreprises correspondant aux critères"""
     try:
         data = request.json
-        criteria = data.get('criteria', [])
-        
-        logger.info(f"=== MATCHING ENTREPRISES ===")
-        logger.info(f"Critères reçus: {len(criteria)}")
-        logger.info(f"Entreprises disponibles: {len(COMPANIES)}")
+        try:
+            max_results, min_score = match_parameters(data)
+            criteria = data.get('criteria', [])
+            check_criteria(criteria)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        search_id = data.get('searchId') or CriterionScoreCache.new_search_id()
         
-        if not criteria:
-            return jsonify({"success": False, "message": "Critères requis"}), 400
+        companies, dataset_version = PANEL.snapshot()
+        logger.debug("Matching: %d critères, %d entreprises", len(criteria), len(companies))
         
-        if not COMPANIES:
+        if not companies:
             return jsonify({"success": False, "message": "Aucune entreprise en base"}), 400
         
-        # Utiliser l'algorithme de matching amélioré
-        matched_companies = match_companies(COMPANIES, criteria)
+        # Réponse depuis le cache si les mêmes critères ont déjà été évalués sur cette version du panel
+        cache_key = criteria_fingerprint(criteria, max_results, min_score, dataset_version)
+        matched_companies = MATCH_CACHE.get(cache_key)
         
-        logger.info(f"Matching terminé: {len(matched_companies)} entreprises")
-        if matched_companies:
-            logger.info(f"Meilleur match: {matched_companies[0]['name']} ({matched_companies[0]['score']}%)")
+        if matched_companies is None:
+            # Utiliser l'algorithme de matching amélioré, en réutilisant les scores déjà
+            # calculés pour cette session de recherche
+            score_vectors = SCORE_CACHE.vectors(search_id, dataset_version)
+            matched_companies = match_companies(companies, criteria, max_results, min_score,
+                                                score_vectors=score_vectors)
+            MATCH_CACHE.put(cache_key, matched_companies)
         
-        return jsonify({"success": True, "data": matched_companies})
+        return jsonify({
+            "success": True,
+            "data": compact_matches(matched_companies, match_result_fields(data)),
+            "searchId": search_id
+        })
         
     except Exception as e:
         logger.error(f"Erreur matching: {e}")
         logger.error(traceback.format_exc())
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/ia/find-matching-companies/batch', methods=['POST'])
+def api_find_matching_companies_batch():
+    """
+    Trouve les entreprises correspondant aux critères de plusieurs projets
+    en un seul passage sur le panel : {"projects": [{"id", "criteria"}, ...]}
+    """
+    try:
+        data = request.json or {}
+        try:
+            max_results, min_score = match_parameters(data)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        projects = data.get('projects', [])
+        fields = match_result_fields(data)
+        
+        if not projects or not isinstance(projects, list):
+            return jsonify({"success": False, "message": "Projets requis"}), 400
+        
+        if len(projects) > app.config['MAX_BATCH_PROJECTS']:
+            return jsonify({
+                "success": False,
+                "message": f"Maximum {app.config['MAX_BATCH_PROJECTS']} projets par appel"
+            }), 400
+        
+        for i, project in enumerate(projects):
+            if not isinstance(project, dict):
+                return jsonify({"success": False, "message": f"Projet {i + 1} invalide : objet attendu"}), 400
+            try:
+                check_criteria(project.get('criteria'))
+            except ValueError as e:
+                return jsonify({"success": False, "message": f"Projet {project.get('id', i + 1)} : {e}"}), 400
+        
+        companies, dataset_version = PANEL.snapshot()
+        if not companies:
+            return jsonify({"success": False, "message": "Aucune entreprise en base"}), 400
+        
+        # Les projets déjà évalués sur cette version du panel viennent du cache
+        cache_keys = [
+            criteria_fingerprint(project['criteria'], max_results, min_score, dataset_version)
+            for project in projects
+        ]
+        results = [MATCH_CACHE.get(cache_key) for cache_key in cache_keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        logger.debug("Matching groupé: %d projets (%d à calculer), %d entreprises",
+                     len(projects), len(missing), len(companies))
+        
+        if missing:
+            matched = match_companies_batch(companies, [projects[i]['criteria'] for i in missing],
+                                            max_results, min_score)
+            for i, matched_companies in zip(missing, matched):
+                MATCH_CACHE.put(cache_keys[i], matched_companies)
+                results[i] = matched_companies
+        
+        return jsonify({
+            "success": True,
+            "data": [
+                {"id": project.get('id', i), "companies": compact_matches(result, fields)}
+                for i, (project, result) in enumerate(zip(projects, results))
+            ]
+        })
+        
+    except Exception as e:
+        logger.error(f"Erreur matching groupé: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e)}), 500
+
+def match_result_fields(data):
+    """
+    Champs d'entreprise demandés pour les résultats de matching : liste 'fields'
+    de la requête, 'all' pour tous les champs, sinon MATCH_RESULT_FIELDS
+    """
+    fields = data.get('fields')
+    if fields == 'all':
+        return None
+    if isinstance(fields, list):
+        return tuple(str(field) for field in fields)
+    return app.config['MATCH_RESULT_FIELDS']
+
+def sse_event(event, payload):
+    """Formate un événement Server-Sent Events"""
+    return f"event: {event}\ndata: {app.json.dumps(payload)}\n\n"
+
+@app.route('/api/ia/find-matching-companies/stream', methods=['POST'])
+def api_find_matching_companies_stream():
+    """
+    Variante en flux (text/event-stream) de find-matching-companies : un
+    événement 'progress' avec le top provisoire après chaque tour de
+    scoring, puis un événement 'result' avec la liste finale (règles de
+    diversité appliquées), ou 'error'
+    """
+    data = request.json or {}
+    try:
+        max_results, min_score = match_parameters(data)
+        criteria = data.get('criteria', [])
+        check_criteria(criteria)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    search_id = data.get('searchId') or CriterionScoreCache.new_search_id()
+    fields = match_result_fields(data)
+    
+    companies, dataset_version = PANEL.snapshot()
+    
+    if not companies:
+        return jsonify({"success": False, "message": "Aucune entreprise en base"}), 400
+    
+    cache_key = criteria_fingerprint(criteria, max_results, min_score, dataset_version)
+    events = queue.Queue()
+    
+    def run_matching():
+        try:
+            score_vectors = SCORE_CACHE.vectors(search_id, dataset_version)
+            matched_companies = match_companies(
+                companies, criteria, max_results, min_score, score_vectors=score_vectors,
+                on_progress=lambda provisional: events.put(
+                    sse_event('progress', {"data": compact_matches(provisional, fields)})
+                )
+            )
+            MATCH_CACHE.put(cache_key, matched_companies)
+            events.put(sse_event('result', {
+                "success": True,
+                "data": compact_matches(matched_companies, fields),
+                "searchId": search_id
+            }))
+        except Exception as e:
+            logger.error(f"Erreur matching (flux): {e}")
+            logger.error(traceback.format_exc())
+            events.put(sse_event('error', {"success": False, "error": str(e)}))
+        events.put(None)
+    
+    def generate():
+        matched_companies = MATCH_CACHE.get(cache_key)
+        if matched_companies is not None:
+            yield sse_event('result', {
+                "success": True,
+                "data": compact_matches(matched_companies, fields),
+                "searchId": search_id
+            })
+            return
+        
+        # Le scoring tourne dans un thread : ses résultats provisoires sont
+        # transmis au fur et à mesure
+        threading.Thread(target=run_matching, daemon=True).start()
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            yield event
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def selected_companies(data):
+    """
+    Entreprises sélectionnées d'une demande de génération : liste
+    'companies' de la requête (envoyée par search.js), sinon celle de
+    'projectData'
+    """
+    return data.get('companies') or (data.get('projectData') or {}).get('companies') or []
+
 @app.route('/api/documents/generate', methods=['POST'])
 def api_generate_document():
     """Génère un document de consultation"""
@@ -465,7 +865,7 @@ def api_generate_document():
         data = request.json
         template_type = data.get('templateType')
         project_data = data.get('projectData', {})
-        companies = data.get('companies', [])
+        companies = selected_companies(data)
         
         logger.info(f"Génération document: {template_type}")
         
@@ -473,47 +873,162 @@ def api_generate_document():
             return jsonify({"success": False, "message": "Type de document requis"}), 400
         
         # Générer le document
-        document_content = generate_document(
-            template_type, 
-            project_data, 
-            app.config['PRISME_API_KEY']
-        )
+        client = prisme_client()
+        document_content = client.generate_document(template_type, project_data, companies)
         
         # Sauvegarder le document
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        project_id = project_data.get('id', 'projet').replace(' ', '_')
-        
-        extension = 'xlsx' if template_type == 'grilleEvaluation' else 'txt'
-        
-        prefix_map = {
-            'projetMarche': 'PM',
-            'reglementConsultation': 'RC',
-            'grilleEvaluation': 'GE',
-            'lettreConsultation': 'LC'
-        }
-        prefix = prefix_map.get(template_type, 'DOC')
-        
-        filename = f"{prefix}_{project_id}_{timestamp}.{extension}"
-        file_path = os.path.join(app.config['GENERATED_DOCS'], filename)
-        
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(document_content)
-        
-        logger.info(f"Document généré: {filename}")
+        saved = save_generated_document(template_type, project_data, document_content, companies)
         
         return jsonify({
             "success": True,
             "data": {
-                "fileName": filename,
-                "fileUrl": f"/api/documents/download/{filename}",
-                "type": extension
-            }
+                "fileName": saved["fileName"],
+                "fileUrl": saved["fileUrl"],
+                "type": saved["type"]
+            },
+            "degraded": client.degraded
         })
         
     except Exception as e:
         logger.error(f"Erreur génération document: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/documents/generate-pack', methods=['POST'])
+def api_generate_document_pack():
+    """
+    Génère plusieurs documents de consultation en un seul échange avec l'IA :
+    le contexte du projet est construit une fois et partagé par tous les
+    documents
+    """
+    try:
+        data = request.json or {}
+        template_types = data.get('templateTypes')
+        project_data = data.get('projectData', {})
+        
+        if (not isinstance(template_types, list) or not template_types
+                or not all(isinstance(template_type, str) and template_type for template_type in template_types)):
+            return jsonify({"success": False, "message": "Types de documents requis"}), 400
+        
+        logger.info(f"Génération pack: {', '.join(template_types)}")
+        
+        # Les mêmes entreprises pour le contexte de l'IA et pour la grille
+        companies = selected_companies(data)
+        client = prisme_client()
+        documents = client.generate_documents(template_types, project_data, companies)
+        
+        saved = [
+            save_generated_document(template_type, project_data, content, companies)
+            for template_type, content in documents.items()
+        ]
+        
+        return jsonify({"success": True, "data": saved, "degraded": client.degraded})
+        
+    except Exception as e:
+        logger.error(f"Erreur génération pack: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e)}), 500
+
+def save_generated_document(template_type, project_data, document_content, companies=None):
+    """
+    Enregistre un document généré dans son format réel et retourne sa
+    description (nom, URL, type) : grille d'évaluation xlsx (une ligne par
+    entreprise consultée, le texte de l'IA en feuille « Notes »), docx pour
+    les autres documents (modèle templates_docs/<type>.docx s'il existe)
+    """
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    project_id = project_data.get('id', 'projet').replace(' ', '_')
+    
+    extension = document_extension(template_type)
+    
+    prefix_map = {
+        'projetMarche': 'PM',
+        'reglementConsultation': 'RC',
+        'grilleEvaluation': 'GE',
+        'lettreConsultation': 'LC'
+    }
+    prefix = prefix_map.get(template_type, 'DOC')
+    
+    filename = f"{prefix}_{project_id}_{timestamp}.{extension}"
+    file_path = os.path.join(app.config['GENERATED_DOCS'], filename)
+    
+    if extension == 'xlsx':
+        write_evaluation_grid(file_path, project_data, companies or [], notes=document_content)
+    else:
+        write_docx(file_path, document_content,
+                   template_path=template_path_for(app.config['TEMPLATE_DOCS'], template_type))
+    
+    logger.info(f"Document généré: {filename}")
+    
+    return {
+        "templateType": template_type,
+        "fileName": filename,
+        "fileUrl": f"/api/documents/download/{filename}",
+        "type": extension
+    }
+
+def merge_recipients(companies):
+    """
+    Destinataires d'un publipostage : la fiche complète du panel (contact,
+    localisation) de chaque entreprise sélectionnée, ou l'entreprise telle
+    qu'envoyée si elle n'est pas dans le panel
+    """
+    panel, _ = PANEL.snapshot()
+    recipients = []
+    for company in companies or []:
+        if not isinstance(company, dict):
+            continue
+        row = panel.row_of(company['id']) if company.get('id') else None
+        if row is not None:
+            recipients.append(panel[row].to_dict())
+        elif company.get('name'):
+            recipients.append(company)
+    return recipients
+
+@app.route('/api/documents/mail-merge', methods=['POST'])
+def api_mail_merge():
+    """
+    Publipostage des lettres de consultation : une lettre docx personnalisée
+    par entreprise sélectionnée (nom, localisation, contact), rendue sans
+    appel à l'IA à partir d'un seul modèle compilé, et livrée dans une
+    archive ZIP diffusée au fil du rendu.
+    
+    Le modèle est le texte "template" de la requête (champs {{entreprise}},
+    {{localisation}}, {{email}}, {{telephone}}, {{domaine}}), sinon la lettre
+    de consultation locale du projet ; templates_docs/lettreConsultation.docx
+    en donne la mise en page s'il existe.
+    """
+    try:
+        data = request.json or {}
+        project_data = data.get('projectData', {})
+        
+        companies = merge_recipients(data.get('companies'))
+        if not companies:
+            return jsonify({"success": False, "message": "Veuillez sélectionner au moins une entreprise"}), 400
+        
+        body = data.get('template') or prisme_client().local_document('lettreConsultation', project_data)
+        try:
+            template = MergeTemplate(
+                letter_template(body),
+                template_path=template_path_for(app.config['TEMPLATE_DOCS'], 'lettreConsultation')
+            )
+        except ValueError as e:
+            return jsonify({"success": False, "message": f"Modèle de lettre invalide : {e}"}), 400
+        
+    except Exception as e:
+        logger.error(f"Erreur publipostage: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e)}), 500
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    project_id = str(project_data.get('id', 'projet')).replace(' ', '_')
+    filename = secure_filename(f"LC_{project_id}_{timestamp}.zip")
+    logger.info(f"Publipostage: {len(companies)} lettres ({filename})")
+    
+    return Response(stream_zip(template, companies), mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no'
+    })
+
 # ================================================
 # ROUTES DE TÉLÉCHARGEMENT
 # ================================================
@@ -537,6 +1052,15 @@ def download_file(filename):
 # ROUTES BASE DE DONNÉES
 # ================================================
 
+def publish_panel_change():
+    """
+    Mode préfork : une modification du panel n'atteint que le worker qui l'a
+    faite. Elle est déjà enregistrée (PanelEdits, fichier partagé) : le maître
+    recharge le panel, qui la réapplique, puis remplace tous les workers
+    """
+    if PREFORK:
+        os.kill(os.getppid(), signal.SIGHUP)
+
 @app.route('/api/database/import-excel', methods=['POST'])
 def import_excel():
     """Importe des entreprises depuis Excel"""
@@ -559,30 +1083,45 @@ def import_excel():
         
         logger.info(f"Import Excel: {temp_path}")
         
-        # Charger les nouvelles entreprises
-        new_companies = load_companies_from_excel(temp_path)
+        # Charger les nouvelles entreprises (dans les processus de parsing
+        # quand ils sont démarrés, sans bloquer les autres requêtes)
+        new_companies = parse_workbook(temp_path)[0]
         
         # Supprimer le fichier temporaire
         os.remove(temp_path)
         
         if new_companies:
-            global COMPANIES
-            # Fusionner sans doublons
-            existing_names = {comp['name'].lower() for comp in COMPANIES}
-            added_count = 0
+            # Rapprocher les nouvelles entreprises du panel par son index de
+            # dédoublonnage (les entreprises déjà présentes sont prioritaires ;
+            # les homonymes d'autres départements sont signalés, pas
+            # fusionnés), puis appliquer le résultat en une fois si le panel
+            # n'a pas changé entre-temps
+            for _ in range(IMPORT_ATTEMPTS):
+                panel, version = PANEL.snapshot()
+                added, updated, removed, report, review = dedupe_new(panel, new_companies)
+                if not (added or updated or removed):
+                    break
+                new_version = PANEL.merge(added, updated, removed, version)
+                if new_version is not None:
+                    table, current = PANEL.snapshot()
+                    if current == new_version and not removed:
+                        carry_index(panel, table, [*updated, *range(len(panel), len(panel) + len(added))])
+                    publish_panel_change()
+                    break
+            else:
+                return jsonify({"success": False, "message": "Le panel a été modifié pendant l'import, veuillez réessayer"}), 409
             
-            for company in new_companies:
-                if company['name'].lower() not in existing_names:
-                    COMPANIES.append(company)
-                    added_count += 1
+            added_count = len(added)
             
-            logger.info(f"Import réussi: {added_count} nouvelles entreprises")
+            logger.info(f"Import réussi: {added_count} nouvelles entreprises, {len(report)} doublons fusionnés")
             
             return jsonify({
                 "success": True, 
                 "message": f"{added_count} nouvelles entreprises importées",
                 "imported": added_count,
-                "total": len(new_companies)
+                "total": len(new_companies),
+                "duplicates": report,
+                "toReview": review
             })
         else:
             return jsonify({"success": False, "message": "Aucune entreprise trouvée"}), 400
@@ -601,14 +1140,18 @@ def add_company():
         if not company_name:
             return jsonify({"success": False, "message": "Nom requis"}), 400
         
-        # Créer nouvelle entreprise
-        company_id = f"ENT_{str(len(COMPANIES) + 1).zfill(3)}"
+        # Créer nouvelle entreprise (identifiant stable dérivé du nom et de la localisation)
+        location = data.get('location', 'Non spécifié')
+        company_id = stable_company_id(company_name, location)
+        
+        if PANEL.find(company_id):
+            return jsonify({"success": False, "message": "Entreprise déjà présente"}), 409
         
         new_company = {
             'id': company_id,
             'name': company_name,
             'domain': data.get('domain', 'Autre'),
-            'location': data.get('location', 'Non spécifié'),
+            'location': location,
             'certifications': data.get('certifications', []),
             'ca': data.get('ca', 'Non spécifié'),
             'employees': data.get('employees', 'Non spécifié'),
@@ -618,7 +1161,8 @@ def add_company():
             'score': 0
         }
         
-        COMPANIES.append(new_company)
+        PANEL.add(new_company)
+        publish_panel_change()
         
         logger.info(f"Entreprise ajoutée: {company_name}")
         
@@ -639,14 +1183,13 @@ def update_company():
             return jsonify({"success": False, "message": "ID requis"}), 400
         
         # Trouver et mettre à jour l'entreprise
-        for i, company in enumerate(COMPANIES):
-            if company['id'] == company_id:
-                for key, value in data.items():
-                    if key != 'id':
-                        COMPANIES[i][key] = value
-                
-                logger.info(f"Entreprise mise à jour: {COMPANIES[i]['name']}")
-                return jsonify({"success": True, "data": COMPANIES[i]})
+        changes = {key: value for key, value in data.items() if key != 'id'}
+        updated_company = PANEL.update(company_id, changes)
+        
+        if updated_company:
+            publish_panel_change()
+            logger.info(f"Entreprise mise à jour: {updated_company['name']}")
+            return jsonify({"success": True, "data": updated_company})
         
         return jsonify({"success": False, "message": "Entreprise non trouvée"}), 404
         
@@ -664,11 +1207,8 @@ def delete_company():
         if not company_id:
             return jsonify({"success": False, "message": "ID requis"}), 400
         
-        global COMPANIES
-        original_count = len(COMPANIES)
-        COMPANIES = [company for company in COMPANIES if company['id'] != company_id]
-        
-        if len(COMPANIES) < original_count:
+        if PANEL.delete(company_id):
+            publish_panel_change()
             logger.info(f"Entreprise supprimée: {company_id}")
             return jsonify({"success": True, "message": "Entreprise supprimée"})
         else:
@@ -678,6 +1218,53 @@ def delete_company():
         logger.error(f"Erreur suppression: {e}")
         return jsonify({"success": False, "message": str(e)}), 500
 
+@app.route('/api/database/reload', methods=['POST'])
+def reload_database():
+    """Recharge le panel depuis les fichiers sources déclarés"""
+    try:
+        if PREFORK:
+            publish_panel_change()
+            return jsonify({"success": True, "message": "Rechargement du panel demandé"}), 202
+        
+        if SOURCE_WATCHER.reload():
+            return jsonify({
+                "success": True,
+                "message": "Panel rechargé",
+                "total": len(PANEL.companies),
+                "version": PANEL.version
+            })
+        return jsonify({"success": False, "message": "Aucune entreprise trouvée dans les sources"}), 400
+        
+    except Exception as e:
+        logger.error(f"Erreur rechargement: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+# ================================================
+# ROUTES SYSTÈME
+# ================================================
+
+@app.route('/api/system/ready', methods=['GET'])
+def get_readiness():
+    """Indique si le panel et ses index sont prêts (503 tant qu'ils ne le sont pas)"""
+    companies, version = PANEL.snapshot()
+    data = {"ready": READY.is_set(), "companies": len(companies), "version": version, "pid": os.getpid()}
+    return jsonify({"success": READY.is_set(), "data": data}), (200 if READY.is_set() else 503)
+
+@app.route('/api/system/llm-limiter', methods=['GET'])
+def get_llm_limiter_stats():
+    """Retourne l'état du limiteur d'appels LLM (file d'attente, attentes, appels mutualisés)"""
+    return jsonify({"success": True, "data": LLM_LIMITER.stats()})
+
+@app.route('/api/system/prisme-circuit', methods=['GET'])
+def get_prisme_circuit():
+    """Retourne l'état du disjoncteur de l'API Prisme (fermé, ouvert, semi-ouvert)"""
+    return jsonify({"success": True, "data": PRISME_BREAKER.stats()})
+
+@app.route('/api/system/boot-profile', methods=['GET'])
+def get_boot_profile():
+    """Retourne le profil de démarrage (imports et phases)"""
+    return jsonify({"success": True, "data": BOOT_PROFILER.report()})
+
 # ================================================
 # GESTIONNAIRE D'ERREURS
 # ================================================
@@ -695,13 +1282,21 @@ def internal_error(error):
 def too_large(error):
     return jsonify({"success": False, "error": "Fichier trop volumineux"}), 413
 
+# Fin du démarrage : journalise le profil et vérifie le budget de démarrage à froid
+BOOT_PROFILER.finish()
+
+# Serveur à un seul processus : le panel est chargé en arrière-plan (le serveur
+# répond déjà, les routes de l'API l'attendent), puis ses index construits
+if not PREFORK:
+    threading.Thread(target=load_in_background, name='panel-load', daemon=True).start()
+
 # ================================================
 # DÉMARRAGE DE L'APPLICATION
 # ================================================
 
 if __name__ == '__main__':
     logger.info("=== DÉMARRAGE DU SERVEUR ===")
-    logger.info(f"Entreprises chargées: {len(COMPANIES)}")
+    logger.info("Panel en cours de chargement (voir /api/system/ready)")
     logger.info("Serveur disponible sur: http://localhost:5001")
     logger.info("=== PRÊT ===")
     
@@ -0,0 +1,51 @@
+"""
+gunicorn.conf.py - Configuration gunicorn pour EDF Panel Entreprises
+
+    gunicorn -c gunicorn.conf.py
+
+Variables d'environnement :
+    PANEL_BIND: adresse d'écoute (défaut 0.0.0.0:5001)
+    PANEL_WORKERS: nombre de processus workers (défaut : nombre de CPU, 4 au plus)
+    PANEL_THREADS: threads par worker (défaut 4)
+    PANEL_TIMEOUT: délai maximal d'une requête en secondes (défaut 120, appels IA)
+"""
+
+import os
+import signal
+import multiprocessing
+
+# Lu par app.py à l'import : chargement dans le maître (when_ready), threads démarrés après le fork
+os.environ.setdefault('PANEL_SERVER_MODE', 'prefork')
+
+wsgi_app = 'wsgi:application'
+bind = os.environ.get('PANEL_BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('PANEL_WORKERS', min(multiprocessing.cpu_count(), 4)))
+threads = int(os.environ.get('PANEL_THREADS', '4'))
+worker_class = 'gthread'
+timeout = int(os.environ.get('PANEL_TIMEOUT', '120'))
+
+# Panel, caches et index chargés une fois dans le maître et partagés par fork
+preload_app = True
+
+# Maître sans thread (gunicorn >= 26 y démarre sinon le serveur du socket de
+# contrôle) : il peut forker les processus de parsing des classeurs (voir
+# utils/ingest.py) ; les rechargements passent par SIGHUP
+control_socket_disable = True
+
+
+def when_ready(server):
+    # Sockets ouverts, workers pas encore forkés : le panel est chargé dans le
+    # maître (les connexions attendent dans la file du socket)
+    from wsgi import prepare_master
+    prepare_master()
+    # Les sources sont surveillées par le maître seul : une modification lui
+    # envoie SIGHUP (voir on_reload)
+    from app import watch_sources_in_master
+    watch_sources_in_master(lambda: os.kill(server.pid, signal.SIGHUP))
+
+
+def on_reload(server):
+    # SIGHUP : le maître recharge le panel, puis gunicorn forke de nouveaux
+    # workers et arrête les anciens une fois leurs requêtes terminées
+    from wsgi import reload_panel
+    reload_panel()
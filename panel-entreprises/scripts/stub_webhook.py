@@ -0,0 +1,97 @@
+"""
+stub_webhook.py - Local stand-in for the Prisme webhook for EDF Panel Entreprises
+
+Answers the POST requests of utils.mistral_api like the production webhook
+({"answer": "..."}), after an optional delay, so that the LLM routes can be
+exercised (and loaded with many concurrent calls) without the real service:
+
+    python scripts/stub_webhook.py --port 8765 --delay 2
+    PRISME_API_URL=http://127.0.0.1:8765/query python app.py
+"""
+
+import re
+import json
+import time
+import argparse
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_ANSWER = {
+    "keywords": ["maintenance", "échangeurs", "nettoyage", "CNPE", "nucléaire"],
+    "selectionCriteria": [
+        {"id": 1, "name": "Certification MASE", "description": "L'entreprise doit être certifiée MASE", "selected": True},
+        {"id": 2, "name": "Expérience similaire", "description": "Références sur des prestations similaires", "selected": True},
+        {"id": 3, "name": "Zone d'intervention", "description": "Intervention sur le CNPE de Chooz (Ardennes)", "selected": True}
+    ],
+    "attributionCriteria": [
+        {"id": 1, "name": "Prix", "weight": 40},
+        {"id": 2, "name": "Valeur technique", "weight": 45},
+        {"id": 3, "name": "Délais", "weight": 15}
+    ]
+}
+
+
+# Documents requested by a pack prompt ("- projetMarche : un projet de marché")
+_PACK_DOCUMENT = re.compile(r'^- (\w+) : ', re.MULTILINE)
+
+
+class StubWebhookServer(ThreadingHTTPServer):
+    # Accept bursts of concurrent calls (the default backlog is 5)
+    request_queue_size = 512
+    daemon_threads = True
+
+
+class StubWebhookHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_error(400, "Invalid JSON")
+            return
+
+        if self.delay:
+            time.sleep(self.delay)
+
+        prompt = payload.get('text', '')
+        if 'format JSON' in prompt:
+            answer = json.dumps(ANALYSIS_ANSWER, ensure_ascii=False)
+        elif '=== DOCUMENT:' in prompt:
+            answer = "\n\n".join(
+                f"=== DOCUMENT: {template_type} ===\nDocument {template_type} généré par le webhook de test."
+                for template_type in _PACK_DOCUMENT.findall(prompt)
+            )
+        else:
+            answer = f"Document généré par le webhook de test.\n\n{prompt[:500]}"
+
+        body = json.dumps({"answer": answer}, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub Prisme webhook")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.0, help="seconds to wait before answering")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    StubWebhookHandler.delay = args.delay
+    server = StubWebhookServer((args.host, args.port), StubWebhookHandler)
+    logger.info("Stub webhook on http://%s:%d/query (delay %.1fs)", args.host, args.port, args.delay)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
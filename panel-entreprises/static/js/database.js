@@ -7,6 +7,8 @@ let allCompanies = [];
 let filteredCompanies = [];
 let currentPage = 1;
 const itemsPerPage = 20;
+// Requête de filtrage en cours, annulée par la suivante
+let filterController = null;
 
 document.addEventListener('DOMContentLoaded', function() {
     console.log("=== INITIALISATION DATABASE.JS ===");
@@ -187,18 +189,65 @@ function initModalEventListeners() {
 /**
  * Filtre les entreprises selon les critères
  */
-function filterCompanies() {
-    const searchTerm = document.getElementById('company-search')?.value.toLowerCase() || '';
+async function filterCompanies() {
+    const searchTerm = document.getElementById('company-search')?.value.trim() || '';
     const domainFilter = document.getElementById('domain-filter')?.value || '';
     const certificationFilter = document.getElementById('certification-filter')?.value || '';
     
     console.log("Filtrage:", { searchTerm, domainFilter, certificationFilter });
     
-    filteredCompanies = allCompanies.filter(company => {
+    // Une réponse arrivée après celle d'un filtrage plus récent ne doit pas
+    // l'écraser : la requête précédente est annulée
+    if (filterController) {
+        filterController.abort();
+    }
+    const controller = new AbortController();
+    filterController = controller;
+    
+    if (!searchTerm && !domainFilter && !certificationFilter) {
+        filteredCompanies = [...allCompanies];
+    } else {
+        // Filtrage côté serveur (index des certifications), seuls les identifiants reviennent
+        const params = new URLSearchParams();
+        if (searchTerm) params.set('q', searchTerm);
+        if (domainFilter) params.set('domain', domainFilter);
+        if (certificationFilter) params.set('certification', certificationFilter);
+        
+        try {
+            const response = await fetch(`/api/companies/filter?${params}`, { signal: controller.signal });
+            const data = await response.json();
+            
+            if (!data.success) {
+                throw new Error(data.error || 'Erreur de filtrage');
+            }
+            
+            const matchingIds = new Set(data.data);
+            filteredCompanies = allCompanies.filter(company => matchingIds.has(company.id));
+        } catch (error) {
+            if (controller.signal.aborted) {
+                return;
+            }
+            console.error('Erreur filtrage serveur, filtrage local:', error);
+            filteredCompanies = filterCompaniesLocally(searchTerm.toLowerCase(), domainFilter, certificationFilter);
+        }
+    }
+    
+    console.log(`Filtrage: ${filteredCompanies.length}/${allCompanies.length} entreprises`);
+    
+    currentPage = 1;
+    renderCompanies();
+    updatePaginationInfo();
+}
+
+/**
+ * Filtre local, utilisé si l'API de filtrage ne répond pas
+ */
+function filterCompaniesLocally(searchTerm, domainFilter, certificationFilter) {
+    return allCompanies.filter(company => {
         // Filtre de recherche
         const matchesSearch = !searchTerm || 
             company.name.toLowerCase().includes(searchTerm) ||
-            company.location.toLowerCase().includes(searchTerm) ||
+            (company.location && company.location.toLowerCase().includes(searchTerm)) ||
             (company.domain && company.domain.toLowerCase().includes(searchTerm));
         
         // Filtre de domaine
@@ -210,12 +259,6 @@ function filterCompanies() {
         
         return matchesSearch && matchesDomain && matchesCertification;
     });
-    
-    console.log(`Filtrage: ${filteredCompanies.length}/${allCompanies.length} entreprises`);
-    
-    currentPage = 1;
-    renderCompanies();
-    updatePaginationInfo();
 }
 
 /**
@@ -12,6 +12,12 @@ document.addEventListener('DOMContentLoaded', function() {
         attributionCriteria: [],
         matchedCompanies: [],
         selectedCompanies: [],
+        searchId: null,  // Session de recherche côté serveur (scores par critère réutilisés)
+        isProvisional: false,  // Résultats partiels reçus pendant le scoring en flux
+        companyDetails: {},  // Détail complet des entreprises, chargé à l'ouverture du modal
+        analysisId: null,  // Analyse à deux niveaux : critères locaux, puis affinés par l'IA
+        analysisPending: false,  // Affinage par l'IA en cours
+        criteriaEdited: false,  // Critères modifiés par l'utilisateur (l'affinage ne les écrase pas)
         projectData: {
             title: '',
             description: ''
@@ -168,8 +174,12 @@ document.addEventListener('DOMContentLoaded', function() {
 
             console.log("Analyse IA réussie");
             state.keywords = analysisResult.data.keywords || [];
+            state.searchId = null;  // Nouveau document : nouvelle session de recherche
             state.selectionCriteria = analysisResult.data.selectionCriteria || [];
             state.attributionCriteria = analysisResult.data.attributionCriteria || [];
+            state.analysisId = analysisResult.analysisId || null;
+            state.analysisPending = analysisResult.status === 'pending';
+            state.criteriaEdited = false;
 
             console.log("Résultats:", {
                 keywords: state.keywords.length,
@@ -177,9 +187,17 @@ document.addEventListener('DOMContentLoaded', function() {
                 attributionCriteria: state.attributionCriteria.length
             });
 
+            if (analysisResult.degraded) {
+                showAlert('warning', "Service IA indisponible : critères proposés par l'analyse locale, à vérifier.");
+            }
+
             // 3. Passer à l'étape suivante
             goToStep(2);
 
+            if (state.analysisPending) {
+                followAnalysis(state.analysisId);
+            }
+
         } catch (error) {
             console.error("Erreur traitement:", error);
             showErrorInDropzone(error.message);
@@ -221,7 +239,8 @@ document.addEventListener('DOMContentLoaded', function() {
                     'Content-Type': 'application/json'
                 },
                 body: JSON.stringify({ 
-                    documentText: state.cahierDesChargesText 
+                    documentText: state.cahierDesChargesText,
+                    mode: 'tiered'
                 })
             });
 
@@ -239,6 +258,64 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    async function followAnalysis(analysisId) {
+        // Les critères locaux sont affichés : le résultat de l'IA est
+        // appliqué dès qu'il arrive
+        let job = null;
+        try {
+            const response = await fetch(`/api/ia/analysis/${analysisId}/stream`);
+            if (!response.ok) {
+                throw new Error(`Erreur HTTP: ${response.status}`);
+            }
+
+            await readEventStream(response, (event, payload) => {
+                if (event === 'result') {
+                    job = payload;
+                }
+            });
+        } catch (error) {
+            console.error("Erreur suivi analyse:", error);
+        }
+
+        if (analysisId !== state.analysisId) {
+            return;  // Un autre document a été chargé entre-temps
+        }
+        state.analysisPending = false;
+        if (job) {
+            applyRefinedAnalysis(job);
+            return;
+        }
+        // Analyse introuvable ou suivi interrompu : les critères locaux restent
+        showAlert('warning', "Affinage par l'IA indisponible : critères proposés par l'analyse locale, à vérifier.");
+        if (state.currentStep === 2) {
+            renderStepContent(2);
+        }
+    }
+
+    function applyRefinedAnalysis(job) {
+        if (job.tier !== 'llm') {
+            if (job.degraded) {
+                showAlert('warning', "Service IA indisponible : critères proposés par l'analyse locale, à vérifier.");
+            }
+            if (state.currentStep === 2) {
+                renderStepContent(2);
+            }
+            return;
+        }
+
+        if (state.currentStep !== 2 || state.criteriaEdited) {
+            showAlert('info', "Analyse IA terminée : les critères déjà modifiés ou utilisés sont conservés.");
+            return;
+        }
+
+        state.keywords = job.data.keywords || [];
+        state.selectionCriteria = job.data.selectionCriteria || [];
+        state.attributionCriteria = job.data.attributionCriteria || [];
+        state.searchId = null;
+        renderStepContent(2);
+        showAlert('success', "Critères affinés par l'analyse IA");
+    }
+
     function showErrorInDropzone(errorMessage) {
         fileDropzone.innerHTML = `
             <div class="dropzone-content error">
@@ -337,6 +414,7 @@ document.addEventListener('DOMContentLoaded', function() {
     function renderStep2Content(panel) {
         panel.innerHTML = `
             <h2>2. Critères extraits par l'IA</h2>
+            ${state.analysisPending ? '<p class="provisional-results">Critères issus de l\'analyse locale, affinage par l\'IA en cours...</p>' : ''}
             
             <div class="keywords-section">
                 <h3>Mots-clés identifiés</h3>
@@ -432,6 +510,7 @@ document.addEventListener('DOMContentLoaded', function() {
         }
 
         state.isProcessing = true;
+        state.companyDetails = {};
         
         try {
             // Afficher le chargement
@@ -441,14 +520,17 @@ document.addEventListener('DOMContentLoaded', function() {
             const selectedCriteria = state.selectionCriteria.filter(c => c.selected);
             console.log("Critères sélectionnés:", selectedCriteria);
 
-            // Appeler l'API
-            const response = await fetch('/api/ia/find-matching-companies', {
+            // Appeler l'API en flux : les résultats provisoires sont affichés
+            // pendant le scoring, la liste finale les remplace
+            const response = await fetch('/api/ia/find-matching-companies/stream', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream'
                 },
                 body: JSON.stringify({
-                    criteria: selectedCriteria
+                    criteria: selectedCriteria,
+                    searchId: state.searchId
                 })
             });
 
@@ -456,26 +538,32 @@ document.addEventListener('DOMContentLoaded', function() {
                 throw new Error(`Erreur HTTP: ${response.status}`);
             }
 
-            const data = await response.json();
+            let data = null;
+            await readEventStream(response, (event, payload) => {
+                if (event === 'progress') {
+                    showMatchedCompanies(payload.data || [], true);
+                } else if (event === 'result' || event === 'error') {
+                    data = payload;
+                }
+            });
+
+            if (!data) {
+                throw new Error('Réponse de recherche incomplète');
+            }
 
             if (!data.success) {
-                throw new Error(data.message || 'Erreur lors de la recherche');
+                throw new Error(data.message || data.error || 'Erreur lors de la recherche');
             }
 
             // Stocker les résultats
-            state.matchedCompanies = data.data || [];
-            state.selectedCompanies = state.matchedCompanies.map(company => ({
-                ...company,
-                selected: true
-            }));
+            state.searchId = data.searchId || state.searchId;
+            showMatchedCompanies(data.data || [], false);
 
             console.log(`${state.matchedCompanies.length} entreprises trouvées`);
 
-            // Passer à l'étape suivante
-            goToStep(3);
-
         } catch (error) {
             console.error("Erreur recherche:", error);
+            state.isProvisional = false;
             showAlert('error', error.message);
         } finally {
             hideLoading();
@@ -483,6 +571,61 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    function showMatchedCompanies(companies, provisional) {
+        state.matchedCompanies = companies;
+        state.selectedCompanies = state.matchedCompanies.map(company => ({
+            ...company,
+            selected: true
+        }));
+        state.isProvisional = provisional;
+
+        if (provisional) {
+            // Premier résultat reçu : on quitte l'écran de chargement
+            hideLoading();
+        }
+        if (state.currentStep === 3) {
+            renderStepContent(3);
+        } else if (state.currentStep < 3) {
+            goToStep(3);
+        }
+    }
+
+    async function readEventStream(response, onEvent) {
+        // Lecture d'un flux text/event-stream (EventSource ne permet pas le POST)
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (value) {
+                buffer += decoder.decode(value, { stream: true });
+            }
+
+            let separator;
+            while ((separator = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, separator);
+                buffer = buffer.slice(separator + 2);
+
+                let event = 'message';
+                const dataLines = [];
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        event = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        dataLines.push(line.slice(5).trimStart());
+                    }
+                });
+                if (dataLines.length) {
+                    onEvent(event, JSON.parse(dataLines.join('\n')));
+                }
+            }
+
+            if (done) {
+                break;
+            }
+        }
+    }
     function renderStep3Content(panel) {
         panel.innerHTML = `
             <h2>3. Entreprises correspondantes</h2>
@@ -490,6 +633,7 @@ document.addEventListener('DOMContentLoaded', function() {
             <div class="companies-result">
                 <h3>Résultats de la recherche</h3>
                 <p>L'IA a identifié ${state.matchedCompanies.length} entreprises correspondant à vos critères :</p>
+                ${state.isProvisional ? '<p class="provisional-results">Résultats provisoires, recherche en cours...</p>' : ''}
                 
                 <div class="companies-list">
                     ${renderCompaniesTable()}
@@ -657,6 +801,9 @@ document.addEventListener('DOMContentLoaded', function() {
                     <button class="button primary" onclick="window.searchApp.generateDocuments()">
                         Générer les documents
                     </button>
+                    <button class="button secondary" onclick="window.searchApp.mailMergeLetters()">
+                        Lettres personnalisées (ZIP)
+                    </button>
                 </div>
                 
                 <div class="generated-documents" style="display: none;" id="generated-docs">
@@ -706,47 +853,50 @@ document.addEventListener('DOMContentLoaded', function() {
             // Afficher l'indicateur de chargement
             showLoading('Génération des documents en cours...');
 
-            // Générer chaque document
-            const generatedDocs = [];
-
-            for (const docType of selectedDocTypes) {
-                try {
-                    const response = await fetch('/api/documents/generate', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json'
+            // Générer tous les documents en un seul appel : le contexte du
+            // projet est partagé par les documents du pack
+            let generatedDocs = [];
+
+            try {
+                const response = await fetch('/api/documents/generate-pack', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({
+                        templateTypes: selectedDocTypes,
+                        projectData: {
+                            ...state.projectData,
+                            id: 'P' + Date.now(),
+                            selectionCriteria: state.selectionCriteria,
+                            attributionCriteria: state.attributionCriteria,
+                            cahierDesCharges: state.cahierDesChargesText
                         },
-                        body: JSON.stringify({
-                            templateType: docType,
-                            projectData: {
-                                ...state.projectData,
-                                id: 'P' + Date.now(),
-                                selectionCriteria: state.selectionCriteria,
-                                attributionCriteria: state.attributionCriteria,
-                                cahierDesCharges: state.cahierDesChargesText
-                            },
-                            companies: selectedCompanies
-                        })
-                    });
-
-                    if (response.ok) {
-                        const data = await response.json();
-                        if (data.success) {
-                            generatedDocs.push({
-                                type: docType,
-                                ...data.data
-                            });
-                        }
+                        companies: selectedCompanies
+                    })
+                });
+
+                if (response.ok) {
+                    const data = await response.json();
+                    if (data.success) {
+                        generatedDocs = (data.data || []).map(doc => ({
+                            ...doc,
+                            type: doc.templateType,
+                            degraded: Boolean(data.degraded)
+                        }));
                     }
-                } catch (error) {
-                    console.error(`Erreur génération ${docType}:`, error);
                 }
+            } catch (error) {
+                console.error('Erreur génération pack:', error);
             }
 
             // Afficher les documents générés
             if (generatedDocs.length > 0) {
                 displayGeneratedDocuments(generatedDocs);
                 showAlert('success', `${generatedDocs.length} document(s) généré(s) avec succès`);
+                if (generatedDocs.some(doc => doc.degraded)) {
+                    showAlert('warning', 'Service IA indisponible : document(s) générés à partir des modèles locaux.');
+                }
             } else {
                 showAlert('error', 'Aucun document n\'a pu être généré.');
             }
@@ -760,6 +910,66 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // Publipostage : une lettre de consultation par entreprise sélectionnée,
+    // rendue côté serveur sans appel à l'IA et reçue en archive ZIP
+    async function mailMergeLetters() {
+        if (state.isProcessing) {
+            showAlert('warning', 'Génération déjà en cours...');
+            return;
+        }
+
+        const selectedCompanies = state.selectedCompanies.filter(company => company.selected);
+        if (selectedCompanies.length === 0) {
+            showAlert('warning', 'Veuillez sélectionner au moins une entreprise.');
+            return;
+        }
+
+        state.isProcessing = true;
+        showLoading(`Publipostage de ${selectedCompanies.length} lettre(s) en cours...`);
+
+        try {
+            const response = await fetch('/api/documents/mail-merge', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    projectData: {
+                        ...state.projectData,
+                        id: 'P' + Date.now(),
+                        attributionCriteria: state.attributionCriteria
+                    },
+                    companies: selectedCompanies.map(company => ({ id: company.id, name: company.name }))
+                })
+            });
+
+            if (!response.ok) {
+                const data = await response.json().catch(() => ({}));
+                throw new Error(data.message || data.error || `Erreur HTTP: ${response.status}`);
+            }
+
+            // Nom de l'archive donné par le serveur
+            const disposition = response.headers.get('Content-Disposition') || '';
+            const match = disposition.match(/filename="([^"]+)"/);
+            const url = URL.createObjectURL(await response.blob());
+            const link = document.createElement('a');
+            link.href = url;
+            link.download = match ? match[1] : 'lettres_consultation.zip';
+            document.body.appendChild(link);
+            link.click();
+            link.remove();
+            setTimeout(() => URL.revokeObjectURL(url), 1000);
+
+            showAlert('success', `${selectedCompanies.length} lettre(s) personnalisée(s) générée(s)`);
+        } catch (error) {
+            console.error('Erreur publipostage:', error);
+            showAlert('error', `Erreur: ${error.message}`);
+        } finally {
+            hideLoading();
+            state.isProcessing = false;
+        }
+    }
+
     function displayGeneratedDocuments(documents) {
         const container = document.getElementById('generated-docs');
         const list = document.getElementById('documents-list');
@@ -797,15 +1007,42 @@ document.addEventListener('DOMContentLoaded', function() {
         container.scrollIntoView({ behavior: 'smooth' });
     }
 
+    // Détail complet d'une entreprise : les résultats de matching n'en
+    // contiennent qu'un résumé
+    async function fetchCompanyDetails(companyId) {
+        if (!state.companyDetails[companyId]) {
+            const response = await fetch(`/api/companies/${encodeURIComponent(companyId)}`);
+            const data = await response.json();
+            if (!response.ok || !data.success) {
+                throw new Error(data.message || `Erreur HTTP: ${response.status}`);
+            }
+            state.companyDetails[companyId] = data.data;
+        }
+        return state.companyDetails[companyId];
+    }
+
     // Fonction pour voir les détails d'une entreprise
-    function viewCompanyDetails(companyId) {
-        const company = state.matchedCompanies.find(c => c.id === companyId);
+    async function viewCompanyDetails(companyId) {
+        const match = state.matchedCompanies.find(c => c.id === companyId);
         
-        if (!company) {
+        if (!match) {
             showAlert('error', 'Entreprise non trouvée');
             return;
         }
         
+        let company = match;
+        try {
+            // Les scores restent ceux du résultat de matching
+            company = {
+                ...(await fetchCompanyDetails(companyId)),
+                score: match.score,
+                matchDetails: match.matchDetails,
+                selected: match.selected
+            };
+        } catch (error) {
+            console.error("Erreur chargement détail entreprise:", error);
+        }
+        
         // Créer un modal pour afficher les détails
         const modal = document.createElement('div');
         modal.className = 'modal';
@@ -1008,12 +1245,14 @@ document.addEventListener('DOMContentLoaded', function() {
         findMatchingCompanies: findMatchingCompanies,
         
         toggleSelectionCriterion: function(id, checked) {
+            state.criteriaEdited = true;
             state.selectionCriteria = state.selectionCriteria.map(criterion => 
                 criterion.id == id ? { ...criterion, selected: checked } : criterion
             );
         },
         
         updateAttributionWeight: function(id, weight) {
+            state.criteriaEdited = true;
             state.attributionCriteria = state.attributionCriteria.map(criterion => 
                 criterion.id == id ? { ...criterion, weight: parseInt(weight) } : criterion
             );
@@ -1042,6 +1281,7 @@ document.addEventListener('DOMContentLoaded', function() {
         },
         
         generateDocuments: generateDocuments,
+        mailMergeLetters: mailMergeLetters,
         viewCompanyDetails: viewCompanyDetails,
         addCompanyManually: addCompanyManually,
         saveManualCompany: saveManualCompany
@@ -0,0 +1,147 @@
+"""
+test_circuit_breaker.py - Tests of the Prisme circuit breaker for EDF Panel Entreprises
+
+The breaker runs on a fake clock: transitions are checked without waiting.
+
+    python -m unittest discover -s tests
+"""
+
+import unittest
+from unittest import mock
+
+from utils import circuit_breaker
+from utils.circuit_breaker import CircuitBreaker, CircuitOpen, CLOSED, OPEN, HALF_OPEN, failed_status
+
+
+class FakeClock:
+    """Stands for the time module of utils.circuit_breaker"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class Cancelled(BaseException):
+    pass
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(circuit_breaker, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('test', window_seconds=60, min_calls=4, failure_rate=0.5,
+                                      open_seconds=30, probes=1)
+
+    def successful_attempt(self):
+        with self.breaker.attempt():
+            pass
+
+    def failing_attempt(self):
+        with self.assertRaises(ConnectionError):
+            with self.breaker.attempt():
+                raise ConnectionError("timeout")
+
+    def open_circuit(self):
+        for _ in range(4):
+            self.failing_attempt()
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_opens_at_the_failure_rate_once_min_calls_are_reached(self):
+        for _ in range(3):
+            self.failing_attempt()
+        # Fewer than min_calls attempts: still closed
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.failing_attempt()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.stats()['opened'], 1)
+
+    def test_stays_closed_below_the_failure_rate(self):
+        for _ in range(3):
+            self.successful_attempt()
+        self.failing_attempt()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.failing_attempt()
+        # 2 failures out of 5 attempts
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.failing_attempt()
+        # 3 out of 6: at the rate
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_failed_answers_count_as_failures(self):
+        for _ in range(4):
+            with self.breaker.attempt() as attempt:
+                attempt.failed = failed_status(503)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertTrue(failed_status(429))
+        self.assertFalse(failed_status(404))
+
+    def test_outcomes_leave_the_window(self):
+        for _ in range(3):
+            self.failing_attempt()
+        self.clock.now += 61
+        self.failing_attempt()
+        stats = self.breaker.stats()
+        self.assertEqual((stats['state'], stats['windowCalls'], stats['windowFailures']), (CLOSED, 1, 1))
+
+    def test_open_circuit_refuses_attempts_at_once(self):
+        self.open_circuit()
+        self.assertTrue(self.breaker.rejects())
+        with self.assertRaises(CircuitOpen):
+            with self.breaker.attempt():
+                self.fail("attempt ran while open")
+        self.assertTrue(self.breaker.rejects(count=True))
+        self.assertEqual(self.breaker.stats()['shortCircuited'], 2)
+
+    def test_half_open_probe_success_closes(self):
+        self.open_circuit()
+        self.clock.now += 30
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        with self.breaker.attempt():
+            # A single probe at a time
+            self.assertTrue(self.breaker.rejects())
+            with self.assertRaises(CircuitOpen):
+                with self.breaker.attempt():
+                    pass
+        self.assertEqual(self.breaker.state, CLOSED)
+        stats = self.breaker.stats()
+        self.assertEqual((stats['probes'], stats['windowCalls']), (1, 0))
+
+    def test_half_open_probe_failure_opens_again(self):
+        self.open_circuit()
+        self.clock.now += 30
+        self.failing_attempt()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.stats()['opened'], 2)
+        self.clock.now += 29
+        self.assertTrue(self.breaker.rejects())
+        self.clock.now += 1
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+
+    def test_abandoned_probe_frees_its_slot(self):
+        self.open_circuit()
+        self.clock.now += 30
+        with self.assertRaises(Cancelled):
+            with self.breaker.attempt():
+                raise Cancelled()
+        # Neither a success nor a failure: still half-open, probe available
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.rejects())
+        self.successful_attempt()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_attempt_started_before_opening_is_ignored(self):
+        late = self.breaker.attempt()
+        late.__enter__()
+        self.open_circuit()
+        late.__exit__(None, None, None)
+        stats = self.breaker.stats()
+        self.assertEqual((stats['state'], stats['opened'], stats['windowCalls']), (OPEN, 1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
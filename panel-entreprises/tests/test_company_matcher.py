@@ -0,0 +1,204 @@
+"""
+test_company_matcher.py - Differential tests of the pruned matching for EDF Panel Entreprises
+
+match_companies only scores the companies that can still be returned
+(rank_candidates); on random panels and criteria, its result must be the one
+a brute force gets by scoring every company on every criterion.
+
+    python -m unittest discover -s tests
+"""
+
+import random
+import logging
+import unittest
+
+from utils.company_matcher import (
+    analyze_criteria_types, company_groups, compute_bonus_vector, compute_criterion_vector, filter_and_sort_matches,
+    get_criterion_weight, match_companies, match_entry, rank_candidates, score_row, upper_score,
+    UNSCORED
+)
+from utils.company_table import CompanyTable
+from utils.excel_parser import enrich_company_data, stable_company_id
+from utils.tracing import span
+
+CASES = 120
+
+CRITERIA = [
+    {'name': 'Certification MASE', 'description': 'MASE requise'},
+    {'name': 'Certification ISO 9001', 'description': 'Système qualité ISO 9001'},
+    {'name': "Zone d'intervention", 'description': 'Intervention à moins de 150 km du CNPE de Chooz'},
+    {'name': 'Localisation', 'description': 'Grand Est, Ardennes'},
+    {'name': 'Expérience similaire', 'description': 'maintenance des échangeurs, nettoyage industriel'},
+    {'name': 'Compétence technique', 'description': 'soudure, tuyauterie et robinetterie'},
+    {'name': 'Capacité', 'description': 'effectif minimum 20 salariés'},
+    {'name': 'Domaine', 'description': 'génie civil et bâtiment'},
+    {'name': 'Sécurité', 'description': 'habilitation nucléaire et radioprotection'},
+    # Few companies score well: failed companies (fallback 50) reach the top
+    {'name': 'Certification CEFRI', 'description': 'CEFRI exigée'},
+    {'name': 'Proximité', 'description': 'Intervention à moins de 20 km de Marseille'},
+]
+
+NAMES = ['Ardennes', 'Meuse', 'Tech', 'Industrie', 'Services', 'Maintenance', 'Hydro', 'Élec', 'Bâti', 'Nord']
+LOCATIONS = ['Charleville-Mézières (08)', 'Givet (08)', 'Reims (51)', 'Nancy (54)', 'Lyon (69)',
+             'Paris (75)', 'Bordeaux (33)', 'Marseille (13)', 'Non spécifié']
+DOMAINS = ['Électricité', 'Mécanique', 'Hydraulique', 'Bâtiment', 'Maintenance', 'Autre']
+CERTIFICATIONS = ['MASE', 'ISO 9001', 'ISO 14001', 'CEFRI', 'Qualibat', 'RGE']
+WORDS = ['maintenance', 'échangeurs', 'nettoyage', 'soudure', 'tuyauterie', 'robinetterie', 'génie civil',
+         'câblage', 'nucléaire', 'radioprotection', 'usinage', 'pompes', 'CNPE', 'industriel']
+
+
+def random_company(rng):
+    name = f"{rng.choice(NAMES)} {rng.choice(NAMES)} {rng.choice(['SAS', 'SARL', 'SA'])}"
+    location = rng.choice(LOCATIONS)
+    company = {
+        'id': stable_company_id(name, location),
+        'name': name,
+        'domain': rng.choice(DOMAINS),
+        'location': location,
+        'certifications': rng.sample(CERTIFICATIONS, rng.randint(0, 3)),
+        'ca': rng.choice(['800 k€', '1,5 M€', '12 M€', 'Non spécifié']),
+        'employees': rng.choice(['8', '25', '120', 'Non spécifié']),
+        'contact': {'email': '', 'phone': ''},
+        'experience': ' '.join(rng.sample(WORDS, rng.randint(0, 5))) or 'Non spécifié',
+        'lots_marches': [{'description': ' '.join(rng.sample(WORDS, 3))} for _ in range(rng.randint(0, 2))],
+        'capabilities': rng.sample(WORDS, rng.randint(0, 3)),
+        'score': 0
+    }
+    return company
+
+
+def random_panel(rng, size):
+    companies = [random_company(rng) for _ in range(size)]
+    enrich_company_data(companies)
+    for company in companies:
+        if rng.random() < 0.08:
+            # Malformed value: scoring (or its bound) fails and the company
+            # gets the fallback 50
+            company[rng.choice(['certifications', 'experience', 'capabilities', 'lots_marches'])] = 7
+    return companies
+
+
+def random_criteria(rng):
+    criteria = []
+    for index, criterion in enumerate(rng.sample(CRITERIA, rng.randint(1, 5)), 1):
+        criterion = {'id': index, **criterion}
+        if rng.random() < 0.5:
+            # Fractional weights: totals carry float error (see upper_score)
+            criterion['weight'] = rng.choice([0, 0.1, 0.2, 0.3, 1, 7, 15])
+        criteria.append(criterion)
+    if rng.random() < 0.3:
+        criteria.append({'id': 99, 'name': 'Domaine', 'description': 'électricité', 'selected': False})
+    return criteria
+
+
+def brute_force(companies, criteria):
+    """Final score and criterion scores of every company, every criterion evaluated"""
+    selected = [criterion for criterion in criteria if criterion.get('selected', True)]
+    criteria_types = analyze_criteria_types(selected)
+    weights = [get_criterion_weight(criterion, criteria_types) for criterion in selected]
+    weights_sum = 0
+    for weight in weights:
+        weights_sum += weight
+    vectors = [compute_criterion_vector(companies, criterion, criteria_types) for criterion in selected]
+    bonuses = compute_bonus_vector(companies)
+    return [score_row(row, selected, weights, vectors, weights_sum, bonuses) for row in range(len(companies))]
+
+
+def brute_force_matches(companies, criteria, max_results, min_score):
+    scored = brute_force(companies, criteria)
+    matches = [match_entry(companies[row], final_score, company_scores)
+               for row, (final_score, company_scores) in enumerate(scored) if final_score >= min_score]
+    return filter_and_sort_matches(matches, min_score, max_results)
+
+
+class MatchCompaniesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.disable(logging.CRITICAL)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+
+    def test_pruned_matching_equals_brute_force(self):
+        rng = random.Random(2025)
+        for case in range(CASES):
+            companies = random_panel(rng, rng.randint(1, 150))
+            if rng.random() < 0.5:
+                # Tables score certification and radius criteria from their indexes
+                companies = CompanyTable.from_companies(companies)
+            criteria = random_criteria(rng)
+            max_results = rng.choice([1, 2, 3, 5, 10])
+            min_score = rng.choice([0, 40, 50, 60, 70])
+
+            self.assertEqual(match_companies(companies, criteria, max_results, min_score),
+                             brute_force_matches(companies, criteria, max_results, min_score),
+                             f"case {case}: {criteria} max_results={max_results} min_score={min_score}")
+
+    def test_rank_candidates_keeps_every_returnable_company(self):
+        # Every qualified company in the top 2 * max_results (ties included)
+        # or best of its (domain, zone) group must be kept by the pruning
+        rng = random.Random(2026)
+        for case in range(CASES):
+            companies = random_panel(rng, rng.randint(1, 150))
+            criteria = [criterion for criterion in random_criteria(rng) if criterion.get('selected', True)]
+            max_results = rng.choice([1, 2, 3, 5])
+            min_score = rng.choice([0, 40, 50, 60, 70])
+            scores = [final_score for final_score, _ in brute_force(companies, criteria)]
+
+            criteria_types = analyze_criteria_types(criteria)
+            weights = [get_criterion_weight(criterion, criteria_types) for criterion in criteria]
+            weights_sum = 0
+            for weight in weights:
+                weights_sum += weight
+            vectors = [[UNSCORED] * len(companies) for _ in criteria]
+            keys = [('test', case, index) for index in range(len(criteria))]
+            score_vectors = {}
+            with span('test') as trace:
+                rows = rank_candidates(companies, criteria, criteria_types, weights, vectors, keys, weights_sum,
+                                       compute_bonus_vector(companies), min_score, max_results, score_vectors,
+                                       trace)
+
+            qualified = sorted((row for row in range(len(companies)) if scores[row] >= min_score),
+                               key=lambda row: -scores[row])
+            needed = set()
+            if qualified:
+                kth = scores[qualified[min(2 * max_results, len(qualified)) - 1]]
+                needed = {row for row in qualified if scores[row] >= kth}
+                groups = company_groups(companies, score_vectors)
+                group_best = {}
+                for row in qualified:
+                    group_best[groups[row]] = max(group_best.get(groups[row], -1), scores[row])
+                needed |= {row for row in qualified if scores[row] == group_best[groups[row]]}
+
+            self.assertLessEqual(needed, set(rows), f"case {case}: {criteria} max_results={max_results} "
+                                                    f"min_score={min_score}")
+            for row in rows:
+                self.assertNotIn(UNSCORED, [vector[row] for vector in vectors], f"case {case}: row {row} unscored")
+
+
+class UpperScoreTest(unittest.TestCase):
+
+    def test_bounds_the_rounded_final_score(self):
+        rng = random.Random(7)
+        for _ in range(2000):
+            weights = [rng.choice([0.1, 0.2, 0.3, 1, 7, 15]) for _ in range(rng.randint(1, 5))]
+            scores = [rng.choice([0, 10, 30, 50, 55, 70, 85, 100]) for _ in weights]
+            total = 0
+            weights_sum = 0
+            for weight, score in zip(weights, scores):
+                total += score * weight
+                weights_sum += weight
+            # rank_candidates adds the same terms in another order: the
+            # totals may differ by float error
+            bound_total = 0
+            for weight, score in sorted(zip(weights, scores), key=lambda item: rng.random()):
+                bound_total += weight * score
+            bonus = rng.randint(0, 15)
+            self.assertGreaterEqual(upper_score(bound_total, weights_sum, bonus),
+                                    min(100, round(total / weights_sum) + bonus))
+
+
+if __name__ == '__main__':
+    unittest.main()
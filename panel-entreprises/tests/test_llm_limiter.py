@@ -0,0 +1,218 @@
+"""
+test_llm_limiter.py - Tests of the LLM bulkhead and single flight for EDF Panel Entreprises
+
+    python -m unittest discover -s tests
+"""
+
+import time
+import threading
+import unittest
+
+from utils.llm_limiter import LLMLimiter, LimiterRejected
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.001)
+
+
+class Holder(threading.Thread):
+    """Thread holding a limiter slot until released"""
+
+    def __init__(self, limiter, name=None, log=None):
+        super().__init__(name=name, daemon=True)
+        self.limiter = limiter
+        self.log = log
+        self.release = threading.Event()
+        self.acquired = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            with self.limiter.slot():
+                if self.log is not None:
+                    self.log.append(self.name)
+                self.acquired.set()
+                self.release.wait(5)
+        except LimiterRejected as e:
+            self.error = e
+
+
+class BulkheadTest(unittest.TestCase):
+
+    def test_slots_are_taken_until_max_concurrency(self):
+        limiter = LLMLimiter(max_concurrency=2, max_queue=0, queue_timeout=1)
+        with limiter.slot(), limiter.slot():
+            self.assertEqual(limiter.stats()['active'], 2)
+            # No queue: a third caller is rejected at once
+            with self.assertRaises(LimiterRejected):
+                with limiter.slot():
+                    pass
+        stats = limiter.stats()
+        self.assertEqual((stats['active'], stats['acquired'], stats['rejected']), (0, 2, 1))
+
+    def test_queue_full_rejects_at_once(self):
+        limiter = LLMLimiter(max_concurrency=1, max_queue=1, queue_timeout=5)
+        holder = Holder(limiter)
+        holder.start()
+        holder.acquired.wait(2)
+        waiter = Holder(limiter)
+        waiter.start()
+        wait_until(lambda: limiter.stats()['queueDepth'] == 1)
+
+        start = time.monotonic()
+        with self.assertRaises(LimiterRejected):
+            with limiter.slot():
+                pass
+        self.assertLess(time.monotonic() - start, 1)
+
+        holder.release.set()
+        waiter.acquired.wait(2)
+        waiter.release.set()
+        for thread in (holder, waiter):
+            thread.join(2)
+        self.assertIsNone(waiter.error)
+        self.assertEqual(limiter.stats()['active'], 0)
+
+    def test_wait_times_out_and_leaves_the_queue(self):
+        limiter = LLMLimiter(max_concurrency=1, max_queue=4, queue_timeout=0.05)
+        with limiter.slot():
+            with self.assertRaises(LimiterRejected):
+                with limiter.slot():
+                    pass
+            stats = limiter.stats()
+            self.assertEqual((stats['timedOut'], stats['queueDepth'], stats['active']), (1, 0, 1))
+        # The timed out caller is not handed the released slot
+        self.assertEqual(limiter.stats()['active'], 0)
+
+    def test_released_slot_is_handed_over_in_fifo_order(self):
+        limiter = LLMLimiter(max_concurrency=1, max_queue=4, queue_timeout=5)
+        order = []
+        holder = Holder(limiter, 'holder', order)
+        holder.start()
+        holder.acquired.wait(2)
+        waiters = []
+        for name in ('first', 'second'):
+            waiter = Holder(limiter, name, order)
+            waiter.start()
+            waiters.append(waiter)
+            wait_until(lambda: limiter.stats()['queueDepth'] == len(waiters))
+
+        holder.release.set()
+        waiters[0].acquired.wait(2)
+        # Handed over: still one active slot, the second caller still waits
+        stats = limiter.stats()
+        self.assertEqual((stats['active'], stats['queueDepth']), (1, 1))
+        waiters[0].release.set()
+        waiters[1].acquired.wait(2)
+        waiters[1].release.set()
+        for thread in [holder] + waiters:
+            thread.join(2)
+
+        self.assertEqual(order, ['holder', 'first', 'second'])
+        stats = limiter.stats()
+        self.assertEqual((stats['active'], stats['acquired'], stats['queued']), (0, 3, 2))
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def run_concurrently(self, limiter, key, call, followers=3):
+        """Leader running call, then followers joining its flight; returns their outcomes"""
+        outcomes = []
+
+        def follow():
+            try:
+                outcomes.append(('result', limiter.coalesce(key, call)))
+            except Exception as e:
+                outcomes.append(('error', e))
+
+        leader = threading.Thread(target=follow, daemon=True)
+        leader.start()
+        wait_until(lambda: limiter.stats()['inFlight'] == 1)
+        threads = [threading.Thread(target=follow, daemon=True) for _ in range(followers)]
+        for thread in threads:
+            thread.start()
+        wait_until(lambda: limiter.stats()['coalesced'] == followers)
+        return leader, threads, outcomes
+
+    def test_concurrent_callers_share_one_call(self):
+        limiter = LLMLimiter()
+        proceed = threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            proceed.wait(5)
+            return {'answer': 42}
+
+        leader, threads, outcomes = self.run_concurrently(limiter, 'prompt', call)
+        proceed.set()
+        for thread in [leader] + threads:
+            thread.join(2)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outcomes, [('result', {'answer': 42})] * 4)
+        self.assertEqual(limiter.stats()['inFlight'], 0)
+        # The flight is over: the next call runs again
+        self.assertEqual(limiter.coalesce('prompt', lambda: 'again'), 'again')
+
+    def test_followers_see_the_leader_error(self):
+        limiter = LLMLimiter()
+        proceed = threading.Event()
+
+        def call():
+            proceed.wait(5)
+            raise ValueError("webhook down")
+
+        leader, threads, outcomes = self.run_concurrently(limiter, 'prompt', call, followers=2)
+        proceed.set()
+        for thread in [leader] + threads:
+            thread.join(2)
+
+        self.assertEqual([kind for kind, _ in outcomes], ['error'] * 3)
+        self.assertTrue(all(isinstance(error, ValueError) for _, error in outcomes))
+
+    def test_cancelled_leader_gives_no_answer(self):
+        limiter = LLMLimiter()
+        proceed = threading.Event()
+
+        class Cancelled(BaseException):
+            pass
+
+        def call():
+            proceed.wait(5)
+            raise Cancelled()
+
+        followers = []
+
+        def lead():
+            try:
+                limiter.coalesce('prompt', call)
+            except Cancelled:
+                pass
+
+        leader = threading.Thread(target=lead, daemon=True)
+        leader.start()
+        wait_until(lambda: limiter.stats()['inFlight'] == 1)
+        follower = threading.Thread(target=lambda: followers.append(limiter.coalesce('prompt', call)), daemon=True)
+        follower.start()
+        wait_until(lambda: limiter.stats()['coalesced'] == 1)
+        proceed.set()
+        leader.join(2)
+        follower.join(2)
+
+        self.assertEqual(followers, [None])
+        self.assertEqual(limiter.stats()['inFlight'], 0)
+
+    def test_different_keys_do_not_coalesce(self):
+        limiter = LLMLimiter()
+        self.assertEqual([limiter.coalesce(key, lambda key=key: key) for key in ('a', 'b')], ['a', 'b'])
+        stats = limiter.stats()
+        self.assertEqual((stats['calls'], stats['coalesced']), (2, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
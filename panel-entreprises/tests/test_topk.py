@@ -0,0 +1,136 @@
+"""
+test_topk.py - Differential tests of the top-K pruning for EDF Panel Entreprises
+
+The threshold rounds and TopKSelection are checked against a brute force over
+random score lists: pruning may skip companies, never change the result.
+
+    python -m unittest discover -s tests
+"""
+
+import random
+import unittest
+
+from utils.topk import TopKSelection, sorted_access_list, threshold_rounds
+from utils.company_matcher import filter_and_sort_matches
+
+CASES = 120
+
+DOMAINS = ['Électricité', 'Mécanique', 'Hydraulique', 'Bâtiment']
+ZONES = ['est', 'ouest', 'centre']
+
+
+def random_scores(rng, size):
+    # Few distinct values: ties on every score, and some failed (None) rows
+    return [None if rng.random() < 0.05 else rng.choice([0, 10, 50, 55.5, 60, 70, 85, 100])
+            for _ in range(size)]
+
+
+def random_panel(rng, size):
+    """
+    Final scores and (domain, zone) groups of a random panel; rare groups
+    mostly score low, so the diversity rules pick companies below the top-K
+    """
+    scores = [rng.choice(range(30, 101, 5)) for _ in range(size)]
+    groups = [(rng.choices(DOMAINS, [1, 1, 1, 1] if score < 60 else [8, 4, 0, 0])[0],
+               rng.choices(ZONES, [1, 1, 1] if score < 60 else [6, 1, 0])[0])
+              for score in scores]
+    return scores, groups
+
+
+def results(rows, scores, groups, min_score, max_results):
+    """Final result over the given rows, as match_companies builds it (rows in order)"""
+    matches = [{'id': row, 'score': scores[row], 'domain': groups[row][0], 'geo_zone': groups[row][1]}
+               for row in sorted(rows) if scores[row] >= min_score]
+    return [(match['id'], match['score']) for match in filter_and_sort_matches(matches, min_score, max_results)]
+
+
+class ThresholdRoundsTest(unittest.TestCase):
+
+    def test_rounds_read_every_row_once_and_bound_unread_rows(self):
+        rng = random.Random(37)
+        for case in range(CASES):
+            size = rng.randint(0, 150)
+            vectors = [random_scores(rng, size) for _ in range(rng.randint(1, 4))]
+            lists = [sorted_access_list(vector) for vector in vectors]
+            # Rows failed in any list are read beforehand, as rank_candidates does
+            first = {row for vector in vectors for row, score in enumerate(vector) if score is None}
+            seen = set(first)
+            read = []
+
+            for new_rows, last_scores in threshold_rounds(lists, seen, first_depth=rng.randint(1, 8)):
+                read.extend(new_rows)
+                if last_scores is None:
+                    continue
+                for row in set(range(size)) - seen:
+                    for vector, last in zip(vectors, last_scores):
+                        self.assertLessEqual(vector[row], last, f"case {case}: row {row} above the threshold")
+
+            self.assertEqual(len(read), len(set(read)), f"case {case}: row read twice")
+            self.assertEqual(set(read) | first, set(range(size)), f"case {case}: row never read")
+            self.assertFalse(set(read) & first, f"case {case}: failed row read again")
+
+
+class TopKSelectionTest(unittest.TestCase):
+
+    def test_excluded_rows_never_change_the_result(self):
+        # Random scan order, rows dropped as soon as their exact score is excluded
+        rng = random.Random(38)
+        for case in range(CASES):
+            size = rng.randint(1, 120)
+            scores, groups = random_panel(rng, size)
+            max_results = rng.randint(1, 8)
+            min_score = rng.choice([0, 40, 50, 60, 75])
+            selection = TopKSelection(2 * max_results, min_score, groups)
+
+            kept = []
+            for row in rng.sample(range(size), size):
+                selection.seen(groups[row])
+                if selection.excludes(scores[row], groups[row]):
+                    continue
+                kept.append(row)
+                selection.add(scores[row], groups[row])
+
+            self.assertEqual(results(kept, scores, groups, min_score, max_results),
+                             results(range(size), scores, groups, min_score, max_results),
+                             f"case {case}")
+
+    def test_complete_stops_only_when_unread_rows_cannot_be_returned(self):
+        # Rows read by decreasing score: the next score bounds every unread row
+        rng = random.Random(39)
+        for case in range(CASES):
+            size = rng.randint(1, 120)
+            scores, groups = random_panel(rng, size)
+            max_results = rng.randint(1, 8)
+            min_score = rng.choice([0, 40, 50, 60, 75])
+            selection = TopKSelection(2 * max_results, min_score, groups)
+            order = sorted(range(size), key=lambda row: (-scores[row], row))
+
+            kept = []
+            for position, row in enumerate(order):
+                selection.seen(groups[row])
+                if not selection.excludes(scores[row], groups[row]):
+                    kept.append(row)
+                    selection.add(scores[row], groups[row])
+                following = order[position + 1:]
+                if following and selection.complete(scores[following[0]]):
+                    break
+
+            self.assertEqual(results(kept, scores, groups, min_score, max_results),
+                             results(range(size), scores, groups, min_score, max_results),
+                             f"case {case}")
+
+    def test_group_best_is_kept_below_the_top_k(self):
+        selection = TopKSelection(2, 0, ['a', 'a', 'b'])
+        selection.add(90, 'a')
+        selection.add(80, 'a')
+        # Below the top-K but the best of its group: still returnable
+        self.assertFalse(selection.excludes(70, 'b'))
+        selection.add(70, 'b')
+        self.assertTrue(selection.excludes(60, 'b'))
+        self.assertTrue(selection.excludes(60, 'a'))
+        # Equal to the K-th best score: ties are kept
+        self.assertFalse(selection.excludes(80, 'a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
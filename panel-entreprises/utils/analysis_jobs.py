@@ -0,0 +1,247 @@
+"""
+analysis_jobs.py - Registry of tiered document analyses for EDF Panel Entreprises
+
+A tiered analysis answers in two steps:
+- the local analysis (keywords and criteria extracted by MistralAPI without
+  calling the endpoint) is returned at once with an analysis id
+- the LLM analysis runs in the background and replaces it when it arrives;
+  clients poll or subscribe to the job with its id
+
+Jobs are kept in memory for ttl seconds, at most max_entries of them (the
+oldest are dropped first). With several worker processes (prefork), the
+registry is given a directory shared by the workers: each job is also saved
+there as <id>.json whenever it changes, so any worker answers for a job
+started by another one, polling its file while it is pending. A pending job
+whose worker is gone (replaced after a reload) is reported as failed.
+
+Configuration (environment variables):
+    PANEL_ANALYSIS_JOBS: jobs kept (default 256)
+    PANEL_ANALYSIS_JOB_TTL: seconds a job is kept (default 3600)
+    PANEL_ANALYSIS_JOBS_DIR: directory shared by the workers (default
+        data/analysis_jobs)
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS_DIR = os.environ.get('PANEL_ANALYSIS_JOBS_DIR', 'data/analysis_jobs')
+
+# Seconds between two reads of the file of a job run by another worker
+POLL_INTERVAL = 0.25
+
+_JOB_ID = re.compile(r'[0-9a-f]{32}')
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+LOCAL_TIER = 'local'
+LLM_TIER = 'llm'
+
+
+class AnalysisJob:
+    """One tiered analysis: the current result and its tier"""
+
+    __slots__ = ('id', 'status', 'tier', 'result', 'degraded', 'error', 'created', 'updated', 'done')
+
+    def __init__(self, job_id, local_result):
+        self.id = job_id
+        self.status = PENDING
+        self.tier = LOCAL_TIER
+        self.result = local_result
+        self.degraded = False
+        self.error = None
+        self.created = self.updated = time.time()
+        self.done = threading.Event()
+
+    def to_dict(self):
+        """JSON view of the job"""
+        return {
+            'analysisId': self.id,
+            'status': self.status,
+            'tier': self.tier,
+            'degraded': self.degraded,
+            'error': self.error,
+            'data': self.result
+        }
+
+    @classmethod
+    def restore(cls, saved):
+        """Job read back from the file saved by a worker"""
+        job = cls(saved['analysisId'], saved['data'])
+        job.status = saved['status']
+        job.tier = saved['tier']
+        job.degraded = saved['degraded']
+        job.error = saved['error']
+        job.created = saved['created']
+        job.updated = saved['updated']
+        if job.status != PENDING:
+            job.done.set()
+        return job
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class AnalysisJobRegistry:
+    """Thread-safe registry of AnalysisJob, with expiry"""
+
+    def __init__(self, max_entries=None, ttl=None, directory=None):
+        """
+        Args:
+            max_entries: Jobs kept (PANEL_ANALYSIS_JOBS when None)
+            ttl: Seconds a job is kept (PANEL_ANALYSIS_JOB_TTL when None)
+            directory: Directory shared by the worker processes (None: jobs
+                only live in this process)
+        """
+        self.max_entries = max_entries or int(os.environ.get('PANEL_ANALYSIS_JOBS', '256'))
+        self.ttl = ttl or float(os.environ.get('PANEL_ANALYSIS_JOB_TTL', '3600'))
+        self.directory = directory
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _expire(self, now):
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if len(self._jobs) <= self.max_entries and now - job.created < self.ttl:
+                break
+            self._jobs.popitem(last=False)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _save(self, job):
+        if not self.directory:
+            return
+        path = self._path(job.id)
+        # Written next to the file then renamed: readers never see half a file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({**job.to_dict(), 'created': job.created, 'updated': job.updated, 'pid': os.getpid()},
+                          f, ensure_ascii=False, default=str)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Analysis job {job.id} not shared: {e}")
+
+    def _load(self, job_id):
+        # Job saved by another worker, None if unknown or expired
+        if not self.directory or not _JOB_ID.fullmatch(job_id):
+            return None
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - saved['created'] >= self.ttl:
+            return None
+
+        job = AnalysisJob.restore(saved)
+        if job.status == PENDING and not _process_alive(saved['pid']):
+            # Its worker stopped before the LLM answered
+            job.status = FAILED
+            job.degraded = True
+            job.error = "Analysis interrupted"
+            job.done.set()
+        return job
+
+    def _expire_files(self, now):
+        # Before saving a new job: room is left for its file
+        try:
+            entries = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(self.directory)
+                             if entry.name.endswith('.json'))
+        except OSError:
+            return
+        excess = len(entries) + 1 - self.max_entries
+        for index, (modified, path) in enumerate(entries):
+            if index >= excess and now - modified < self.ttl:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def create(self, local_result):
+        """Register a job answered by its local result"""
+        job = AnalysisJob(uuid.uuid4().hex, local_result)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._expire(job.created)
+        if self.directory:
+            self._expire_files(job.created)
+            self._save(job)
+        return job
+
+    def get(self, job_id):
+        """Return the job (read from the shared directory when another worker runs it), or None if unknown or expired"""
+        with self._lock:
+            self._expire(time.time())
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._load(job_id)
+
+    def wait(self, job, timeout):
+        """
+        Wait up to timeout seconds for the job to finish
+
+        Returns:
+            The job as last known (a job run by another worker is read again
+            from its file)
+        """
+        with self._lock:
+            local = self._jobs.get(job.id) is job
+        if local or not self.directory:
+            job.done.wait(timeout)
+            return job
+
+        deadline = time.monotonic() + timeout
+        while not job.done.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(POLL_INTERVAL, remaining))
+            job = self._load(job.id) or job
+        return job
+
+    def complete(self, job, result, tier, degraded=False):
+        """Record the final result of a job"""
+        job.result = result
+        job.tier = tier
+        job.degraded = degraded
+        job.status = DONE
+        job.updated = time.time()
+        self._save(job)
+        job.done.set()
+
+    def fail(self, job, error):
+        """Mark a job as failed: its local result stays the answer"""
+        job.error = str(error)
+        job.degraded = True
+        job.status = FAILED
+        job.updated = time.time()
+        self._save(job)
+        job.done.set()
+
+    def stats(self):
+        """Return job counts by status"""
+        with self._lock:
+            counts = {PENDING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return {'entries': len(self._jobs), 'maxEntries': self.max_entries, **counts}
@@ -0,0 +1,132 @@
+"""
+boot_profile.py - Cold start profiling for EDF Panel Entreprises
+
+Set PANEL_PROFILE_STARTUP=1 to time every top-level import and each named boot
+phase; the breakdown is logged when the application is ready and served by
+/api/system/boot-profile. Phases run after that (the panel load, deferred until
+the server is started) are reported apart as deferred, outside the boot time.
+
+PANEL_COLD_START_BUDGET_MS sets a budget for the total boot time. Exceeding it
+logs a warning, or aborts start-up when PANEL_COLD_START_STRICT=1.
+"""
+
+import os
+import sys
+import time
+import builtins
+import logging
+from contextlib import contextmanager
+
+from utils.lazy_imports import lazy_import_times
+
+logger = logging.getLogger(__name__)
+
+
+class ColdStartBudgetExceeded(RuntimeError):
+    """Raised in strict mode when boot takes longer than the configured budget"""
+
+
+class BootProfiler:
+    """Collects import and phase timings between start() and finish()"""
+
+    def __init__(self):
+        self.enabled = os.environ.get('PANEL_PROFILE_STARTUP', '0') == '1'
+        budget = os.environ.get('PANEL_COLD_START_BUDGET_MS')
+        self.budget_ms = float(budget) if budget else None
+        self.strict = os.environ.get('PANEL_COLD_START_STRICT', '0') == '1'
+        self.started_at = None
+        self.total_ms = None
+        self.phases = []
+        self.deferred = []
+        self.imports = {}
+        self._original_import = None
+        self._depth = 0
+
+    def start(self):
+        """Mark the beginning of boot and hook imports when profiling is enabled"""
+        self.started_at = time.perf_counter()
+        if self.enabled and self._original_import is None:
+            self._original_import = builtins.__import__
+            builtins.__import__ = self._timed_import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Already loaded modules go straight through
+        if level == 0 and name in sys.modules and self._depth == 0:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        start = time.perf_counter()
+        self._depth += 1
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                # Only outermost imports are recorded, with their cumulative time
+                top_level = name.split('.')[0] if level == 0 else name
+                elapsed = (time.perf_counter() - start) * 1000
+                self.imports[top_level] = self.imports.get(top_level, 0.0) + elapsed
+
+    @contextmanager
+    def phase(self, name):
+        """Time a named boot phase (deferred when run after finish())"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            if self.total_ms is None:
+                self.phases.append((name, elapsed))
+            else:
+                self.deferred.append((name, elapsed))
+                if self.enabled:
+                    logger.info("Deferred boot phase %s: %.0fms", name, elapsed)
+
+    def finish(self):
+        """
+        Stop profiling, log the report and enforce the cold start budget
+
+        Raises:
+            ColdStartBudgetExceeded: in strict mode when the budget is exceeded
+        """
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+        if self.started_at is not None:
+            self.total_ms = (time.perf_counter() - self.started_at) * 1000
+
+        report = self.report()
+        if self.enabled:
+            logger.info("Boot profile: total %.0fms, phases %s, slowest imports %s",
+                        report['totalMs'], report['phases'], report['imports'][:10])
+
+        if self.budget_ms is not None and self.total_ms is not None and self.total_ms > self.budget_ms:
+            message = f"Cold start took {self.total_ms:.0f}ms, budget is {self.budget_ms:.0f}ms"
+            if self.strict:
+                raise ColdStartBudgetExceeded(message)
+            logger.warning(message)
+
+        return report
+
+    def report(self):
+        """Return the boot profile as a JSON-serializable dict"""
+        return {
+            'enabled': self.enabled,
+            'totalMs': round(self.total_ms, 1) if self.total_ms is not None else None,
+            'budgetMs': self.budget_ms,
+            'withinBudget': (self.budget_ms is None or self.total_ms is None
+                             or self.total_ms <= self.budget_ms),
+            'phases': [{'name': name, 'ms': round(ms, 1)} for name, ms in self.phases],
+            'deferred': [{'name': name, 'ms': round(ms, 1)} for name, ms in self.deferred],
+            'imports': [
+                {'module': module_name, 'ms': round(ms, 1)}
+                for module_name, ms in sorted(self.imports.items(), key=lambda item: item[1], reverse=True)
+            ],
+            'lazyImports': [
+                {'module': module_name, 'ms': round(ms, 1)}
+                for module_name, ms in sorted(lazy_import_times().items(), key=lambda item: item[1], reverse=True)
+            ]
+        }
+
+
+BOOT_PROFILER = BootProfiler()
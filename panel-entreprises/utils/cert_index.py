@@ -0,0 +1,158 @@
+"""
+cert_index.py - Certification bitmap index for EDF Panel Entreprises
+
+For a CompanyTable, one bitmap (a Python int, bit n = row n) per exact
+certification value and per certification family recognized by
+company_matcher.match_certification (a family matches every certification
+containing its token, e.g. "ISO 9001:2015" is in the "iso 9001" family).
+Required-certification criteria and the database certification filter are
+then answered with bitmap operations instead of scanning every company.
+
+The index is built on first use and cached on the table, which is immutable.
+"""
+
+import threading
+import logging
+
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Tokens looked up by match_certification, in its order of precedence
+CERTIFICATION_FAMILIES = ('mase', 'iso 9001', 'iso 14001', 'cefri')
+
+_build_lock = threading.Lock()
+
+
+def bitmap_from_rows(rows, size):
+    """Build a bitmap from row numbers in O(size)"""
+    buffer = bytearray((size + 7) // 8)
+    for row in rows:
+        buffer[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def bitmap_rows(bitmap):
+    """Row numbers set in a bitmap, in increasing order"""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    rows = []
+    for byte_index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            rows.append((byte_index << 3) + low.bit_length() - 1)
+            byte ^= low
+    return rows
+
+
+def required_certification_family(criterion):
+    """
+    Family a certification criterion requires, as decided by
+    match_certification, or None for a general certification criterion
+    """
+    criterion_name = criterion['name'].lower()
+    criterion_desc = criterion.get('description', '').lower()
+
+    required = {
+        'mase': 'mase' in criterion_name or 'mase' in criterion_desc,
+        'iso 9001': ('iso 9001' in criterion_name or 'iso 9001' in criterion_desc or
+                     ('iso' in criterion_name and 'qualité' in criterion_desc)),
+        'iso 14001': ('iso 14001' in criterion_name or 'iso 14001' in criterion_desc or
+                      ('iso' in criterion_name and 'environnement' in criterion_desc)),
+        'cefri': ('cefri' in criterion_name or 'cefri' in criterion_desc or
+                  ('nucléaire' in criterion_desc and 'certification' in criterion_name))
+    }
+    for family in CERTIFICATION_FAMILIES:
+        if required[family]:
+            return family
+    return None
+
+
+class CertificationIndex:
+    """Certification bitmaps over the rows of one CompanyTable"""
+
+    def __init__(self, table):
+        self.size = len(table)
+        values = table.vocabularies['certifications'].values
+        rows_by_code = [[] for _ in values]
+        with_any = []
+        irregular = []
+
+        for row in range(self.size):
+            mask = table.certification_mask(row)
+            if mask:
+                with_any.append(row)
+                while mask:
+                    low = mask & -mask
+                    rows_by_code[low.bit_length() - 1].append(row)
+                    mask ^= low
+            elif table.has(row, 'certifications') and table.value(row, 'certifications'):
+                # Certifications that could not be encoded (kept verbatim)
+                irregular.append(row)
+
+        self.by_certification = {}
+        family_rows = {family: set() for family in CERTIFICATION_FAMILIES}
+        for code, rows in enumerate(rows_by_code):
+            if not rows:
+                continue
+            self.by_certification[values[code]] = bitmap_from_rows(rows, self.size)
+            lowered = values[code].lower()
+            for family in CERTIFICATION_FAMILIES:
+                if family in lowered:
+                    family_rows[family].update(rows)
+
+        self.by_family = {
+            family: bitmap_from_rows(rows, self.size) for family, rows in family_rows.items()
+        }
+        self.with_any = bitmap_from_rows(with_any, self.size)
+        self.irregular = bitmap_from_rows(irregular, self.size)
+
+    def certification(self, name):
+        """Bitmap of the companies holding exactly this certification"""
+        return self.by_certification.get(name, 0)
+
+    def family(self, family):
+        """Bitmap of the companies holding a certification of this family"""
+        return self.by_family.get(family, 0)
+
+    def all_rows(self):
+        """Bitmap with every row set"""
+        return (1 << self.size) - 1
+
+
+def certification_index(table):
+    """Return the (cached) CertificationIndex of a CompanyTable"""
+    index = getattr(table, '_certification_index', None)
+    if index is None:
+        with _build_lock:
+            index = getattr(table, '_certification_index', None)
+            if index is None:
+                with span('cert_index.build', companies=len(table)):
+                    index = CertificationIndex(table)
+                table._certification_index = index
+    return index
+
+
+def filter_company_rows(table, certification=None, domain=None, query=None):
+    """
+    Rows matching the database page filters (exact certification, exact
+    domain, and a case-insensitive search on name, location and domain)
+    """
+    if certification:
+        rows = bitmap_rows(certification_index(table).certification(certification))
+    else:
+        rows = range(len(table))
+
+    if domain:
+        code = table.vocabularies['domain'].codes.get(domain)
+        if code is None:
+            return []
+        rows = [row for row in rows if table.has(row, 'domain') and table.code(row, 'domain') == code]
+
+    if query:
+        query = query.lower()
+        rows = [
+            row for row in rows
+            if any(query in str(table[row].get(field) or '').lower() for field in ('name', 'location', 'domain'))
+        ]
+
+    return list(rows)
@@ -0,0 +1,206 @@
+"""
+circuit_breaker.py - Circuit breaker for the Prisme endpoint in EDF Panel Entreprises
+
+Each HTTP attempt to the webhook reports its outcome to a CircuitBreaker:
+- closed: attempts go through; outcomes are kept over a sliding time window
+  and the circuit opens when at least min_calls attempts of the window
+  failed at failure_rate or more
+- open: attempts are refused at once (CircuitOpen), so callers use their
+  local fallback in milliseconds instead of waiting through timeouts and
+  retries; after open_seconds the circuit turns half-open
+- half-open: up to probes attempts go through as probes; a successful
+  probe closes the circuit, a failed one opens it again
+
+A failure is an exception (timeout, connection error) or a 5xx / 429
+status; any other answer shows that the endpoint is up.
+
+Configuration (environment variables):
+    PANEL_BREAKER_WINDOW: seconds of outcomes considered (default 60)
+    PANEL_BREAKER_MIN_CALLS: attempts needed before the circuit can open (default 4)
+    PANEL_BREAKER_FAILURE_RATE: failure rate opening the circuit (default 0.5)
+    PANEL_BREAKER_OPEN_SECONDS: time before probing again (default 30)
+    PANEL_BREAKER_PROBES: concurrent probe attempts when half-open (default 1)
+"""
+
+import os
+import time
+import threading
+import logging
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpen(Exception):
+    """The circuit is open: the endpoint is considered down"""
+
+
+class Attempt:
+    """Outcome of one attempt; set failed for answers that show an outage"""
+
+    __slots__ = ('failed',)
+
+    def __init__(self):
+        self.failed = False
+
+
+def failed_status(status_code):
+    """True for HTTP statuses counted as endpoint failures"""
+    return status_code >= 500 or status_code == 429
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over a sliding failure-rate window"""
+
+    def __init__(self, name, window_seconds=None, min_calls=None, failure_rate=None,
+                 open_seconds=None, probes=None):
+        self.name = name
+        self.window_seconds = window_seconds or float(os.environ.get('PANEL_BREAKER_WINDOW', '60'))
+        self.min_calls = min_calls or int(os.environ.get('PANEL_BREAKER_MIN_CALLS', '4'))
+        self.failure_rate = failure_rate or float(os.environ.get('PANEL_BREAKER_FAILURE_RATE', '0.5'))
+        self.open_seconds = open_seconds or float(os.environ.get('PANEL_BREAKER_OPEN_SECONDS', '30'))
+        self.probes = probes or int(os.environ.get('PANEL_BREAKER_PROBES', '1'))
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = 0
+        self._outcomes = deque()    # (time, failed) of the window
+        self._failures = 0
+        self._counters = {'opened': 0, 'shortCircuited': 0, 'probes': 0}
+
+    # ------------------------------------------------------------------
+    # State
+    # ------------------------------------------------------------------
+
+    def _current_state(self, now):
+        # Open circuits turn half-open once open_seconds have passed
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probing = 0
+            logger.info("Circuit %s half-open: probing", self.name)
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def rejects(self, count=False):
+        """
+        True if an attempt would be refused now (does not take a probe);
+        count: record the refusal as a short-circuited call
+        """
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            refused = state == OPEN or (state == HALF_OPEN and self._probing >= self.probes)
+            if refused and count:
+                self._counters['shortCircuited'] += 1
+            return refused
+
+    def _open(self, now):
+        self._state = OPEN
+        self._opened_at = now
+        self._probing = 0
+        self._outcomes.clear()
+        self._failures = 0
+        self._counters['opened'] += 1
+        logger.warning("Circuit %s open for %gs", self.name, self.open_seconds)
+
+    def _close(self):
+        self._state = CLOSED
+        self._probing = 0
+        self._outcomes.clear()
+        self._failures = 0
+        logger.info("Circuit %s closed", self.name)
+
+    # ------------------------------------------------------------------
+    # Attempts
+    # ------------------------------------------------------------------
+
+    def _allow(self):
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probing < self.probes:
+                self._probing += 1
+                self._counters['probes'] += 1
+                return
+            self._counters['shortCircuited'] += 1
+            raise CircuitOpen(f"Circuit {self.name} is {state}")
+
+    def _record(self, failed):
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == HALF_OPEN:
+                self._probing = max(0, self._probing - 1)
+                if failed:
+                    self._open(now)
+                else:
+                    self._close()
+                return
+            if state == OPEN:
+                # Attempt started before the circuit opened
+                return
+
+            self._outcomes.append((now, failed))
+            self._failures += failed
+            while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+                self._failures -= self._outcomes.popleft()[1]
+            if (failed and len(self._outcomes) >= self.min_calls
+                    and self._failures >= self.failure_rate * len(self._outcomes)):
+                self._open(now)
+
+    def _abandon(self):
+        # Attempt cancelled before any outcome: free its probe
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probing = max(0, self._probing - 1)
+
+    @contextmanager
+    def attempt(self):
+        """
+        Guard one attempt (raises CircuitOpen when refused)
+
+        Exceptions raised inside count as failures, as does setting
+        attempt.failed; cancellation (BaseException) counts as nothing.
+        """
+        self._allow()
+        attempt = Attempt()
+        try:
+            yield attempt
+        except Exception:
+            self._record(True)
+            raise
+        except BaseException:
+            self._abandon()
+            raise
+        self._record(attempt.failed)
+
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+
+    def stats(self):
+        """Return the state, window counts and transition counters"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            return {
+                'name': self.name,
+                'state': state,
+                'windowCalls': len(self._outcomes),
+                'windowFailures': self._failures,
+                'openFor': max(0.0, self.open_seconds - (now - self._opened_at)) if state == OPEN else 0.0,
+                **self._counters
+            }
+
+
+# Breaker of the Prisme webhook, used by utils.mistral_api
+PRISME_BREAKER = CircuitBreaker('prisme')
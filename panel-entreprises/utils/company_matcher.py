@@ -3,15 +3,73 @@ company_matcher.py - Enhanced Matching Algorithm for EDF Panel Entreprises
 """
 
 import re
+import math
+import functools
+import itertools
 import json
 import logging
-from difflib import SequenceMatcher
+from collections import Counter
+
+from utils.lazy_imports import get_numpy, get_sequence_matcher
+from utils.tracing import span
+from utils.company_table import CompanyTable
+from utils.cert_index import certification_index, required_certification_family, bitmap_rows
+from utils.gazetteer import get_gazetteer
+from utils.geo_index import geo_index, haversine_km, parse_radius_criterion
+from utils.topk import TopKSelection, cached_sorted_access_list, threshold_rounds
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def match_companies(companies, criteria, max_results=10, min_score=60):
+# Placeholder for a company not scored yet in a cached score vector
+UNSCORED = object()
+
+# Highest score a criterion matcher returns
+MAX_CRITERION_SCORE = 100
+
+# Relative cost of scoring one company on a criterion, by category
+CRITERION_COSTS = {
+    'certification': 1,   # certification list tests (bitmap index on tables)
+    'geographic': 1,      # gazetteer lookups (grid index on tables)
+    'capacity': 2,        # keyword tests on CA and headcount
+    'domain': 5,          # keywords, text similarity as a last resort
+    'technical': 20,      # text similarity on experience, contracts, capabilities
+    'experience': 20,
+    'other': 20
+}
+MAX_CRITERION_COST = 20
+
+# Criteria up to this cost are scored for every company and read through
+# sorted access lists (see rank_candidates)
+CHEAP_CRITERION_COST = 5
+
+# Companies within this multiple of a radius criterion score as nearby
+NEARBY_RADIUS_FACTOR = 1.5
+
+# Company fields kept in compact match results (the score fields are always kept)
+MATCH_RESULT_FIELDS = (
+    'id', 'name', 'domain', 'location', 'geo_zone', 'certifications', 'ca', 'employees', 'contact'
+)
+MATCH_SCORE_FIELDS = ('score', 'matchDetails', 'selected')
+
+# Zones partially served from a neighboring zone (lowercased gazetteer zones)
+NEIGHBORING_ZONES = {
+    'ile-de-france': ['est', 'nord', 'centre'],
+    'nord': ['ile-de-france', 'est'],
+    'est': ['ile-de-france', 'centre', 'nord'],
+    'ardennes': ['est', 'nord'],
+    'ouest': ['ile-de-france', 'centre', 'sud-ouest'],
+    'sud-ouest': ['centre', 'ouest', 'sud-est'],
+    'sud-est': ['centre', 'sud-ouest'],
+    'centre': ['ile-de-france', 'est', 'ouest', 'sud-est', 'sud-ouest']
+}
+
+# Zones that are part of a larger one (the Ardennes, around Chooz, are in the Est)
+SUBZONES = {
+    'est': ['ardennes']
+}
+
+def match_companies(companies, criteria, max_results=10, min_score=60, score_vectors=None,
+                    on_progress=None):
     """
     Advanced matching algorithm that finds companies matching the specified criteria
     with detailed scoring and transparency
@@ -19,81 +77,656 @@ def match_companies(companies, criteria, max_results=10, min_score=60):
     Args:
         companies: List of company objects
         criteria: List of criteria objects with {id, name, description, selected} structure
+                  and an optional numeric 'weight' overriding the category weight
         max_results: Maximum number of results to return
         min_score: Minimum score threshold for inclusion in results
+        score_vectors: Optional dict reused across calls on the same companies list
+                       (see utils.score_cache); per-criterion scores found there are
+                       not recomputed, so toggling or reweighting a criterion only
+                       redoes the weighted sum and the top-K selection
+        on_progress: Optional callable receiving the provisional results (best
+                     companies scored so far, by score, without the diversity
+                     rules) after each round of rank_candidates
+    
+    When companies is a CompanyTable, required-certification criteria are
+    scored from the certification index, radius criteria ("à moins de 150 km
+    du CNPE de Chooz") from the geographic index. Criteria are evaluated
+    cheapest first (see rank_candidates) and a company stops being scored as
+    soon as its best possible score falls below min_score or below the
+    current top-K threshold.
         
     Returns:
         List of company objects with match scores and details
     """
-    logger.info("=== COMPANY MATCHING PROCESS ===")
-    logger.info(f"Companies to analyze: {len(companies)}")
-    logger.info(f"Criteria received: {len(criteria)}")
-    
-    # Filter only selected criteria
-    selected_criteria = [c for c in criteria if c.get('selected', True)]
-    logger.info(f"Selected criteria: {len(selected_criteria)}")
+    with span('match', companies=len(companies), criteria=len(criteria)) as trace:
+        # Filter only selected criteria
+        selected_criteria = [c for c in criteria if c.get('selected', True)]
+        trace.set(selected=len(selected_criteria))
+        
+        if not selected_criteria:
+            logger.warning("No criteria selected, returning companies with default scores")
+            return sorted_companies_by_relevance(companies, max_results)
+        
+        # Analyze criteria types for better matching strategy
+        criteria_types = analyze_criteria_types(selected_criteria)
+        trace.event("Criteria types identified: %s", criteria_types)
+        
+        if score_vectors is None:
+            score_vectors = {}
+        
+        # Per-criterion score vectors (one score per company, None when scoring
+        # failed, UNSCORED when not computed yet)
+        is_table = isinstance(companies, CompanyTable)
+        weights = []
+        vectors = []
+        keys = []
+        for criterion in selected_criteria:
+            key = criterion_vector_key(criterion, criteria_types)
+            vector = score_vectors.get(key)
+            if vector is not None:
+                trace.incr('vectors_reused')
+            elif is_table:
+                vector = indexed_criterion_vector(companies, criterion, criteria_types)
+                if vector is not None:
+                    score_vectors[key] = vector
+                    trace.incr('vectors_indexed')
+            weights.append(get_criterion_weight(criterion, criteria_types))
+            vectors.append(vector)
+            keys.append(key)
+        
+        bonuses = score_vectors.get('bonuses')
+        if bonuses is None:
+            bonuses = score_vectors['bonuses'] = compute_bonus_vector(companies)
+        
+        # Accumulate sequentially (not sum()) to keep the historical float rounding
+        weights_sum = 0
+        for weight in weights:
+            weights_sum += weight
+        
+        # Score the companies that can still make it into the result, cheapest
+        # criteria first
+        for i in range(len(selected_criteria)):
+            if vectors[i] is None:
+                vectors[i] = score_vectors[keys[i]] = [UNSCORED] * len(companies)
+                trace.incr('vectors_computed')
+        on_round = None
+        if on_progress is not None:
+            reported = []
+            
+            def on_round(kept_rows):
+                provisional = provisional_matches(companies, kept_rows, selected_criteria, weights, vectors,
+                                                  weights_sum, bonuses, min_score, max_results)
+                # Only report rounds that changed the provisional results
+                summary = [(match.get('id'), match['score']) for match in provisional]
+                if summary != reported:
+                    reported[:] = summary
+                    on_progress(provisional)
+        rows = rank_candidates(companies, selected_criteria, criteria_types, weights, vectors, keys,
+                               weights_sum, bonuses, min_score, max_results, score_vectors, trace,
+                               on_round)
+        trace.set(candidates=len(rows))
+        
+        matched_companies = []
+        
+        for position in rows:
+            company = companies[position]
+            final_score, company_scores = score_row(position, selected_criteria, weights, vectors,
+                                                    weights_sum, bonuses)
+            if company_scores is None:
+                trace.incr('errors')
+            
+            # Only companies above the threshold can be returned
+            if final_score < min_score:
+                continue
+            
+            matched_companies.append(match_entry(company, final_score, company_scores))
+        
+        # Sort and filter results
+        result = filter_and_sort_matches(matched_companies, min_score, max_results)
+        
+        trace.set(matched=len(result))
+        if result:
+            trace.set(top_score=result[0]['score'], bottom_score=result[-1]['score'])
+        if trace.counters.get('errors'):
+            logger.warning("Matching failed for %d companies", trace.counters['errors'])
+        
+        return result
+
+def match_companies_batch(companies, criteria_sets, max_results=10, min_score=60, score_vectors=None):
+    """
+    Match several projects (criteria lists) against the same companies
     
-    if not selected_criteria:
-        logger.warning("No criteria selected, returning companies with default scores")
-        return sorted_companies_by_relevance(companies, max_results)
+    Criterion score vectors are shared between projects (a criterion used by
+    several projects is scored once) and the final scores of all projects
+    are computed as one numpy matrix (projects x companies). Each project
+    then gets the result match_companies would return for its criteria.
     
-    # Analyze criteria types for better matching strategy
-    criteria_types = analyze_criteria_types(selected_criteria)
-    logger.info(f"Criteria types identified: {criteria_types}")
+    Args:
+        companies: List of company objects or CompanyTable
+        criteria_sets: List of criteria lists, one per project
+        max_results: Maximum number of results per project
+        min_score: Minimum score threshold for inclusion in results
+        score_vectors: Optional dict of criterion score vectors (see match_companies)
     
-    matched_companies = []
+    Returns:
+        List of results (lists of company objects), aligned with criteria_sets
+    """
+    np = get_numpy()
+    size = len(companies)
     
-    for company in companies:
-        try:
-            company_scores = {}
-            total_score = 0
-            weights_sum = 0
+    with span('match_batch', companies=size, projects=len(criteria_sets)) as trace:
+        if score_vectors is None:
+            score_vectors = {}
+        is_table = isinstance(companies, CompanyTable)
+        
+        bonuses = score_vectors.get('bonuses')
+        if bonuses is None:
+            bonuses = score_vectors['bonuses'] = compute_bonus_vector(companies)
+        bonus_array = np.array([0 if bonus is None else bonus for bonus in bonuses], dtype=float)
+        bonus_failed = np.array([bonus is None for bonus in bonuses], dtype=bool)
+        
+        # Projects x companies final scores; NaN for projects without criteria
+        matrix = np.full((len(criteria_sets), size), np.nan)
+        arrays = {}
+        projects = []
+        
+        for p, criteria in enumerate(criteria_sets):
+            selected_criteria = [c for c in criteria if c.get('selected', True)]
+            if not selected_criteria:
+                projects.append(None)
+                continue
+            
+            criteria_types = analyze_criteria_types(selected_criteria)
+            weights = []
+            vectors = []
+            totals = np.zeros(size)
+            failed = bonus_failed.copy()
             
-            # Calculate scores for each criterion with appropriate weights
             for criterion in selected_criteria:
-                weight = get_criterion_weight(criterion, criteria_types)
-                criterion_score = calculate_criterion_score(company, criterion, criteria_types)
+                key = criterion_vector_key(criterion, criteria_types)
+                vector = score_vectors.get(key)
+                if vector is None and is_table:
+                    vector = indexed_criterion_vector(companies, criterion, criteria_types)
+                if vector is None:
+                    vector = compute_criterion_vector(companies, criterion, criteria_types)
+                    trace.incr('vectors_computed')
+                elif UNSCORED in vector:
+                    fill_criterion_vector(vector, companies, range(size), criterion, criteria_types)
+                else:
+                    trace.incr('vectors_reused')
+                score_vectors[key] = vector
                 
-                company_scores[criterion['name']] = criterion_score
-                total_score += criterion_score * weight
-                weights_sum += weight
-            
-            # Calculate final weighted score
-            final_score = round(total_score / weights_sum) if weights_sum > 0 else 50
+                array = arrays.get(key)
+                if array is None:
+                    array = arrays[key] = np.array([np.nan if score is None else score for score in vector], dtype=float)
+                weight = get_criterion_weight(criterion, criteria_types)
+                # Same operation order as score_row, so that rounding is identical
+                totals += array * weight
+                failed |= np.isnan(array)
+                weights.append(weight)
+                vectors.append(vector)
             
-            # Add historical and strategic bonuses
-            bonuses = calculate_company_bonuses(company)
-            final_score = min(100, final_score + bonuses)
+            weights_sum = 0
+            for weight in weights:
+                weights_sum += weight
             
-            # Store the matched company with scores
-            matched_company = {
-                **company,
-                'score': final_score,
-                'matchDetails': company_scores,
-                'selected': True  # Default to selected for convenience
-            }
+            if weights_sum > 0:
+                with np.errstate(invalid='ignore'):
+                    final_scores = np.rint(totals / weights_sum)
+            else:
+                final_scores = np.full(size, 50.0)
+            final_scores = np.minimum(100, final_scores + bonus_array)
+            final_scores[failed] = 50
+            matrix[p] = final_scores
+            projects.append((selected_criteria, weights, vectors, weights_sum))
+        
+        groups = company_groups(companies, score_vectors)
+        group_codes = {}
+        group_array = np.array([group_codes.setdefault(group, len(group_codes)) for group in groups], dtype=np.int64)
+        
+        results = []
+        for p, project in enumerate(projects):
+            if project is None:
+                results.append(match_companies(companies, criteria_sets[p], max_results, min_score, score_vectors))
+                continue
+            selected_criteria, weights, vectors, weights_sum = project
             
-            matched_companies.append(matched_company)
+            # Only the top 2 * max_results companies and the best company of
+            # each (domain, zone) group can be returned (see TopKSelection)
+            order = np.argsort(-matrix[p], kind='stable')
+            qualified = order[matrix[p][order] >= min_score]
+            _, first = np.unique(group_array[qualified], return_index=True)
+            rows = sorted(set(qualified[:2 * max_results].tolist()) | set(qualified[first].tolist()))
             
+            matched_companies = []
+            for row in rows:
+                final_score, company_scores = score_row(row, selected_criteria, weights, vectors,
+                                                        weights_sum, bonuses)
+                matched_companies.append(match_entry(companies[row], final_score, company_scores))
+            results.append(filter_and_sort_matches(matched_companies, min_score, max_results))
+            trace.incr('candidates', len(rows))
+        
+        trace.set(vectors=len(arrays))
+        return results
+
+def indexed_criterion_vector(companies, criterion, criteria_types):
+    """
+    Score vector of a criterion answered from the indexes of a CompanyTable
+    (required certification, radius criterion), or None
+    """
+    category = criterion_category(criterion, criteria_types)
+    if category == 'certification':
+        return certification_vector(companies, certification_index(companies), criterion, criteria_types)
+    if category == 'geographic':
+        return geographic_vector(companies, criterion, criteria_types)
+    return None
+
+def company_groups(companies, score_vectors):
+    """
+    (domain, zone) group of every company, as used by apply_diversity_rules
+    (cached in score_vectors)
+    """
+    groups = score_vectors.get('groups')
+    if groups is None:
+        groups = []
+        for row, company in enumerate(companies):
+            group = (company.get('domain', 'Autre'), company.get('geo_zone', 'Non spécifié'))
+            try:
+                hash(group)
+            except TypeError:
+                # Values kept verbatim (lists...): a group of its own
+                group = ('row', row)
+            groups.append(group)
+        score_vectors['groups'] = groups
+    return groups
+
+def compact_matches(matches, fields=MATCH_RESULT_FIELDS):
+    """
+    Match results restricted to the given company fields and the score
+    fields (fields=None keeps every field)
+    """
+    if fields is None:
+        return matches
+    keep = (*fields, *MATCH_SCORE_FIELDS)
+    return [{field: match[field] for field in keep if field in match} for match in matches]
+
+def match_entry(company, final_score, company_scores):
+    """
+    Result entry of a matched company (company_scores is None when scoring failed)
+    """
+    if company_scores is None:
+        return {
+            **company,
+            'score': 50,
+            'matchDetails': {'Error': 'Calculation failed'},
+            'selected': False
+        }
+    # Store the matched company with scores
+    return {
+        **company,
+        'score': final_score,
+        'matchDetails': company_scores,
+        'selected': True  # Default to selected for convenience
+    }
+
+def provisional_matches(companies, rows, criteria, weights, vectors, weights_sum, bonuses,
+                        min_score, max_results):
+    """
+    Best max_results companies among the rows scored so far, by score (the
+    diversity rules are only applied to the final result)
+    """
+    scored = []
+    for row in sorted(rows):
+        final_score, company_scores = score_row(row, criteria, weights, vectors, weights_sum, bonuses)
+        if final_score >= min_score:
+            scored.append((final_score, row, company_scores))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [match_entry(companies[row], final_score, company_scores)
+            for final_score, row, company_scores in scored[:max_results]]
+
+def criterion_category(criterion, criteria_types):
+    """
+    Return the category a criterion was assigned to by analyze_criteria_types
+    """
+    criterion_id = criterion['id']
+    for category, ids in criteria_types.items():
+        if criterion_id in ids:
+            return category
+    return None
+
+def criterion_vector_key(criterion, criteria_types):
+    """
+    Identify a criterion score vector: scores only depend on the matcher
+    category and on the criterion name and description
+    """
+    return (
+        criterion_category(criterion, criteria_types),
+        criterion['name'],
+        criterion.get('description', '')
+    )
+
+def compute_criterion_vector(companies, criterion, criteria_types):
+    """
+    Score every company on one criterion
+
+    Returns:
+        List aligned with companies; None marks a company whose scoring failed
+    """
+    vector = [UNSCORED] * len(companies)
+    fill_criterion_vector(vector, companies, range(len(companies)), criterion, criteria_types)
+    return vector
+
+def fill_criterion_vector(vector, companies, rows, criterion, criteria_types):
+    """
+    Score the companies at the given rows that are still UNSCORED in vector
+    """
+    for row in rows:
+        if vector[row] is not UNSCORED:
+            continue
+        company = companies[row]
+        try:
+            vector[row] = calculate_criterion_score(company, criterion, criteria_types)
         except Exception as e:
-            logger.error(f"Error matching company {company.get('name', 'Unknown')}: {e}")
-            matched_companies.append({
-                **company,
-                'score': 50,
-                'matchDetails': {'Error': 'Calculation failed'},
-                'selected': False
-            })
+            logger.debug("Error matching company %s: %s", company.get('name', 'Unknown'), e)
+            vector[row] = None
+
+def certification_vector(companies, index, criterion, criteria_types):
+    """
+    Score a required-certification criterion from the certification index
+    (same scores as match_certification: 100 if the company holds a
+    certification of the required family, 0 otherwise)
+
+    Returns:
+        Score vector, or None when the criterion is not a required-certification one
+    """
+    try:
+        family = required_certification_family(criterion)
+    except Exception:
+        # Let the regular scoring report the failure
+        return None
+    if family is None:
+        return None
+    
+    vector = [0] * len(companies)
+    for row in bitmap_rows(index.family(family)):
+        vector[row] = MAX_CRITERION_SCORE
+    
+    # Certifications kept verbatim are scored the regular way
+    irregular = bitmap_rows(index.irregular)
+    for row in irregular:
+        vector[row] = UNSCORED
+    fill_criterion_vector(vector, companies, irregular, criterion, criteria_types)
+    return vector
+
+def geographic_vector(companies, criterion, criteria_types):
+    """
+    Score a radius criterion from the geographic index of a CompanyTable
+    (same scores as match_geographic)
+
+    Returns:
+        Score vector, or None when the criterion is not a radius one
+    """
+    try:
+        radius_query = parse_radius_criterion(criterion)
+    except Exception:
+        # Let the regular scoring report the failure
+        return None
+    if radius_query is None:
+        return None
+    site, radius = radius_query
+    index = geo_index(companies)
+    
+    vector = [UNSCORED] * len(companies)
+    rows, distances = index.rows_within(site['lat'], site['lon'], radius * NEARBY_RADIUS_FACTOR)
+    for row, distance in zip(rows.tolist(), distances.tolist()):
+        vector[row] = radius_score(distance, radius)
+    
+    # Located companies outside the nearby radius only score as national
+    # suppliers; unlocated ones are scored the regular way
+    for row in index.located.nonzero()[0].tolist():
+        if vector[row] is UNSCORED:
+            company = companies[row]
+            vector[row] = national_score(company.get('location', '').lower(),
+                                         company.get('geo_zone', 'Non spécifié').lower())
+    fill_criterion_vector(vector, companies, range(len(companies)), criterion, criteria_types)
+    return vector
+
+def plan_criteria(criteria, criteria_types, weights):
+    """
+    Evaluation order of the criteria: cheapest category first and, among
+    equal costs, heaviest first (it tightens the score bounds the most)
+    """
+    return sorted(
+        range(len(criteria)),
+        key=lambda i: (criterion_cost(criteria[i], criteria_types), -weights[i], i)
+    )
+
+def criterion_cost(criterion, criteria_types):
+    """
+    Relative cost of scoring one company on a criterion
+    """
+    return CRITERION_COSTS.get(criterion_category(criterion, criteria_types), MAX_CRITERION_COST)
+
+def upper_score(total, weights_sum, bonus):
+    """
+    Upper bound of the final score of a company whose weighted criterion
+    total is at most total (ceil bounds round() from above, the epsilon
+    absorbs float error)
+    """
+    return min(100, math.ceil(total / weights_sum - 1e-9) + bonus)
+
+def criterion_upper_bound(company, criterion, criteria_types):
+    """
+    Cheap upper bound of calculate_criterion_score for the text-similarity
+    criteria
     
-    # Sort and filter results
-    result = filter_and_sort_matches(matched_companies, min_score, max_results)
+    The bound runs the matcher itself with text_similarity_upper_bound, so a
+    company it bounds cannot fail on the criterion.
     
-    logger.info(f"=== MATCHING COMPLETE ===")
-    logger.info(f"Companies matched: {len(result)}")
-    if result:
-        logger.info(f"Top match: {result[0]['name']} ({result[0]['score']}%)")
-        logger.info(f"Score range: {result[-1]['score']}% - {result[0]['score']}%")
+    Returns:
+        The bound, or None when the criterion has no cheap bound or the
+        company cannot be bounded
+    """
+    category = criterion_category(criterion, criteria_types)
+    try:
+        if category == 'technical':
+            return match_technical(company, criterion, similarity=text_similarity_upper_bound)
+        if category == 'experience':
+            return match_experience(company, criterion, similarity=text_similarity_upper_bound)
+        if category in ('other', None):
+            return match_generic(company, criterion, similarity=text_similarity_upper_bound)
+    except Exception:
+        pass
+    return None
+
+def score_row(position, criteria, weights, vectors, weights_sum, bonuses):
+    """
+    Final score of one company from its criterion scores
     
-    return result
+    Returns:
+        (final_score, company_scores); company_scores is None when scoring failed
+    """
+    company_scores = {}
+    total_score = 0
+    failed = bonuses[position] is None
+    
+    # Weighted sum of the precomputed criterion scores
+    for criterion, weight, vector in zip(criteria, weights, vectors):
+        criterion_score = vector[position]
+        if criterion_score is None:
+            failed = True
+            break
+        company_scores[criterion['name']] = criterion_score
+        total_score += criterion_score * weight
+    
+    if failed:
+        return 50, None
+    
+    # Calculate final weighted score
+    final_score = round(total_score / weights_sum) if weights_sum > 0 else 50
+    
+    # Add historical and strategic bonuses
+    return min(100, final_score + bonuses[position]), company_scores
+
+def rank_candidates(companies, criteria, criteria_types, weights, vectors, keys, weights_sum, bonuses,
+                    min_score, max_results, score_vectors, trace, on_round=None):
+    """
+    Compute the criterion scores of the companies that can still be returned
+    
+    Criteria are evaluated in plan_criteria order. The cheap ones are scored
+    for every company and read through sorted access lists (utils.topk):
+    companies come in rounds by decreasing cheap scores and bonus, and the
+    rounds stop once the threshold (the best score a company not read yet
+    can reach) cannot make it into the result. Within a round, the expensive
+    criteria are evaluated company by company, best upper bound first, and a
+    company is dropped as soon as TopKSelection excludes its upper bound.
+    Pending criterion scores count as their criterion_upper_bound (or
+    MAX_CRITERION_SCORE), and a company whose scoring may still fail on an
+    unbounded criterion can always get the fallback 50.
+    
+    on_round, if given, is called with the rows kept so far after each round.
+    
+    Returns:
+        Sorted rows whose criterion scores are all computed
+    """
+    size = len(companies)
+    plan = plan_criteria(criteria, criteria_types, weights)
+    precomputed = []
+    expensive = []
+    for i in plan:
+        if criterion_cost(criteria[i], criteria_types) <= CHEAP_CRITERION_COST:
+            fill_criterion_vector(vectors[i], companies, range(size), criteria[i], criteria_types)
+            precomputed.append(i)
+        else:
+            expensive.append(i)
+    
+    if weights_sum <= 0:
+        for i in expensive:
+            fill_criterion_vector(vectors[i], companies, range(size), criteria[i], criteria_types)
+        return range(size)
+    
+    groups = company_groups(companies, score_vectors)
+    selection = TopKSelection(2 * max_results, min_score, groups)
+    
+    # Companies that failed a cheap criterion or their bonus are not in the
+    # sorted lists: they are read first
+    seen = {row for row in range(size) if bonuses[row] is None}
+    for i in precomputed:
+        seen.update(row for row, score in enumerate(vectors[i]) if score is None)
+    first_rows = sorted(seen)
+    
+    lists = [cached_sorted_access_list(score_vectors, keys[i], vectors[i]) for i in precomputed if weights[i] > 0]
+    lists.append(cached_sorted_access_list(score_vectors, 'bonuses', bonuses))
+    unbounded_total = 0
+    for i in expensive:
+        unbounded_total += weights[i] * MAX_CRITERION_SCORE
+    
+    rows = []
+    rounds = itertools.chain([(first_rows, ())], threshold_rounds(lists, seen))
+    for round_rows, last_scores in rounds:
+        trace.incr('rounds')
+        rank_round(companies, criteria, criteria_types, weights, vectors, weights_sum, bonuses,
+                   expensive, round_rows, groups, selection, rows, trace)
+        if on_round is not None and round_rows:
+            on_round(rows)
+        if not last_scores:
+            continue
+        
+        # Best final score of a company not read yet
+        total = unbounded_total
+        for i, score in zip((i for i in precomputed if weights[i] > 0), last_scores):
+            total += weights[i] * score
+        threshold = upper_score(total, weights_sum, last_scores[-1])
+        if expensive:
+            threshold = max(threshold, 50)
+        if selection.complete(threshold):
+            trace.set(threshold=threshold)
+            break
+    
+    trace.set(read=size - sum(selection.unseen.values()))
+    rows.sort()
+    return rows
+
+def rank_round(companies, criteria, criteria_types, weights, vectors, weights_sum, bonuses,
+               expensive, round_rows, groups, selection, rows, trace):
+    """
+    Evaluate the expensive criteria of the companies read in one round of
+    rank_candidates, best upper bound first; kept rows are appended to rows
+    """
+    # Known part of each weighted total, bounds of the pending criterion
+    # scores and best possible final score
+    ceilings = {}
+    bounds = []
+    for row in round_rows:
+        selection.seen(groups[row])
+        total = 0
+        pending = 0
+        failed = bonuses[row] is None
+        for i, (weight, vector) in enumerate(zip(weights, vectors)):
+            score = vector[row]
+            if score is UNSCORED:
+                ceiling = criterion_upper_bound(companies[row], criteria[i], criteria_types)
+                ceilings[row, i] = ceiling
+                pending += weight * (MAX_CRITERION_SCORE if ceiling is None else ceiling)
+            elif score is None:
+                failed = True
+            else:
+                total += weight * score
+        bound = 50 if failed else upper_score(total + pending, weights_sum, bonuses[row])
+        bounds.append((bound, row, total, pending, failed))
+    bounds.sort(key=lambda item: (-item[0], item[1]))
+    
+    for _, row, total, pending, failed in bounds:
+        group = groups[row]
+        steps = [i for i in expensive if vectors[i][row] is UNSCORED]
+        dropped = False
+        
+        while True:
+            if failed:
+                bound = 50
+            else:
+                bound = upper_score(total + pending, weights_sum, bonuses[row])
+                if any(ceilings[row, i] is None for i in steps):
+                    bound = max(bound, 50)
+            if selection.excludes(bound, group):
+                dropped = True
+                break
+            if failed or not steps:
+                break
+            i = steps.pop(0)
+            fill_criterion_vector(vectors[i], companies, (row,), criteria[i], criteria_types)
+            trace.incr('evaluations')
+            ceiling = ceilings[row, i]
+            pending -= weights[i] * (MAX_CRITERION_SCORE if ceiling is None else ceiling)
+            if vectors[i][row] is None:
+                failed = True
+            else:
+                total += weights[i] * vectors[i][row]
+        
+        if dropped:
+            trace.incr('pruned')
+            continue
+        
+        # Failed companies are kept with all their scores for the final loop
+        for i in steps:
+            fill_criterion_vector(vectors[i], companies, (row,), criteria[i], criteria_types)
+        rows.append(row)
+        
+        final_score, _ = score_row(row, criteria, weights, vectors, weights_sum, bonuses)
+        selection.add(final_score, group)
+
+def compute_bonus_vector(companies):
+    """
+    Compute calculate_company_bonuses for every company (None on failure)
+    """
+    vector = []
+    for company in companies:
+        try:
+            vector.append(calculate_company_bonuses(company))
+        except Exception as e:
+            logger.debug("Error computing bonuses for %s: %s", company.get('name', 'Unknown'), e)
+            vector.append(None)
+    return vector
 
 def analyze_criteria_types(criteria):
     """
@@ -135,6 +768,11 @@ def get_criterion_weight(criterion, criteria_types):
     """
     Determine the weight of a criterion based on its type and importance
     """
+    # Explicit weight set by the buyer takes precedence over the category weight
+    explicit_weight = criterion.get('weight')
+    if isinstance(explicit_weight, (int, float)) and not isinstance(explicit_weight, bool) and explicit_weight >= 0:
+        return explicit_weight
+    
     criterion_id = criterion['id']
     
     # Base weights by category
@@ -233,75 +871,86 @@ def match_geographic(company, criterion):
     if company_location == 'non spécifié' and company_geo_zone == 'non spécifié':
         return 0
     
-    criterion_name = criterion['name'].lower()
-    criterion_desc = criterion.get('description', '').lower()
-    
-    # Extract regions mentioned in criterion
-    regions_mentioned = []
-    
-    regions = {
-        'ile-de-france': ['ile-de-france', 'idf', 'paris', 'region parisienne'],
-        'nord': ['nord', 'hauts-de-france', 'nord-pas-de-calais', 'picardie'],
-        'est': ['est', 'grand est', 'alsace', 'lorraine', 'champagne'],
-        'ardennes': ['ardennes', 'charleville', 'sedan', 'chooz'],  # Special for Chooz
-        'ouest': ['ouest', 'bretagne', 'normandie', 'pays de loire'],
-        'sud-ouest': ['sud-ouest', 'nouvelle aquitaine', 'aquitaine', 'occitanie'],
-        'sud-est': ['sud-est', 'paca', 'rhone alpes', 'provence', 'alpes', 'cote d\'azur'],
-        'centre': ['centre', 'val de loire', 'auvergne', 'limousin', 'bourgogne']
-    }
-    
-    # Find mentioned regions
-    for region, keywords in regions.items():
-        if any(keyword in criterion_name or keyword in criterion_desc for keyword in keywords):
-            regions_mentioned.append(region)
-    
-    # Special case for Chooz nuclear plant
-    if 'chooz' in criterion_name or 'chooz' in criterion_desc:
-        regions_mentioned.append('ardennes')
+    # Distance to a named site ("à moins de 150 km du CNPE de Chooz")
+    radius_query = parse_radius_criterion(criterion)
+    if radius_query:
+        coordinates = get_gazetteer().coordinates_of(company.get('location', ''))
+        if coordinates:
+            site, radius = radius_query
+            distance = float(haversine_km([coordinates[0]], [coordinates[1]], site['lat'], site['lon'])[0])
+            if distance <= radius * NEARBY_RADIUS_FACTOR:
+                return radius_score(distance, radius)
+            return national_score(company_location, company_geo_zone)
+        # Companies without a known department fall back to the region keywords
+    
+    # Zones named in the criterion (area, department, commune or site names)
+    regions_mentioned = mentioned_zones(f"{criterion['name']} {criterion.get('description', '')}")
     
     # If specific regions are mentioned
     if regions_mentioned:
-        # Check if company is in one of these regions
+        # Check if company is in one of these regions (or in a part of them)
+        company_region = company_zone(company)
         for region in regions_mentioned:
-            if region in company_location or region in company_geo_zone:
-                return 100
-            
-            # Check for region keywords in company location
-            region_keywords = regions.get(region, [])
-            if any(keyword in company_location for keyword in region_keywords):
+            if company_region == region or company_region in SUBZONES.get(region, ()):
                 return 100
         
         # Company not in mentioned regions but might be in nearby area
         # For example, if Est is mentioned and company is in Ile-de-France
-        neighboring_regions = {
-            'ile-de-france': ['est', 'nord', 'centre'],
-            'nord': ['ile-de-france', 'est'],
-            'est': ['ile-de-france', 'centre', 'nord'],
-            'ardennes': ['est', 'nord'],
-            'ouest': ['ile-de-france', 'centre', 'sud-ouest'],
-            'sud-ouest': ['centre', 'ouest', 'sud-est'],
-            'sud-est': ['centre', 'sud-ouest'],
-            'centre': ['ile-de-france', 'est', 'ouest', 'sud-est', 'sud-ouest']
-        }
-        
         for region in regions_mentioned:
-            neighbors = neighboring_regions.get(region, [])
-            if any(neighbor in company_geo_zone.lower() for neighbor in neighbors):
+            if company_region in NEIGHBORING_ZONES.get(region, ()):
                 return 70  # Partial match for neighboring region
         
         # National company can still serve the region
-        if 'france' in company_geo_zone.lower() or 'national' in company_location:
-            return 60
-        
-        return 0  # Not in the requested region
+        return national_score(company_location, company_geo_zone)
     
     # If no specific region mentioned, assume national scope
     return 80
 
-def match_technical(company, criterion):
+@functools.lru_cache(maxsize=256)
+def mentioned_zones(criterion_text):
+    """
+    Lowercased zones named in a criterion text (cached: match_geographic
+    reads the same criterion for every company)
+    """
+    return tuple(zone.lower() for zone in get_gazetteer().zones_in(criterion_text))
+
+def company_zone(company):
+    """
+    Lowercased zone of a company: its geo_zone when it is a gazetteer zone,
+    otherwise the zone of its location (None if unknown)
+    """
+    gazetteer = get_gazetteer()
+    geo_zone = company.get('geo_zone', 'Non spécifié')
+    if geo_zone in gazetteer.zones:
+        return geo_zone.lower()
+    zone = gazetteer.zone_of(company.get('location', ''))
+    return zone.lower() if zone else None
+
+def radius_score(distance, radius):
+    """
+    Score of a company at distance km from the site of a radius criterion
+    """
+    if distance <= radius:
+        return 100
+    return 70  # Nearby, like a neighboring region
+
+def national_score(company_location, company_geo_zone):
+    """
+    Score of a company outside the requested area: national companies can still serve it
+    """
+    # Whole-value check: 'france' is also in 'ile-de-france'
+    if company_geo_zone.lower() == 'france' or 'national' in company_location:
+        return 60
+    return 0  # Not in the requested region
+
+def match_technical(company, criterion, similarity=None):
     """
     Match company against technical criteria
+    
+    similarity replaces calculate_text_similarity (criterion_upper_bound
+    passes text_similarity_upper_bound)
     """
+    similarity = similarity or calculate_text_similarity
     criterion_name = criterion['name'].lower()
     criterion_desc = criterion.get('description', '').lower()
     
@@ -314,7 +963,7 @@ def match_technical(company, criterion):
     # Check experience and capabilities
     experience = company.get('experience', '').lower()
     if experience != 'non spécifié':
-        text_similarity = calculate_text_similarity(criterion_desc, experience)
+        text_similarity = similarity(criterion_desc, experience)
         experience_score = int(text_similarity * 100)
         score += experience_score * 0.3  # 30% weight
     
@@ -324,7 +973,7 @@ def match_technical(company, criterion):
         max_contract_score = 0
         for contract in contracts:
             contract_desc = contract.get('description', '').lower()
-            text_similarity = calculate_text_similarity(criterion_desc, contract_desc)
+            text_similarity = similarity(criterion_desc, contract_desc)
             contract_score = int(text_similarity * 100)
             max_contract_score = max(max_contract_score, contract_score)
         
@@ -335,7 +984,7 @@ def match_technical(company, criterion):
     if capabilities:
         max_capability_score = 0
         for capability in capabilities:
-            text_similarity = calculate_text_similarity(criterion_desc, capability.lower())
+            text_similarity = similarity(criterion_desc, capability.lower())
             capability_score = int(text_similarity * 100)
             max_capability_score = max(max_capability_score, capability_score)
         
@@ -344,10 +993,14 @@ def match_technical(company, criterion):
     
     return min(100, int(score))
 
-def match_experience(company, criterion):
+def match_experience(company, criterion, similarity=None):
     """
     Match company against experience criteria
+    
+    similarity replaces calculate_text_similarity (criterion_upper_bound
+    passes text_similarity_upper_bound)
     """
+    similarity = similarity or calculate_text_similarity
     criterion_name = criterion['name'].lower()
     criterion_desc = criterion.get('description', '').lower()
     
@@ -356,7 +1009,7 @@ def match_experience(company, criterion):
     # Check formal experience description
     company_experience = company.get('experience', '').lower()
     if company_experience != 'non spécifié':
-        text_similarity = calculate_text_similarity(criterion_desc, company_experience)
+        text_similarity = similarity(criterion_desc, company_experience)
         experience_score += int(text_similarity * 60)  # Up to 60 points for experience text
     
     # Check contract history
@@ -370,7 +1023,7 @@ def match_experience(company, criterion):
         max_contract_score = 0
         for contract in contracts:
             contract_desc = contract.get('description', '').lower()
-            text_similarity = calculate_text_similarity(criterion_desc, contract_desc)
+            text_similarity = similarity(criterion_desc, contract_desc)
             contract_score = int(text_similarity * 40)  # Up to 40 points for relevant contracts
             max_contract_score = max(max_contract_score, contract_score)
         
@@ -596,10 +1249,14 @@ def match_capacity(company, criterion):
     
     return capacity_score
 
-def match_generic(company, criterion):
+def match_generic(company, criterion, similarity=None):
     """
     Generic matching for criteria that don't fit specific categories
+    
+    similarity replaces calculate_text_similarity (criterion_upper_bound
+    passes text_similarity_upper_bound)
     """
+    similarity = similarity or calculate_text_similarity
     criterion_name = criterion['name'].lower()
     criterion_desc = criterion.get('description', '').lower()
     
@@ -607,7 +1264,7 @@ def match_generic(company, criterion):
     company_profile = build_company_profile(company)
     
     # Calculate text similarity
-    text_similarity = calculate_text_similarity(criterion_name + ' ' + criterion_desc, company_profile)
+    text_similarity = similarity(criterion_name + ' ' + criterion_desc, company_profile)
     
     # Convert to score
     similarity_score = int(text_similarity * 80)  # Up to 80 points for text similarity
@@ -715,11 +1372,39 @@ def calculate_text_similarity(text1, text2):
     jaccard = len(common_words) / len(all_words)
     
     # Calculate sequence similarity (for word order)
-    sequence = SequenceMatcher(None, text1, text2).ratio()
+    sequence = get_sequence_matcher()(None, text1, text2).ratio()
     
     # Return weighted average (more weight to Jaccard for semantic meaning)
     return (jaccard * 0.7) + (sequence * 0.3)
 
+def text_similarity_upper_bound(text1, text2):
+    """
+    Upper bound of calculate_text_similarity without the sequence alignment
+    (the character multiset ratio, like SequenceMatcher.quick_ratio, bounds
+    ratio from above)
+    """
+    if not text1 or not text2:
+        return 0
+    
+    text1 = re.sub(r'[^\w\s]', ' ', text1.lower())
+    text2 = re.sub(r'[^\w\s]', ' ', text2.lower())
+    
+    words1 = extract_significant_words(text1)
+    words2 = extract_significant_words(text2)
+    
+    common_words = set(words1).intersection(set(words2))
+    all_words = set(words1).union(set(words2))
+    
+    if not all_words:
+        return 0
+    
+    jaccard = len(common_words) / len(all_words)
+    
+    matches = sum((Counter(text1) & Counter(text2)).values())
+    sequence = 2.0 * matches / (len(text1) + len(text2))
+    
+    return (jaccard * 0.7) + (sequence * 0.3)
+
 def extract_significant_words(text):
     """
     Extract significant words from text, removing common words
@@ -0,0 +1,456 @@
+"""
+company_table.py - Compact column storage of the company panel for EDF Panel Entreprises
+
+The panel is stored as one column per field instead of one dict per company:
+- categorical fields (domain, geo_zone, location, ca, employees) are
+  dictionary-encoded in array('I') columns; code 0 is the "Non spécifié"
+  sentinel
+- certification, keyword and capability lists are interned tuples (companies
+  with the same list share one tuple); certifications are also kept as an
+  integer bitmask over the certification vocabulary for set queries
+- contracts are flat (type, description, type, description...) tuples of
+  interned strings, contact
+  details tuples of items; empty contract lists and "Non spécifié"
+  experiences are None
+- any other field is kept as is in a sparse per-row dictionary
+
+Rows are exposed as read-only CompanyRecord mappings, so code written for
+company dicts (company['name'], company.get('keywords', []), {**company})
+works unchanged; to_dict() / to_dicts() give plain dicts for JSON responses.
+Reading a field decodes nothing: list fields are the interned tuples, contact
+details and contracts are FrozenDict views built once per distinct value and
+shared by every read. Tables are immutable: the with_* methods return a new
+table sharing the vocabularies and tuple pool, which only ever grow.
+"""
+
+import sys
+import copy
+from array import array
+from collections.abc import Mapping, Sequence
+
+NOT_SPECIFIED = 'Non spécifié'
+
+# Field order of the dicts built by excel_parser
+FIELDS = (
+    'id', 'name', 'domain', 'location', 'certifications', 'ca', 'employees',
+    'contact', 'experience', 'lots_marches', 'capabilities', 'score',
+    'geo_zone', 'keywords'
+)
+FIELD_BITS = {field: 1 << i for i, field in enumerate(FIELDS)}
+
+CATEGORICAL_FIELDS = ('domain', 'location', 'ca', 'employees', 'geo_zone')
+LIST_FIELDS = ('certifications', 'keywords', 'capabilities')
+PLAIN_FIELDS = ('id', 'name', 'score')
+
+
+class Vocabulary:
+    """Append-only string <-> code mapping"""
+
+    def __init__(self, values=()):
+        self.values = []
+        self.codes = {}
+        for value in values:
+            self.encode(value)
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            value = sys.intern(value)
+            self.values.append(value)
+            self.codes[value] = code
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+class FrozenDict(dict):
+    """
+    Read-only dict returned for contact details and contracts: one instance
+    is shared by every read of the value (copy it with dict() to change it).
+    JSON encoders see a plain dict.
+    """
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Company values are read-only, copy them with dict() first")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+def _contact_view(items):
+    return FrozenDict(items)
+
+
+def _contracts_view(contracts):
+    pairs = iter(contracts)
+    return tuple(FrozenDict(type=contract_type, description=description)
+                 for contract_type, description in zip(pairs, pairs))
+
+
+def _thawed(value):
+    # Plain (mutable) copy of a decoded value, for to_dict()
+    if isinstance(value, FrozenDict):
+        return dict(value)
+    if isinstance(value, tuple):
+        return [dict(item) if isinstance(item, FrozenDict) else item for item in value]
+    return value
+
+
+class TuplePool:
+    """Append-only pool of interned string tuples and of their decoded views"""
+
+    def __init__(self):
+        self.tuples = {(): ()}
+        self.views = {'contact': {}, 'lots_marches': {}}
+
+    def intern(self, items):
+        key = tuple(items)
+        pooled = self.tuples.get(key)
+        if pooled is None:
+            pooled = tuple(sys.intern(item) for item in key)
+            self.tuples[pooled] = pooled
+        return pooled
+
+    def view(self, field, encoded, build):
+        """Read-only value of a field decoded by build(encoded), built once per distinct encoded value"""
+        views = self.views[field]
+        try:
+            view = views.get(encoded)
+        except TypeError:
+            # Unhashable contact value (a list...): not shared
+            return build(encoded)
+        if view is None:
+            view = views.setdefault(encoded, build(encoded))
+        return view
+
+
+def _is_contract(item):
+    # Contracts built by excel_parser.extract_contracts: {'type': str, 'description': str}
+    return (isinstance(item, dict) and list(item) == ['type', 'description']
+            and isinstance(item['type'], str) and isinstance(item['description'], str))
+
+
+class CompanyRecord(Mapping):
+    """Read-only dict-like view of one row of a CompanyTable"""
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, key):
+        return self._table.value(self._row, key)
+
+    def get(self, key, default=None):
+        try:
+            return self._table.value(self._row, key)
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self._table.has(self._row, key)
+
+    def __iter__(self):
+        return iter(self._table.keys(self._row))
+
+    def __len__(self):
+        return len(self._table.keys(self._row))
+
+    def to_dict(self):
+        """Plain dict copy of the record"""
+        return self._table.row_dict(self._row)
+
+    def __repr__(self):
+        return f"CompanyRecord({self.to_dict()!r})"
+
+
+class CompanyTable(Sequence):
+    """Immutable column store of companies"""
+
+    def __init__(self, vocabularies=None, pool=None):
+        self.vocabularies = vocabularies or {
+            **{field: Vocabulary([NOT_SPECIFIED]) for field in CATEGORICAL_FIELDS},
+            'certifications': Vocabulary()
+        }
+        self.pool = pool or TuplePool()
+        self._present = array('I')
+        self._plain = {field: [] for field in PLAIN_FIELDS}
+        self._codes = {field: array('I') for field in CATEGORICAL_FIELDS}
+        self._lists = {field: [] for field in LIST_FIELDS}
+        self._cert_masks = []
+        self._experience = []
+        self._contact = []
+        self._contracts = []
+        self._extras = {}
+        self._index = {}
+        # Built on demand by utils.cert_index.certification_index,
+        # utils.geo_index.geo_index and utils.dedupe.dedupe_index
+        self._certification_index = None
+        self._geo_index = None
+        self._dedupe_index = None
+
+    @classmethod
+    def from_companies(cls, companies):
+        """Build a table from dicts or records"""
+        if isinstance(companies, CompanyTable):
+            return companies
+        table = cls()
+        for company in companies:
+            table._append(company)
+        return table
+
+    # ------------------------------------------------------------------
+    # Encoding
+    # ------------------------------------------------------------------
+
+    def _append(self, company):
+        row = len(self._present)
+        present = 0
+        extras = None
+
+        for key, value in company.items():
+            bit = FIELD_BITS.get(key)
+            if bit is None or not self._can_encode(key, value):
+                extras = extras or {}
+                extras[key] = value
+                continue
+            present |= bit
+
+        self._present.append(present)
+
+        for field in PLAIN_FIELDS:
+            self._plain[field].append(company[field] if present & FIELD_BITS[field] else None)
+
+        for field in CATEGORICAL_FIELDS:
+            if present & FIELD_BITS[field]:
+                self._codes[field].append(self.vocabularies[field].encode(company[field]))
+            else:
+                self._codes[field].append(0)
+
+        for field in LIST_FIELDS:
+            items = company[field] if present & FIELD_BITS[field] else ()
+            self._lists[field].append(self.pool.intern(items))
+
+        mask = 0
+        vocabulary = self.vocabularies['certifications']
+        for certification in self._lists['certifications'][row]:
+            mask |= 1 << vocabulary.encode(certification)
+        self._cert_masks.append(mask)
+
+        experience = company['experience'] if present & FIELD_BITS['experience'] else None
+        if experience == NOT_SPECIFIED:
+            experience = None
+        self._experience.append(sys.intern(experience) if experience else experience)
+
+        contact = company['contact'] if present & FIELD_BITS['contact'] else None
+        self._contact.append(tuple(contact.items()) if contact is not None else None)
+
+        contracts = company['lots_marches'] if present & FIELD_BITS['lots_marches'] else None
+        self._contracts.append(
+            tuple(sys.intern(c[field]) for c in contracts for field in ('type', 'description')) if contracts else None
+        )
+
+        if extras:
+            self._extras[row] = extras
+
+        company_id = self._plain['id'][row]
+        if company_id is not None:
+            self._index.setdefault(company_id, row)
+
+    @staticmethod
+    def _can_encode(key, value):
+        # Values that do not fit the column type are kept verbatim in the extras
+        if key in CATEGORICAL_FIELDS or key == 'experience':
+            return isinstance(value, str)
+        if key in LIST_FIELDS:
+            return isinstance(value, (list, tuple)) and all(isinstance(item, str) for item in value)
+        if key == 'contact':
+            return value is None or isinstance(value, Mapping)
+        if key == 'lots_marches':
+            return isinstance(value, (list, tuple)) and all(_is_contract(item) for item in value)
+        return True
+
+    # ------------------------------------------------------------------
+    # Decoding
+    # ------------------------------------------------------------------
+
+    def has(self, row, key):
+        bit = FIELD_BITS.get(key)
+        if bit is not None and self._present[row] & bit:
+            return True
+        extras = self._extras.get(row)
+        return extras is not None and key in extras
+
+    def value(self, row, key):
+        """
+        Value of one field of a row (KeyError if the row does not have it):
+        tuples for list fields, shared FrozenDict views for contact details
+        and contracts
+        """
+        bit = FIELD_BITS.get(key)
+        if bit is None or not self._present[row] & bit:
+            extras = self._extras.get(row)
+            if extras is not None and key in extras:
+                return extras[key]
+            raise KeyError(key)
+
+        if key in self._plain:
+            return self._plain[key][row]
+        if key in self._codes:
+            return self.vocabularies[key].values[self._codes[key][row]]
+        if key in self._lists:
+            return self._lists[key][row]
+        if key == 'experience':
+            experience = self._experience[row]
+            return NOT_SPECIFIED if experience is None else experience
+        if key == 'contact':
+            contact = self._contact[row]
+            return self.pool.view('contact', contact, _contact_view) if contact is not None else None
+        if key == 'lots_marches':
+            contracts = self._contracts[row]
+            if not contracts:
+                return ()
+            return self.pool.view('lots_marches', contracts, _contracts_view)
+        raise KeyError(key)
+
+    def keys(self, row):
+        present = self._present[row]
+        keys = [field for field in FIELDS if present & FIELD_BITS[field]]
+        extras = self._extras.get(row)
+        if extras:
+            keys.extend(extras)
+        return keys
+
+    def row_dict(self, row):
+        return {key: _thawed(self.value(row, key)) for key in self.keys(row)}
+
+    def certification_mask(self, row):
+        """Certifications of a row as a bitmask over vocabularies['certifications']"""
+        return self._cert_masks[row]
+
+    def code(self, row, field):
+        """Raw code of a categorical field (0 is "Non spécifié")"""
+        return self._codes[field][row]
+
+    # ------------------------------------------------------------------
+    # Sequence protocol
+    # ------------------------------------------------------------------
+
+    def __len__(self):
+        return len(self._present)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [CompanyRecord(self, row) for row in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return CompanyRecord(self, index)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield CompanyRecord(self, row)
+
+    def row_of(self, company_id):
+        """Row of the first company with this id, or None"""
+        return self._index.get(company_id)
+
+    def to_dicts(self):
+        """Plain dict copy of every company (JSON responses)"""
+        return [self.row_dict(row) for row in range(len(self))]
+
+    # ------------------------------------------------------------------
+    # Copy-on-write changes
+    # ------------------------------------------------------------------
+
+    def _columns(self):
+        return [
+            self._present, *self._plain.values(), *self._codes.values(), *self._lists.values(),
+            self._cert_masks, self._experience, self._contact, self._contracts
+        ]
+
+    def _copy(self):
+        table = CompanyTable(self.vocabularies, self.pool)
+        table._present = array('I', self._present)
+        table._plain = {field: list(column) for field, column in self._plain.items()}
+        table._codes = {field: array('I', column) for field, column in self._codes.items()}
+        table._lists = {field: list(column) for field, column in self._lists.items()}
+        table._cert_masks = list(self._cert_masks)
+        table._experience = list(self._experience)
+        table._contact = list(self._contact)
+        table._contracts = list(self._contracts)
+        table._extras = dict(self._extras)
+        table._index = dict(self._index)
+        return table
+
+    def _reindex(self):
+        ids = self._plain['id']
+        # Reversed so that the first row of a duplicated id wins
+        self._index = {
+            company_id: row
+            for company_id, row in zip(reversed(ids), range(len(ids) - 1, -1, -1))
+            if company_id is not None
+        }
+
+    def with_appended(self, companies):
+        """New table with companies added at the end"""
+        table = self._copy()
+        for company in companies:
+            table._append(company)
+        return table
+
+    def with_replaced(self, row, company):
+        """New table where one row is replaced by company"""
+        return self.with_changes(replaced={row: company})
+
+    def without(self, row):
+        """New table without one row"""
+        return self.with_changes(removed=[row])
+
+    def with_changes(self, replaced=None, removed=(), appended=()):
+        """
+        New table with several changes made on one copy: rows replaced
+        ({row: company}, rows of this table), then rows removed, then
+        companies appended
+        """
+        table = self._copy()
+
+        if replaced:
+            encoded = CompanyTable(self.vocabularies, self.pool)
+            for company in replaced.values():
+                encoded._append(company)
+            encoded_columns = encoded._columns()
+            for source_row, row in enumerate(replaced):
+                for column, source in zip(table._columns(), encoded_columns):
+                    column[row] = source[source_row]
+                table._extras.pop(row, None)
+                if source_row in encoded._extras:
+                    table._extras[row] = encoded._extras[source_row]
+
+        for row in sorted(set(removed), reverse=True):
+            for column in table._columns():
+                del column[row]
+            table._extras = {
+                (r - 1 if r > row else r): extras
+                for r, extras in table._extras.items() if r != row
+            }
+
+        table._reindex()
+        for company in appended:
+            table._append(company)
+        return table
@@ -0,0 +1,221 @@
+"""
+data_sources.py - Panel workbook registry and hot reload for EDF Panel Entreprises
+
+The workbooks making up the company panel are declared in a JSON registry
+(data/sources.json by default, PANEL_SOURCES_FILE to override):
+
+    {
+        "sources": [
+            {
+                "name": "acms",
+                "path": "data/ACMS Publipostage FINAL V4.xlsx",
+                "sheet": "TOTAL",
+                "columns": {"company_name": ["RS"]},
+                "enabled": true
+            },
+            {
+                "name": "regions",
+                "path": "data/regions/*.xlsx",
+                "sheets": ["Nord", "Est"]
+            }
+        ],
+        "watch": {"enabled": true, "intervalSeconds": 5}
+    }
+
+"path" may be a glob pattern and "sheets" lists several sheets to read from
+each workbook (the sheet is detected when neither "sheet" nor "sheets" is
+given). "columns" overrides the columns detected by
+excel_parser.identify_columns for the listed fields. All sheets are parsed in
+parallel and merged by utils.ingest. A SourceWatcher polls the registered
+files and reloads the panel in the background when one of them changes.
+"""
+
+import os
+import glob
+import json
+import threading
+import logging
+
+from utils.ingest import ingest
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGISTRY_PATH = os.environ.get('PANEL_SOURCES_FILE', 'data/sources.json')
+
+# Used when no registry file exists (historical file names, no directory scan)
+DEFAULT_SOURCES = [
+    {'name': 'daci', 'path': 'data/DACI GP_ORANO DS_Nettoyages des échangeurs à plaques_CNPE CHOOZ signé .xlsx'},
+    {'name': 'acms', 'path': 'data/ACMS Publipostage FINAL V4.xlsx'}
+]
+
+DEFAULT_WATCH = {'enabled': False, 'intervalSeconds': 5}
+
+
+def normalize_source(source, index=0):
+    """Fill the optional fields of a source declaration"""
+    sheets = source.get('sheets') or [source.get('sheet')]
+    return {
+        'name': source.get('name') or f"source_{index + 1}",
+        'path': source['path'],
+        'sheets': sheets,
+        'columns': source.get('columns') or {},
+        'enabled': source.get('enabled', True)
+    }
+
+
+def load_registry(registry_path=None):
+    """
+    Read the data-source registry
+
+    Returns:
+        Dictionary with 'sources' (normalized list) and 'watch' settings
+    """
+    registry_path = registry_path or DEFAULT_REGISTRY_PATH
+
+    if os.path.exists(registry_path):
+        with open(registry_path, 'r', encoding='utf-8') as f:
+            registry = json.load(f)
+        logger.info("Data-source registry loaded from %s", registry_path)
+    else:
+        logger.warning("No data-source registry at %s, using default sources", registry_path)
+        registry = {'sources': DEFAULT_SOURCES}
+
+    return {
+        'sources': [normalize_source(source, i) for i, source in enumerate(registry.get('sources', []))],
+        'watch': {**DEFAULT_WATCH, **registry.get('watch', {})}
+    }
+
+
+def source_files(source):
+    """Return the existing files of a source (its path may be a glob pattern)"""
+    if glob.has_magic(source['path']):
+        return sorted(glob.glob(source['path']))
+    return [source['path']] if os.path.exists(source['path']) else []
+
+
+def source_jobs(sources):
+    """Expand the enabled sources into one ingestion job per workbook"""
+    jobs = []
+    for source in sources:
+        if not source['enabled']:
+            continue
+
+        files = source_files(source)
+        if not files:
+            logger.warning("Data source %s not found: %s", source['name'], source['path'])
+
+        for path in files:
+            jobs.append({'source': source['name'], 'path': path, 'sheets': source['sheets'], 'columns': source['columns']})
+    return jobs
+
+
+def load_panel(sources):
+    """
+    Parse and merge the panel from all the registered sources
+
+    Returns:
+        List of companies (empty if no source could be parsed)
+    """
+    return ingest(source_jobs(sources))
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+class SourceWatcher:
+    """
+    Polls the registered files and reloads the panel when one changes
+
+    The reload runs in the watcher thread: the new panel is parsed completely
+    and then handed to on_reload (PanelStore.rebase, which applies the API
+    edits again under the store lock), so live requests keep using the
+    previous panel until the swap and no edit made meanwhile is lost.
+
+    When on_change is set, a change only calls on_change: the caller reloads
+    (prefork mode, where the gunicorn master reloads and replaces its
+    workers).
+    """
+
+    def __init__(self, sources, on_reload, interval_seconds=5, on_change=None):
+        self.sources = sources
+        self.on_reload = on_reload
+        self.interval_seconds = interval_seconds
+        self.on_change = on_change
+        self._signatures = self._scan()
+        self._pending = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._reload_lock = threading.Lock()
+
+    def _scan(self):
+        return {
+            path: _file_signature(path)
+            for source in self.sources if source['enabled']
+            for path in source_files(source)
+        }
+
+    def start(self):
+        """Start polling in a daemon thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='panel-source-watcher', daemon=True)
+            self._thread.start()
+            logger.info("Watching %d data sources every %ss", len(self._signatures), self.interval_seconds)
+
+    def stop(self):
+        """Stop polling"""
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self.poll()
+
+    def poll(self):
+        """check(), logging errors instead of raising them"""
+        try:
+            return self.check()
+        except Exception as e:
+            logger.error(f"Data source watcher error: {e}")
+            return False
+
+    def check(self):
+        """
+        Poll once; reload when a change has been stable for one interval
+        (so that a file still being written is not parsed)
+
+        Returns:
+            True if the panel was reloaded (or on_change called)
+        """
+        signatures = self._scan()
+        if signatures == self._signatures:
+            self._pending = None
+            return False
+
+        if self._pending != signatures:
+            self._pending = signatures
+            return False
+
+        self._signatures = signatures
+        self._pending = None
+        if self.on_change is not None:
+            logger.info("Data sources changed, reload requested")
+            self.on_change()
+            return True
+        return self.reload()
+
+    def reload(self):
+        """Parse the sources and hand the new panel to on_reload"""
+        with self._reload_lock:
+            companies = load_panel(self.sources)
+            if not companies:
+                logger.warning("Reload produced no companies, keeping the current panel")
+                return False
+
+            self.on_reload(companies)
+            logger.info("Panel reloaded: %d companies", len(companies))
+            return True
@@ -0,0 +1,545 @@
+"""
+dedupe.py - Near-duplicate company detection for EDF Panel Entreprises
+
+Candidate pairs come from three sources, all near-linear in the panel size:
+- blocking on exact keys (normalized name, contact email, phone number)
+- MinHash signatures of the name character trigrams, bucketed with LSH
+  (PANEL_DEDUPE_BANDS bands of PANEL_DEDUPE_ROWS rows)
+- oversized blocks and buckets (shared switchboard numbers, very common
+  names) are skipped to keep the pair count bounded
+
+Candidates are verified with the trigram Jaccard similarity of the names,
+grouped with union-find and merged with merge_company_records: the first
+record of a group is kept (existing panel records come first) and completed
+with the others.
+
+An import is not deduplicated with the whole panel again: dedupe_new looks
+the new records up in a DedupeIndex of the panel (its blocking keys and LSH
+buckets, cached on the table) and only compares them with the rows they
+share a key or a bucket with.
+
+A name alone is not enough: regional agencies share their company name.
+Pairs found by name (same key or similar names) are linked only when their
+locations agree (same department, or one of them unknown); otherwise they
+are reported for review instead of merged. A shared email or phone number
+links companies whatever their location.
+"""
+
+import os
+import re
+import zlib
+import logging
+import threading
+from collections import defaultdict
+
+from utils.excel_parser import normalize_text
+from utils.lazy_imports import get_numpy
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Name similarity (trigram Jaccard) above which two companies are duplicates
+NAME_THRESHOLD = float(os.environ.get('PANEL_DEDUPE_THRESHOLD', '0.8'))
+
+# Lower name similarity accepted when the email or phone number is shared
+CONTACT_NAME_THRESHOLD = 0.3
+
+LSH_BANDS = int(os.environ.get('PANEL_DEDUPE_BANDS', '16'))
+LSH_ROWS = int(os.environ.get('PANEL_DEDUPE_ROWS', '4'))
+
+# Blocks or buckets larger than this are ignored (generic values)
+MAX_BLOCK_SIZE = 50
+
+# Companies hashed per numpy batch when computing signatures
+SIGNATURE_CHUNK = 5000
+
+_PRIME = 2147483647
+_SEED = 20240601
+
+# Fields merged as lists when two records describe the same company
+LIST_FIELDS = ('certifications', 'lots_marches', 'capabilities', 'keywords')
+
+MISSING_VALUES = (None, '', 'Non spécifié', 'Autre')
+
+# Legal forms and generic words ignored when comparing names
+LEGAL_FORMS = {
+    'sa', 'sas', 'sasu', 'sarl', 'eurl', 'sci', 'snc', 'scop', 'gie',
+    'ets', 'etablissements', 'ste', 'societe', 'cie', 'compagnie', 'et'
+}
+
+
+def merge_company_records(primary, duplicate):
+    """Complete primary with the fields of duplicate (primary wins on conflicts)"""
+    for key, value in duplicate.items():
+        if key in LIST_FIELDS:
+            merged = list(primary.get(key) or [])
+            for item in value or []:
+                if item not in merged:
+                    merged.append(item)
+            primary[key] = merged
+        elif key == 'contact':
+            contact = dict(value or {})
+            contact.update({k: v for k, v in (primary.get('contact') or {}).items() if v not in MISSING_VALUES})
+            primary['contact'] = contact
+        elif primary.get(key) in MISSING_VALUES and value not in MISSING_VALUES:
+            primary[key] = value
+    return primary
+
+
+def normalize_company_name(name):
+    """Normalized company name without legal form ("Techni-Maintenance SAS" -> "techni maintenance")"""
+    tokens = normalize_text(name or '').split()
+    significant = [token for token in tokens if token not in LEGAL_FORMS]
+    return ' '.join(significant or tokens)
+
+
+def name_key(name):
+    """Normalized name with spaces removed ("TECHNI-MAINTENANCE SAS" -> "technimaintenance")"""
+    return normalize_company_name(name).replace(' ', '')
+
+
+def trigrams(compact):
+    """Character trigrams of a name key"""
+    if len(compact) < 3:
+        return {compact} if compact else set()
+    return {compact[i:i + 3] for i in range(len(compact) - 2)}
+
+
+def jaccard(first, second):
+    """Jaccard similarity of two sets"""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+_DEPARTMENT_CODE = re.compile(r'\((\d{2,3}|2[ab])\)\s*$')
+
+
+def location_key(company):
+    """Department code of a company ("Haut-Rhin (68)" -> "68"), else its normalized location, None when unknown"""
+    location = company.get('location')
+    if location in MISSING_VALUES:
+        return None
+    normalized = normalize_text(location)
+    match = _DEPARTMENT_CODE.search(str(location).strip().lower())
+    return match.group(1) if match else normalized or None
+
+
+def contact_keys(company):
+    """Return (email, phone) blocking keys of a company, None when missing"""
+    contact = company.get('contact') or {}
+
+    email = (contact.get('email') or '').strip().lower() or None
+
+    digits = re.sub(r'\D', '', contact.get('phone') or '')
+    # Last 9 digits: same number written 01..., +33 1... or 0033 1...
+    phone = digits[-9:] if len(digits) >= 9 else None
+
+    return email, phone
+
+
+def minhash_signatures(shingle_sets):
+    """
+    MinHash signatures (one row per non-empty shingle set)
+
+    Returns:
+        numpy uint64 array of shape (len(shingle_sets), LSH_BANDS * LSH_ROWS);
+        rows of empty sets are left at the maximum value
+    """
+    np = get_numpy()
+    num_perm = LSH_BANDS * LSH_ROWS
+    # Multiply-shift hashing: (a * x + b) mod 2^64, keep the high 32 bits
+    rng = np.random.RandomState(_SEED)
+    a = (rng.randint(0, 2 ** 62, size=num_perm, dtype=np.int64).astype(np.uint64) << np.uint64(1)) | np.uint64(1)
+    b = rng.randint(0, 2 ** 62, size=num_perm, dtype=np.int64).astype(np.uint64)
+    a, b = a[:, None], b[:, None]
+    shift = np.uint64(32)
+
+    signatures = np.full((len(shingle_sets), num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+    shingle_hashes = {}
+
+    for start in range(0, len(shingle_sets), SIGNATURE_CHUNK):
+        rows = [i for i in range(start, min(start + SIGNATURE_CHUNK, len(shingle_sets))) if shingle_sets[i]]
+        if not rows:
+            continue
+
+        lengths = [len(shingle_sets[i]) for i in rows]
+        flat = [shingle for i in rows for shingle in shingle_sets[i]]
+        for shingle in set(flat).difference(shingle_hashes):
+            shingle_hashes[shingle] = zlib.crc32(shingle.encode('utf-8')) & 0x7fffffff
+
+        hashes = np.array([shingle_hashes[shingle] for shingle in flat], dtype=np.uint64)[None, :]
+        permuted = (a * hashes + b) >> shift
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        signatures[rows] = np.minimum.reduceat(permuted, offsets, axis=1).T
+
+    return signatures
+
+
+def band_keys(signatures):
+    """
+    LSH bucket key of every signature in every band
+
+    The rows of each band are folded into one 64-bit key so that bucketing
+    is a numpy sort instead of a Python dictionary per band.
+
+    Returns:
+        numpy uint64 array of shape (len(signatures), LSH_BANDS)
+    """
+    np = get_numpy()
+    multipliers = np.random.RandomState(_SEED + 1).randint(1, _PRIME, size=LSH_ROWS).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        return (signatures.reshape(len(signatures), LSH_BANDS, LSH_ROWS) * multipliers).sum(axis=2, dtype=np.uint64)
+
+
+def lsh_buckets(signatures):
+    """Yield the LSH buckets (row index lists) holding at least two signatures"""
+    np = get_numpy()
+    keys_by_band = band_keys(signatures)
+
+    for band in range(LSH_BANDS):
+        keys = keys_by_band[:, band]
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        boundaries = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(keys)]))
+
+        for start in np.flatnonzero(ends - starts > 1):
+            yield order[starts[start]:ends[start]].tolist()
+
+
+def blocking_keys(company, key=None):
+    """Exact blocking keys of a company: ('name', key), ('email', ...), ('phone', ...)"""
+    key = name_key(company.get('name')) if key is None else key
+    keys = [('name', key)] if key else []
+    email, phone = contact_keys(company)
+    if email:
+        keys.append(('email', email))
+    if phone:
+        keys.append(('phone', phone))
+    return keys
+
+
+class _UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            # The smallest index stays the root (first occurrence wins)
+            if root_j < root_i:
+                root_i, root_j = root_j, root_i
+            self.parent[root_j] = root_i
+
+
+def find_duplicate_groups(companies, threshold=None):
+    """
+    Find groups of near-duplicate companies
+
+    Returns:
+        (groups, reasons, review): groups is a list of sorted index lists with
+        at least two members; reasons maps a member index to why it matched;
+        review lists the (i, j, reason) pairs with matching names but
+        different locations, left unmerged
+    """
+    threshold = NAME_THRESHOLD if threshold is None else threshold
+
+    with span('dedupe', companies=len(companies)) as trace:
+        keys = [name_key(company.get('name')) for company in companies]
+        shingles = [trigrams(key) for key in keys]
+        locations = [location_key(company) for company in companies]
+        union_find = _UnionFind(len(companies))
+        reasons = {}
+        review = []
+        checked = set()
+
+        def link(i, j, reason):
+            union_find.union(i, j)
+            reasons.setdefault(j, reason)
+            reasons.setdefault(i, reason)
+
+        def same_place(i, j):
+            return locations[i] is None or locations[j] is None or locations[i] == locations[j]
+
+        def verify(i, j, reason, min_similarity, located=False):
+            # located: name evidence only, the locations must agree
+            pair = (i, j) if i < j else (j, i)
+            if pair in checked:
+                return
+            checked.add(pair)
+            trace.incr('pairs')
+            similarity = jaccard(shingles[i], shingles[j])
+            if similarity < min_similarity:
+                return
+            if located and not same_place(i, j):
+                review.append((pair[0], pair[1], f"{reason} ({similarity:.2f}), different location"))
+            else:
+                link(pair[0], pair[1], f"{reason} ({similarity:.2f})")
+
+        # Blocking on exact keys
+        blocks = defaultdict(list)
+        for i, company in enumerate(companies):
+            for block in blocking_keys(company, keys[i]):
+                blocks[block].append(i)
+
+        for (kind, _), members in blocks.items():
+            if len(members) < 2:
+                continue
+            if kind == 'name':
+                # Same normalized name: duplicates within one location
+                # (unknown locations join the first one), whatever the
+                # block size; other locations are agencies to review
+                places = {}
+                for i in members:
+                    if locations[i] is not None:
+                        places.setdefault(locations[i], []).append(i)
+                place_groups = list(places.values()) or [[]]
+                place_groups[0].extend(i for i in members if locations[i] is None)
+                for group in place_groups:
+                    group.sort()
+                    for j in group[1:]:
+                        link(group[0], j, 'name')
+                for group in place_groups[1:]:
+                    review.append((place_groups[0][0], group[0], 'name, different location'))
+            elif len(members) <= MAX_BLOCK_SIZE:
+                for x, i in enumerate(members):
+                    for j in members[x + 1:]:
+                        verify(i, j, kind, CONTACT_NAME_THRESHOLD)
+            else:
+                trace.incr('skipped_blocks')
+
+        # MinHash LSH on name trigrams
+        if len(companies) > 1:
+            signatures = minhash_signatures(shingles)
+            valid = [i for i, company_shingles in enumerate(shingles) if company_shingles]
+            for members in lsh_buckets(signatures[valid]):
+                if len(members) > MAX_BLOCK_SIZE:
+                    trace.incr('skipped_buckets')
+                    continue
+                members = [valid[m] for m in members]
+                for x, i in enumerate(members):
+                    for j in members[x + 1:]:
+                        verify(i, j, 'similar name', threshold, located=True)
+
+        groups = defaultdict(list)
+        for i in range(len(companies)):
+            groups[union_find.find(i)].append(i)
+
+        duplicate_groups = [members for members in groups.values() if len(members) > 1]
+        # One review entry per pair of groups; groups merged meanwhile
+        # through a shared contact need none
+        reviewed = {}
+        for i, j, reason in review:
+            roots = tuple(sorted((union_find.find(i), union_find.find(j))))
+            if roots[0] != roots[1]:
+                reviewed.setdefault(roots, (min(i, j), max(i, j), reason))
+        review = list(reviewed.values())
+        trace.set(groups=len(duplicate_groups), review=len(review))
+
+    return duplicate_groups, reasons, review
+
+
+def _review_entries(companies, review_pairs):
+    return [
+        {
+            'reason': reason,
+            'companies': [
+                {'id': companies[k]['id'], 'name': companies[k]['name'], 'location': companies[k].get('location')}
+                for k in (i, j)
+            ]
+        }
+        for i, j, reason in review_pairs
+    ]
+
+
+def _merge_groups(companies, groups, reasons):
+    # Merged copy of the first member of each group, the absorbed indexes
+    # and one report entry per group
+    primaries = {}
+    absorbed = set()
+    report = []
+
+    for members in groups:
+        primary = dict(companies[members[0]])
+        for i in members[1:]:
+            merge_company_records(primary, companies[i])
+            absorbed.add(i)
+
+        primaries[members[0]] = primary
+        report.append({
+            'id': primary['id'],
+            'name': primary['name'],
+            'merged': [
+                {'id': companies[i]['id'], 'name': companies[i]['name'], 'reason': reasons.get(i)}
+                for i in members[1:]
+            ]
+        })
+
+    return primaries, absorbed, report
+
+
+def dedupe_companies(companies, threshold=None):
+    """
+    Merge near-duplicate companies
+
+    Merged records are copies: the input dictionaries are not modified.
+
+    Returns:
+        (companies, report, review): the deduplicated list, in input order,
+        one report entry per merged group, and the same-name companies at
+        different locations kept apart for review
+    """
+    groups, reasons, review_pairs = find_duplicate_groups(companies, threshold)
+    review = _review_entries(companies, review_pairs)
+    if review:
+        logger.info("Dedupe: %d same-name pairs at different locations left for review", len(review))
+    if not groups:
+        return list(companies), [], review
+
+    primaries, absorbed, report = _merge_groups(companies, groups, reasons)
+    result = [primaries.get(i, company) for i, company in enumerate(companies) if i not in absorbed]
+
+    logger.info("Dedupe: %d companies merged into %d records",
+                sum(len(members) for members in groups), len(groups))
+    return result, report, review
+
+
+# ----------------------------------------------------------------------
+# Incremental import
+# ----------------------------------------------------------------------
+
+class DedupeIndex:
+    """
+    Blocking keys and LSH buckets of the rows of a deduplicated panel
+
+    Imported records are matched against it (dedupe_new) instead of
+    hashing and comparing the whole panel again. Rows are only ever added:
+    a key left over by a changed row only yields an extra candidate, which
+    is verified anyway.
+    """
+
+    def __init__(self, companies=()):
+        self.size = 0
+        self.blocks = defaultdict(list)
+        self.buckets = [defaultdict(list) for _ in range(LSH_BANDS)]
+        self.add(range(len(companies)), companies)
+
+    def add(self, rows, companies):
+        """Index companies as the given rows"""
+        rows = list(rows)
+        keys = [name_key(company.get('name')) for company in companies]
+        for row, company, key in zip(rows, companies, keys):
+            for block in blocking_keys(company, key):
+                self.blocks[block].append(row)
+
+        shingles = [trigrams(key) for key in keys]
+        valid = [i for i, company_shingles in enumerate(shingles) if company_shingles]
+        if valid:
+            signatures = minhash_signatures([shingles[i] for i in valid])
+            for i, row_keys in zip(valid, band_keys(signatures).tolist()):
+                for buckets, key in zip(self.buckets, row_keys):
+                    buckets[key].append(rows[i])
+
+        self.size = max([self.size, *(row + 1 for row in rows)])
+
+    def candidates(self, companies, size):
+        """
+        Sorted indexed rows (below size) sharing a name, an email, a phone
+        number or an LSH bucket with one of companies
+        """
+        found = set()
+        keys = [name_key(company.get('name')) for company in companies]
+        for company, key in zip(companies, keys):
+            for block in blocking_keys(company, key):
+                members = self.blocks.get(block, ())
+                if block[0] == 'name' or len(members) < MAX_BLOCK_SIZE:
+                    found.update(members)
+
+        shingles = [trigrams(key) for key in keys if key]
+        shingles = [company_shingles for company_shingles in shingles if company_shingles]
+        if shingles:
+            for row_keys in band_keys(minhash_signatures(shingles)).tolist():
+                for buckets, key in zip(self.buckets, row_keys):
+                    members = buckets.get(key, ())
+                    if len(members) < MAX_BLOCK_SIZE:
+                        found.update(members)
+
+        return sorted(row for row in found if row < size)
+
+
+_index_lock = threading.Lock()
+
+
+def dedupe_index(table):
+    """Return the (cached) DedupeIndex of a CompanyTable"""
+    index = getattr(table, '_dedupe_index', None)
+    if index is None:
+        with _index_lock:
+            index = getattr(table, '_dedupe_index', None)
+            if index is None:
+                with span('dedupe.index', companies=len(table)):
+                    index = DedupeIndex(table)
+                table._dedupe_index = index
+    return index
+
+
+def carry_index(previous, table, rows):
+    """
+    Hand the DedupeIndex of previous on to table, a copy of it where only
+    the given rows were replaced or appended (no row removed)
+    """
+    index = getattr(previous, '_dedupe_index', None)
+    if index is None:
+        return
+    with _index_lock:
+        if getattr(table, '_dedupe_index', None) is None:
+            index.add(rows, [table[row] for row in rows])
+            table._dedupe_index = index
+
+
+def _same_record(first, second):
+    # Panel records hold tuples where merged copies hold lists
+    def plain(value):
+        return list(value) if isinstance(value, tuple) else value
+    return first.keys() == second.keys() and all(plain(first[key]) == plain(second[key]) for key in first)
+
+
+def dedupe_new(table, new_companies, threshold=None):
+    """
+    Match imported companies against a deduplicated panel
+
+    Only the panel rows sharing a block or an LSH bucket with a new record
+    are compared: find_duplicate_groups runs on those rows followed by the
+    new records, so a panel record stays the primary of its group. Groups
+    without a new record are left alone.
+
+    Returns:
+        (added, updated, removed, report, review): the new records to
+        append, the merged panel records by row, the panel rows absorbed by
+        another panel record (linked through a new one), one report entry
+        per merged group and the pairs left for review
+    """
+    rows = dedupe_index(table).candidates(new_companies, len(table))
+    companies = [table[row] for row in rows] + list(new_companies)
+    existing = len(rows)
+
+    groups, reasons, review_pairs = find_duplicate_groups(companies, threshold)
+    groups = [members for members in groups if members[-1] >= existing]
+    review = _review_entries(companies, [pair for pair in review_pairs if pair[1] >= existing])
+    primaries, absorbed, report = _merge_groups(companies, groups, reasons)
+
+    added = [primaries.get(i, companies[i]) for i in range(existing, len(companies)) if i not in absorbed]
+    updated = {rows[i]: primary for i, primary in primaries.items() if i < existing and not _same_record(primary, companies[i])}
+    removed = sorted(rows[i] for i in absorbed if i < existing)
+
+    logger.info("Import dedupe: %d new companies against %d candidate rows, %d merged groups",
+                len(new_companies), existing, len(groups))
+    return added, updated, removed, report, review
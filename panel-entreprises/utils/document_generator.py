@@ -2,6 +2,7 @@ import os
 import time
 from datetime import datetime
 from utils.mistral_api import generate_document
+from utils.document_writers import document_extension, write_evaluation_grid, write_docx
 
 def create_document(template_type, project_data, companies, output_dir, api_key):
     """
@@ -36,10 +37,7 @@ def create_document(template_type, project_data, companies, output_dir, api_key)
         project_id = project_data.get('id', 'projet').replace(' ', '_')
         
         # Déterminer l'extension du fichier
-        if template_type == 'grilleEvaluation':
-            extension = 'xlsx'
-        else:
-            extension = 'docx'
+        extension = document_extension(template_type)
         
         # Créer un préfixe selon le type de document
         prefix_map = {
@@ -54,9 +52,11 @@ def create_document(template_type, project_data, companies, output_dir, api_key)
         filename = f"{prefix}_{project_id}_{timestamp}.{extension}"
         file_path = os.path.join(output_dir, filename)
         
-        # Écrire le contenu dans un fichier
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        # Écrire le document dans son format réel (écriture en flux)
+        if extension == 'xlsx':
+            write_evaluation_grid(file_path, project_data, companies, notes=content)
+        else:
+            write_docx(file_path, content)
         
         return {
             'fileName': filename,
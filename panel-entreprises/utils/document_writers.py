@@ -0,0 +1,391 @@
+"""
+document_writers.py - Native xlsx and docx writers for generated documents in EDF Panel Entreprises
+
+Generated documents are written in their real format, streamed to disk:
+- the evaluation grid (grilleEvaluation) is an xlsx workbook written with
+  openpyxl in write-only mode: rows are serialized as they are appended,
+  so memory stays constant whatever the number of companies; one row per
+  company, one score column per attribution criterion and a weighted total
+  formula
+- text documents are docx packages written entry by entry with zipfile:
+  paragraphs are encoded and compressed as they are produced. When
+  templates_docs/<template type>.docx exists, its styles, headers, footers
+  and page setup are kept and the text replaces the {{contenu}} paragraph
+  (or is appended to the body)
+"""
+
+import os
+import re
+import zipfile
+import logging
+from xml.sax.saxutils import escape
+
+from utils.lazy_imports import get_openpyxl
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+GRID_TEMPLATE = 'grilleEvaluation'
+
+# Characters of document.xml compressed at once
+WRITE_BUFFER_CHARS = 1 << 16
+
+# Placeholder paragraph replaced by the generated text in docx templates
+CONTENT_PLACEHOLDER = '{{contenu}}'
+
+# Characters not allowed in XML 1.0
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_BOLD = re.compile(r'\*\*(.+?)\*\*')
+_MARKDOWN_HEADING = re.compile(r'^(#{1,6})\s+(.*)$')
+_NUMBERED_HEADING = re.compile(r'^(\d+(?:\.\d+)*)\.?\s+\S')
+_BULLET = re.compile(r'^\s*[-*•]\s+')
+
+W_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '</Types>'
+)
+
+_PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+_DOCUMENT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+
+def _style(style_id, name, size, bold=False, based_on='Normal'):
+    return (
+        f'<w:style w:type="paragraph" w:styleId="{style_id}"><w:name w:val="{name}"/>'
+        f'<w:basedOn w:val="{based_on}"/><w:next w:val="Normal"/><w:qFormat/>'
+        f'<w:pPr><w:keepNext/><w:spacing w:before="240" w:after="120"/></w:pPr>'
+        f'<w:rPr>{"<w:b/>" if bold else ""}<w:color w:val="001A70"/><w:sz w:val="{size}"/></w:rPr></w:style>'
+    )
+
+
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    f'<w:styles xmlns:w="{W_NAMESPACE}">'
+    '<w:docDefaults><w:rPrDefault><w:rPr><w:rFonts w:ascii="Calibri" w:hAnsi="Calibri" w:cs="Calibri"/>'
+    '<w:sz w:val="22"/><w:lang w:val="fr-FR"/></w:rPr></w:rPrDefault>'
+    '<w:pPrDefault><w:pPr><w:spacing w:after="120"/></w:pPr></w:pPrDefault></w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>'
+    + _style('Title', 'Title', 36, bold=True)
+    + _style('Heading1', 'heading 1', 28, bold=True)
+    + _style('Heading2', 'heading 2', 24, bold=True)
+    + _style('Heading3', 'heading 3', 22, bold=True)
+    + '<w:style w:type="paragraph" w:styleId="ListBullet"><w:name w:val="List Bullet"/>'
+    '<w:basedOn w:val="Normal"/><w:pPr><w:ind w:left="360" w:hanging="360"/></w:pPr></w:style>'
+    '</w:styles>'
+)
+
+_SECTION = (
+    '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+    '<w:pgMar w:top="1417" w:right="1417" w:bottom="1417" w:left="1417" '
+    'w:header="708" w:footer="708" w:gutter="0"/></w:sectPr>'
+)
+
+
+def document_extension(template_type):
+    """Extension of the file generated for a template type"""
+    return 'xlsx' if template_type == GRID_TEMPLATE else 'docx'
+
+
+# ----------------------------------------------------------------------
+# xlsx evaluation grid
+# ----------------------------------------------------------------------
+
+def _plain(sheet, value):
+    # Text starting with '=' would be written as a formula
+    if isinstance(value, str) and value.startswith('='):
+        from openpyxl.cell import WriteOnlyCell
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.data_type = 's'
+        return cell
+    return value
+
+
+def _weight(criterion):
+    try:
+        return float(criterion.get('weight') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def write_evaluation_grid(path, project_data, companies, notes=None):
+    """
+    Write the evaluation grid of a consultation as an xlsx workbook
+
+    Args:
+        path: Output file
+        project_data: Project information (title, attributionCriteria)
+        companies: Consulted companies (one row each)
+        notes: Text written line by line on a second sheet (LLM answer)
+
+    Returns:
+        Number of company rows written
+    """
+    openpyxl = get_openpyxl()
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font, PatternFill
+    from openpyxl.utils import get_column_letter
+
+    criteria = project_data.get('attributionCriteria') or []
+    first_score_column = 4
+    last_score_column = first_score_column + len(criteria) - 1
+    total_column = first_score_column + len(criteria)
+
+    with span('documents.write_grid', companies=len(companies), criteria=len(criteria)) as trace:
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet("Grille d'évaluation")
+        sheet.column_dimensions['A'].width = 40
+        sheet.column_dimensions['B'].width = 28
+        sheet.column_dimensions['C'].width = 12
+        for column in range(first_score_column, total_column + 1):
+            sheet.column_dimensions[get_column_letter(column)].width = 18
+
+        bold = Font(bold=True)
+        header_font = Font(bold=True, color='FFFFFF')
+        header_fill = PatternFill('solid', fgColor='001A70')
+        wrap = Alignment(wrap_text=True, vertical='center')
+
+        def styled(value, font=None, fill=None, alignment=None):
+            cell = WriteOnlyCell(sheet, value=value)
+            if isinstance(value, str) and value.startswith('='):
+                cell.data_type = 's'
+            if font is not None:
+                cell.font = font
+            if fill is not None:
+                cell.fill = fill
+            if alignment is not None:
+                cell.alignment = alignment
+            return cell
+
+        sheet.append([styled(f"Grille d'évaluation - {project_data.get('title') or 'Projet EDF'}", Font(bold=True, size=14))])
+        sheet.append(["Barème : 0 (très insuffisant) à 5 (excellent) ; note pondérée sur 5"])
+        sheet.append([])
+
+        header = ['Entreprise', 'Localisation', 'Score panel',
+                  *(f"{criterion.get('name', 'Critère')} ({criterion.get('weight', 0)}%)" for criterion in criteria),
+                  'Note pondérée /5']
+        sheet.append([styled(_INVALID_XML_CHARS.sub('', value), header_font, header_fill, wrap) for value in header])
+
+        # Weights row referenced by the total formulas
+        weights_row = 5
+        sheet.append([styled('Pondération', bold), None, None,
+                      *(_weight(criterion) for criterion in criteria),
+                      f"=SUM({get_column_letter(first_score_column)}{weights_row}:"
+                      f"{get_column_letter(last_score_column)}{weights_row})" if criteria else None])
+
+        rows = 0
+        for row, company in enumerate(companies, start=weights_row + 1):
+            if criteria:
+                scores = (f"{get_column_letter(first_score_column)}{row}:"
+                          f"{get_column_letter(last_score_column)}{row}")
+                weights = (f"${get_column_letter(first_score_column)}${weights_row}:"
+                           f"${get_column_letter(last_score_column)}${weights_row}")
+                total = f'=IF(COUNT({scores})=0,"",SUMPRODUCT({weights},{scores})/100)'
+            else:
+                total = None
+            sheet.append([_plain(sheet, company.get('name', '')), _plain(sheet, company.get('location', '')),
+                          company.get('score'),
+                          *([None] * len(criteria)), total])
+            rows += 1
+
+        if notes:
+            notes_sheet = workbook.create_sheet('Notes')
+            notes_sheet.column_dimensions['A'].width = 120
+            for line in notes.splitlines():
+                notes_sheet.append([_plain(notes_sheet, _INVALID_XML_CHARS.sub('', line))])
+
+        workbook.save(path)
+        trace.set(rows=rows)
+        return rows
+
+
+# ----------------------------------------------------------------------
+# docx documents
+# ----------------------------------------------------------------------
+
+def _runs(text):
+    # **bold** spans become bold runs
+    runs = []
+    position = 0
+    for match in _BOLD.finditer(text):
+        if match.start() > position:
+            runs.append((text[position:match.start()], False))
+        runs.append((match.group(1), True))
+        position = match.end()
+    if position < len(text):
+        runs.append((text[position:], False))
+    return ''.join(
+        f'<w:r>{"<w:rPr><w:b/></w:rPr>" if run_bold else ""}'
+        f'<w:t xml:space="preserve">{escape(run_text)}</w:t></w:r>'
+        for run_text, run_bold in runs
+    )
+
+
+def _paragraph_style(line):
+    """(style level, text) of a line: 1-3 for headings, 'bullet', or None"""
+    match = _MARKDOWN_HEADING.match(line)
+    if match:
+        return min(len(match.group(1)), 3), match.group(2).strip('# ')
+    stripped = line.strip()
+    match = _NUMBERED_HEADING.match(stripped)
+    if match and len(stripped) <= 90 and not stripped.endswith(('.', ';', ',')):
+        return min(match.group(1).count('.') + 1, 3), stripped
+    letters = [c for c in stripped if c.isalpha()]
+    if len(letters) >= 4 and len(stripped) <= 90 and all(c.isupper() for c in letters):
+        return 1, stripped
+    if _BULLET.match(line):
+        return 'bullet', _BULLET.sub('', line)
+    return None, line
+
+
+def docx_paragraphs(text, heading_styles=None, title=None):
+    """
+    WordprocessingML paragraphs of a text, one per line (a generator)
+
+    Args:
+        text: Document text; markdown headings, numbered or upper-case
+            title lines become headings and "- " lines bullets
+        heading_styles: style ids of the heading levels 1-3 (template styles)
+        title: Optional first paragraph in the Title style
+    """
+    heading_styles = heading_styles or {1: 'Heading1', 2: 'Heading2', 3: 'Heading3'}
+    if title:
+        yield f'<w:p><w:pPr><w:pStyle w:val="Title"/></w:pPr>{_runs(_INVALID_XML_CHARS.sub("", title))}</w:p>'
+
+    for line in text.splitlines():
+        line = _INVALID_XML_CHARS.sub('', line.rstrip())
+        if not line.strip():
+            yield '<w:p/>'
+            continue
+        level, content = _paragraph_style(line)
+        if level == 'bullet':
+            yield f'<w:p><w:pPr><w:pStyle w:val="ListBullet"/></w:pPr>{_runs("• " + content)}</w:p>'
+        elif level:
+            yield f'<w:p><w:pPr><w:pStyle w:val="{heading_styles[level]}"/></w:pPr>{_runs(content.replace("**", ""))}</w:p>'
+        else:
+            yield f'<w:p>{_runs(content)}</w:p>'
+
+
+def _template_heading_styles(styles_xml):
+    # Heading style ids of a template: English or French Word ("Titre1")
+    style_ids = set(re.findall(r'w:styleId="([^"]+)"', styles_xml))
+    return {
+        level: next((style_id for style_id in (f'Heading{level}', f'Titre{level}') if style_id in style_ids),
+                    f'Heading{level}')
+        for level in (1, 2, 3)
+    }
+
+
+def _split_template_body(document_xml):
+    """
+    (before, after) parts of a template document.xml around the generated
+    content: the {{contenu}} paragraph, or the end of the body
+    """
+    placeholder = document_xml.find(CONTENT_PLACEHOLDER)
+    if placeholder != -1:
+        start = max(document_xml.rfind('<w:p>', 0, placeholder), document_xml.rfind('<w:p ', 0, placeholder))
+        end = document_xml.find('</w:p>', placeholder)
+        if start != -1 and end != -1:
+            return document_xml[:start], document_xml[end + len('</w:p>'):]
+
+    body_end = document_xml.rfind('</w:body>')
+    section = document_xml.rfind('<w:sectPr', 0, body_end)
+    # The body-level section properties stay last
+    cut = section if section != -1 and '</w:p>' not in document_xml[section:body_end] else body_end
+    return document_xml[:cut], document_xml[cut:]
+
+
+def xml_text(value):
+    """Text escaped for a WordprocessingML run"""
+    return escape(_INVALID_XML_CHARS.sub('', str(value)))
+
+
+def docx_skeleton(template_path=None):
+    """
+    Fixed parts of a docx package around the generated paragraphs
+
+    Args:
+        template_path: Optional docx template (see write_docx)
+
+    Returns:
+        (parts, before, after, heading_styles): the (name, bytes) entries
+        other than word/document.xml, the document.xml text before and after
+        the paragraphs, and the heading style ids (None for the defaults)
+    """
+    if not template_path:
+        parts = [
+            ('[Content_Types].xml', _CONTENT_TYPES.encode('utf-8')),
+            ('_rels/.rels', _PACKAGE_RELS.encode('utf-8')),
+            ('word/_rels/document.xml.rels', _DOCUMENT_RELS.encode('utf-8')),
+            ('word/styles.xml', _STYLES.encode('utf-8'))
+        ]
+        before = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                  f'<w:document xmlns:w="{W_NAMESPACE}"><w:body>')
+        return parts, before, f'{_SECTION}</w:body></w:document>', None
+
+    with zipfile.ZipFile(template_path) as template:
+        parts = [(name, template.read(name)) for name in template.namelist() if name != 'word/document.xml']
+        document_xml = template.read('word/document.xml').decode('utf-8')
+    styles_xml = next((data.decode('utf-8') for name, data in parts if name == 'word/styles.xml'), '')
+    before, after = _split_template_body(document_xml)
+    return parts, before, after, _template_heading_styles(styles_xml)
+
+
+def write_docx(path, text, title=None, template_path=None):
+    """
+    Write a text document as a docx package, streamed paragraph by paragraph
+
+    Args:
+        path: Output file
+        text: Document text
+        title: Optional title paragraph
+        template_path: docx template whose styles, headers, footers and page
+            setup are kept (its {{contenu}} paragraph is replaced)
+    """
+    with span('documents.write_docx', chars=len(text), template=bool(template_path)):
+        parts, before, after, heading_styles = docx_skeleton(template_path)
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as package:
+            for name, data in parts:
+                package.writestr(name, data)
+
+            with package.open('word/document.xml', 'w') as document:
+                # Paragraphs are compressed in batches of about WRITE_BUFFER_CHARS
+                buffer = [before]
+                size = len(before)
+                for paragraph in docx_paragraphs(text, heading_styles, title):
+                    buffer.append(paragraph)
+                    size += len(paragraph)
+                    if size >= WRITE_BUFFER_CHARS:
+                        document.write(''.join(buffer).encode('utf-8'))
+                        buffer, size = [], 0
+                buffer.append(after)
+                document.write(''.join(buffer).encode('utf-8'))
+
+
+def template_path_for(template_dir, template_type):
+    """docx template of a template type in template_dir, or None"""
+    path = os.path.join(template_dir, f"{template_type}.docx")
+    return path if os.path.isfile(path) else None
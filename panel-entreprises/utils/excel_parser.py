@@ -2,94 +2,143 @@
 excel_parser.py - Enhanced Company Data Parser for EDF Panel Entreprises
 """
 
-import pandas as pd
 import os
 import re
+import hashlib
+import unicodedata
 from datetime import datetime
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from utils.gazetteer import get_gazetteer
+from utils.lazy_imports import get_pandas
+from utils.tracing import span
+
 logger = logging.getLogger(__name__)
 
-def load_companies_from_excel(file_path):
+def notna(value):
+    """Whether a cell of a row read by sheet_rows holds a value"""
+    return value is not None
+
+def sheet_rows(df):
+    """
+    Rows of a sheet as {column: value} dicts, missing cells (NaN, NaT) as None:
+    pandas checks the whole sheet once instead of every cell
+    """
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+def load_companies_from_excel(file_path, sheet_name=None, column_overrides=None):
     """
     Load companies from Excel file with enhanced domain and criteria extraction
+    
+    Args:
+        file_path: Path of the workbook
+        sheet_name: Sheet to read (detected with find_company_sheet when None)
+        column_overrides: Optional {field: [column names]} replacing the columns
+                          detected by identify_columns for these fields
+    """
+    return load_companies_from_workbook(file_path, [sheet_name], column_overrides)[0]
+
+def load_companies_from_workbook(file_path, sheet_names, column_overrides=None):
+    """
+    Load companies from several sheets of a workbook, opening it only once
+    
+    Args:
+        file_path: Path of the workbook
+        sheet_names: Sheets to read (None entries are detected with find_company_sheet)
+        column_overrides: Optional {field: [column names]} applied to every sheet
+    
+    Returns:
+        One list of companies per requested sheet
     """
     try:
-        logger.info(f"=== LOADING EXCEL FILE: {file_path} ===")
+        pd = get_pandas()
         
         if not os.path.exists(file_path):
-            logger.error(f"File not found: {file_path}")
-            return []
+            logger.error("File not found: %s", file_path)
+            return [[] for _ in sheet_names]
         
         # Load Excel file with proper engine
         xl_file = pd.ExcelFile(file_path, engine='openpyxl')
-        logger.info(f"Available sheets: {xl_file.sheet_names}")
-        
-        # Find the main sheet with company data
-        main_sheet = find_company_sheet(xl_file)
-        if not main_sheet:
-            main_sheet = xl_file.sheet_names[0]
-            logger.info(f"Using first sheet as default: {main_sheet}")
-        
-        # Read the sheet into DataFrame
-        df = pd.read_excel(file_path, sheet_name=main_sheet, engine='openpyxl')
-        logger.info(f"DataFrame dimensions: {df.shape}")
-        logger.info(f"Columns: {list(df.columns)}")
-        
-        # Clean column names
-        df.columns = df.columns.astype(str).str.strip()
-        
-        # Find key columns for company data
-        column_mapping = identify_columns(df)
-        logger.info(f"Column mapping identified: {column_mapping}")
-        
-        # Process each row to extract company information
-        companies = []
-        skipped_rows = 0
-        
-        for idx, row in df.iterrows():
-            try:
-                # Extract company name first - skip if no valid name
-                company_name = extract_company_name(row, column_mapping, df.columns)
-                if not company_name or company_name.strip() == "":
-                    skipped_rows += 1
-                    continue
-                
-                # Create unique ID
-                company_id = f"ENT_{str(len(companies) + 1).zfill(3)}"
-                
-                # Extract all company information
-                company = {
-                    'id': company_id,
-                    'name': company_name,
-                    'domain': extract_domain(row, column_mapping, df.columns),
-                    'location': extract_location(row, column_mapping, df.columns),
-                    'certifications': extract_certifications(row, column_mapping, df.columns),
-                    'ca': extract_ca(row, column_mapping, df.columns),
-                    'employees': extract_employees(row, column_mapping, df.columns),
-                    'contact': extract_contact_info(row, column_mapping, df.columns),
-                    'experience': extract_experience(row, column_mapping, df.columns),
-                    'lots_marches': extract_contracts(row, column_mapping, df.columns),
-                    'capabilities': extract_capabilities(row, column_mapping, df.columns),
-                    'score': 0
-                }
-                
-                companies.append(company)
-                
-            except Exception as e:
-                logger.error(f"Error processing row {idx}: {e}")
-                skipped_rows += 1
-        
-        logger.info(f"=== EXTRACTION RESULTS ===")
-        logger.info(f"Companies extracted: {len(companies)}")
-        logger.info(f"Rows skipped: {skipped_rows}")
+        logger.debug("Available sheets in %s: %s", file_path, xl_file.sheet_names)
         
-        # Enrich with additional data (inferred domains, capabilities)
-        enrich_company_data(companies)
-        
-        return companies
+    except Exception as e:
+        logger.error(f"Excel loading error: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return [[] for _ in sheet_names]
+    
+    return [parse_company_sheet(xl_file, file_path, sheet_name, column_overrides) for sheet_name in sheet_names]
+
+def parse_company_sheet(xl_file, file_path, sheet_name=None, column_overrides=None):
+    """Extract the companies of one sheet of an opened workbook"""
+    try:
+        with span('parse', file=file_path) as trace:
+            # Find the main sheet with company data
+            main_sheet = resolve_sheet_name(xl_file, sheet_name) if sheet_name else find_company_sheet(xl_file)
+            if not main_sheet:
+                if sheet_name:
+                    logger.error("Sheet %r not found in %s", sheet_name, file_path)
+                    return []
+                main_sheet = xl_file.sheet_names[0]
+            trace.set(sheet=main_sheet)
+            
+            # Read the sheet into DataFrame (reusing the already opened workbook)
+            df = xl_file.parse(main_sheet)
+            trace.set(rows=df.shape[0], columns=df.shape[1])
+            
+            # Clean column names
+            df.columns = df.columns.astype(str).str.strip()
+            
+            # Find key columns for company data
+            column_mapping = identify_columns(df)
+            if column_overrides:
+                column_mapping = apply_column_overrides(column_mapping, column_overrides, df.columns)
+            trace.event("Column mapping identified: %s", column_mapping)
+            
+            # Process each row to extract company information
+            companies = []
+            
+            for idx, row in enumerate(sheet_rows(df)):
+                try:
+                    # Extract company name first - skip if no valid name
+                    company_name = extract_company_name(row, column_mapping, df.columns)
+                    if not company_name or company_name.strip() == "":
+                        trace.incr('skipped')
+                        continue
+                    
+                    location = extract_location(row, column_mapping, df.columns)
+                    
+                    # Extract all company information
+                    company = {
+                        'id': stable_company_id(company_name, location),
+                        'name': company_name,
+                        'domain': extract_domain(row, column_mapping, df.columns),
+                        'location': location,
+                        'certifications': extract_certifications(row, column_mapping, df.columns),
+                        'ca': extract_ca(row, column_mapping, df.columns),
+                        'employees': extract_employees(row, column_mapping, df.columns),
+                        'contact': extract_contact_info(row, column_mapping, df.columns),
+                        'experience': extract_experience(row, column_mapping, df.columns),
+                        'lots_marches': extract_contracts(row, column_mapping, df.columns),
+                        'capabilities': extract_capabilities(row, column_mapping, df.columns),
+                        'score': 0
+                    }
+                    
+                    companies.append(company)
+                    
+                except Exception as e:
+                    trace.incr('skipped')
+                    trace.incr('errors')
+                    logger.debug("Error processing row %s: %s", idx, e)
+            
+            trace.set(companies=len(companies))
+            logger.info("Extracted %d companies from %s [%s] (%d rows skipped)",
+                        len(companies), file_path, main_sheet, trace.counters.get('skipped', 0))
+            
+            # Enrich with additional data (inferred domains, capabilities)
+            enrich_company_data(companies)
+            
+            return companies
     
     except Exception as e:
         logger.error(f"Excel loading error: {e}")
@@ -97,6 +146,54 @@ def load_companies_from_excel(file_path):
         logger.error(traceback.format_exc())
         return []
 
+def normalize_text(value):
+    """Lowercase, strip accents and punctuation, collapse spaces"""
+    text = str(value)
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = text.lower()
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text).split())
+
+def stable_company_id(name, location):
+    """
+    Build an id that only depends on the company name and location, so the
+    same company keeps its id across files, sheets and reloads
+    """
+    key = f"{normalize_text(name)}|{normalize_text(location)}"
+    return f"ENT_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:10].upper()}"
+
+def resolve_sheet_name(xl_file, sheet_name):
+    """Find a sheet by name, tolerating case and surrounding spaces"""
+    if sheet_name in xl_file.sheet_names:
+        return sheet_name
+    
+    wanted = str(sheet_name).strip().lower()
+    for sheet in xl_file.sheet_names:
+        if sheet.strip().lower() == wanted:
+            return sheet
+    
+    return None
+
+def apply_column_overrides(column_mapping, column_overrides, all_columns):
+    """Replace detected columns with explicitly configured ones"""
+    mapping = dict(column_mapping)
+    available = set(all_columns)
+    
+    for key, columns in column_overrides.items():
+        if isinstance(columns, str):
+            columns = [columns]
+        # Column names are stripped when the sheet is read
+        columns = [str(col).strip() for col in columns]
+        
+        missing = [col for col in columns if col not in available]
+        if missing:
+            logger.warning("Configured columns not found for %s: %s", key, missing)
+        
+        mapping[key] = [col for col in columns if col in available]
+    
+    return mapping
+
 def find_company_sheet(xl_file):
     """Find the sheet most likely to contain company data"""
     company_keywords = ['entreprise', 'societe', 'société', 'fournisseur', 'prestataire', 'listing']
@@ -108,6 +205,7 @@ def find_company_sheet(xl_file):
             return sheet
     
     # If no match in names, check first row of each sheet
+    pd = get_pandas()
     for sheet in xl_file.sheet_names:
         try:
             # Read just the first row
@@ -169,14 +267,14 @@ def extract_company_name(row, column_mapping, all_columns):
     """Extract company name with enhanced detection"""
     # First try mapped columns
     for col in column_mapping.get('company_name', []):
-        if pd.notna(row[col]):
+        if notna(row[col]):
             name = str(row[col]).strip()
             if name and not is_generic_value(name):
                 return name
     
     # Backup: try first column with content that looks like a name
     for col in all_columns:
-        if pd.notna(row[col]):
+        if notna(row[col]):
             value = str(row[col]).strip()
             if looks_like_company_name(value):
                 return value
@@ -208,7 +306,7 @@ def extract_domain(row, column_mapping, all_columns):
     """Extract company domain with domain inference"""
     # First try mapped columns
     for col in column_mapping.get('domain', []):
-        if pd.notna(row[col]):
+        if notna(row[col]):
             domain = str(row[col]).strip()
             if domain and not is_generic_value(domain):
                 return standardize_domain(domain)
@@ -335,7 +433,7 @@ def extract_location(row, column_mapping, all_columns):
     """Extract location with better formatting"""
     # Try mapped columns
     for col in column_mapping.get('location', []):
-        if pd.notna(row[col]):
+        if notna(row[col]):
             location = str(row[col]).strip()
             if location and not is_generic_value(location):
                 return format_location(location)
@@ -344,45 +442,19 @@ def extract_location(row, column_mapping, all_columns):
 
 def format_location(location):
     """Format location consistently"""
-    # Try to extract postal code
-    postal_code_match = re.search(r'\b\d{5}\b', location)
-    postal_code = postal_code_match.group(0) if postal_code_match else None
-    
-    # Common department names and numbers
-    departments = {
-        '01': 'Ain', '02': 'Aisne', '03': 'Allier', '04': 'Alpes-de-Haute-Provence',
-        '05': 'Hautes-Alpes', '06': 'Alpes-Maritimes', '07': 'Ardèche', '08': 'Ardennes',
-        '09': 'Ariège', '10': 'Aube', '11': 'Aude', '12': 'Aveyron', '13': 'Bouches-du-Rhône',
-        '14': 'Calvados', '15': 'Cantal', '16': 'Charente', '17': 'Charente-Maritime',
-        '18': 'Cher', '19': 'Corrèze', '21': 'Côte-d\'Or', '22': 'Côtes-d\'Armor',
-        '23': 'Creuse', '24': 'Dordogne', '25': 'Doubs', '26': 'Drôme', '27': 'Eure',
-        '28': 'Eure-et-Loir', '29': 'Finistère', '2A': 'Corse-du-Sud', '2B': 'Haute-Corse',
-        '30': 'Gard', '31': 'Haute-Garonne', '32': 'Gers', '33': 'Gironde', '34': 'Hérault',
-        '35': 'Ille-et-Vilaine', '36': 'Indre', '37': 'Indre-et-Loire', '38': 'Isère',
-        '39': 'Jura', '40': 'Landes', '41': 'Loir-et-Cher', '42': 'Loire', '43': 'Haute-Loire',
-        '44': 'Loire-Atlantique', '45': 'Loiret', '46': 'Lot', '47': 'Lot-et-Garonne',
-        '48': 'Lozère', '49': 'Maine-et-Loire', '50': 'Manche', '51': 'Marne',
-        '52': 'Haute-Marne', '53': 'Mayenne', '54': 'Meurthe-et-Moselle', '55': 'Meuse',
-        '56': 'Morbihan', '57': 'Moselle', '58': 'Nièvre', '59': 'Nord', '60': 'Oise',
-        '61': 'Orne', '62': 'Pas-de-Calais', '63': 'Puy-de-Dôme', '64': 'Pyrénées-Atlantiques',
-        '65': 'Hautes-Pyrénées', '66': 'Pyrénées-Orientales', '67': 'Bas-Rhin',
-        '68': 'Haut-Rhin', '69': 'Rhône', '70': 'Haute-Saône', '71': 'Saône-et-Loire',
-        '72': 'Sarthe', '73': 'Savoie', '74': 'Haute-Savoie', '75': 'Paris',
-        '76': 'Seine-Maritime', '77': 'Seine-et-Marne', '78': 'Yvelines', '79': 'Deux-Sèvres',
-        '80': 'Somme', '81': 'Tarn', '82': 'Tarn-et-Garonne', '83': 'Var', '84': 'Vaucluse',
-        '85': 'Vendée', '86': 'Vienne', '87': 'Haute-Vienne', '88': 'Vosges', '89': 'Yonne',
-        '90': 'Territoire de Belfort', '91': 'Essonne', '92': 'Hauts-de-Seine',
-        '93': 'Seine-Saint-Denis', '94': 'Val-de-Marne', '95': 'Val-d\'Oise'
-    }
+    gazetteer = get_gazetteer()
+    
+    # Try to extract postal code (Excel floats such as "7200.0" included)
+    postal_code = gazetteer.find_postal_code(location)
     
-    # Extract department code
-    dept_code = None
     if postal_code:
-        dept_code = postal_code[:2]
-        dept_name = departments.get(dept_code, '')
+        code, start, end = postal_code
+        dept_code = gazetteer.postal_department(code) or code[:2]
+        department = gazetteer.departments.get(dept_code)
+        dept_name = department['name'] if department else ''
         
         # Format as "City, Department (code)"
-        city_match = re.sub(r'\b\d{5}\b', '', location).strip().strip(',.-')
+        city_match = (location[:start] + location[end:]).strip().strip(',.-').strip()
         if city_match:
             return f"{city_match}, {dept_name} ({dept_code})"
         else:
@@ -410,7 +482,7 @@ def extract_certifications(row, column_mapping, all_columns):
     
     # Check mapped columns
     for col in column_mapping.get('certifications', []):
-        if pd.notna(row[col]):
+        if notna(row[col]):
             cert_text = str(row[col]).lower()
             for cert_name, patterns in cert_patterns.items():
                 if any(pattern in cert_text for pattern in patterns):
@@ -420,7 +492,7 @@ def extract_certifications(row, column_mapping, all_columns):
     # Check all other columns for certification mentions
     if not certifications:
         for col in all_columns:
-            if pd.notna(row[col]):
+            if notna(row[col]):
                 cert_text = str(row[col]).lower()
                 for cert_name, patterns in cert_patterns.items():
                     if any(pattern in cert_text for pattern in patterns):
@@ -433,7 +505,7 @@ def extract_ca(row, column_mapping, all_columns):
     """Extract CA (chiffre d'affaires) with better formatting"""
     # Try mapped columns
     for col in column_mapping.get('ca', []):
-        if pd.notna(row[col]):
+        if notna(row[col]):
             ca_value = row[col]
             if isinstance(ca_value, (int, float)) and ca_value > 0:
                 return format_ca(ca_value)
@@ -452,7 +524,7 @@ def extract_ca(row, column_mapping, all_columns):
     
     # Check all other columns for CA mentions
     for col in all_columns:
-        if pd.notna(row[col]) and any(term in str(col).lower() for term in ['ca', 'chiffre']):
+        if notna(row[col]) and any(term in str(col).lower() for term in ['ca', 'chiffre']):
             ca_value = row[col]
             if isinstance(ca_value, (int, float)) and ca_value > 0:
                 return format_ca(ca_value)
@@ -481,7 +553,7 @@ def extract_employees(row, column_mapping, all_columns):
     """Extract employee count with better detection"""
     # Try mapped columns
     for col in column_mapping.get('employees', []):
-        if pd.notna(row[col]):
+        if notna(row[col]):
             emp_value = row[col]
             if isinstance(emp_value, (int, float)) and emp_value > 0:
                 return str(int(emp_value))
@@ -494,7 +566,7 @@ def extract_employees(row, column_mapping, all_columns):
     
     # Check all other columns for employee mentions
     for col in all_columns:
-        if pd.notna(row[col]) and any(term in str(col).lower() for term in ['effectif', 'salarié', 'employé']):
+        if notna(row[col]) and any(term in str(col).lower() for term in ['effectif', 'salarié', 'employé']):
             emp_value = row[col]
             if isinstance(emp_value, (int, float)) and emp_value > 0:
                 return str(int(emp_value))
@@ -512,7 +584,7 @@ def extract_contact_info(row, column_mapping, all_columns):
     
     # Extract email
     for col in column_mapping.get('email', []):
-        if pd.notna(row[col]):
+        if notna(row[col]):
             email = str(row[col]).strip()
             if '@' in email and '.' in email:
                 contact['email'] = email
@@ -520,7 +592,7 @@ def extract_contact_info(row, column_mapping, all_columns):
     
     # Extract phone
     for col in column_mapping.get('phone', []):
-        if pd.notna(row[col]):
+        if notna(row[col]):
             phone = str(row[col]).strip()
             if re.search(r'[\d\s\.]{8,}', phone):
                 contact['phone'] = format_phone_number(phone)
@@ -529,7 +601,7 @@ def extract_contact_info(row, column_mapping, all_columns):
     # Check all other columns for contact info
     if 'email' not in contact:
         for col in all_columns:
-            if pd.notna(row[col]):
+            if notna(row[col]):
                 value = str(row[col])
                 if '@' in value and '.' in value and re.search(r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}', value):
                     contact['email'] = value.strip()
@@ -537,7 +609,7 @@ def extract_contact_info(row, column_mapping, all_columns):
     
     if 'phone' not in contact and contact:  # Only look for phone if we already have email
         for col in all_columns:
-            if pd.notna(row[col]):
+            if notna(row[col]):
                 value = str(row[col])
                 if re.search(r'(0|\+33)\s*[1-9](\s*\d{2}){4}', value):
                     contact['phone'] = format_phone_number(value)
@@ -569,14 +641,14 @@ def extract_experience(row, column_mapping, all_columns):
     """Extract experience with better formatting"""
     # Try mapped columns
     for col in column_mapping.get('experience', []):
-        if pd.notna(row[col]):
+        if notna(row[col]):
             exp = str(row[col]).strip()
             if exp and len(exp) > 10:  # Ensure it's substantial
                 return exp
     
     # Check all other columns for experience mentions
     for col in all_columns:
-        if pd.notna(row[col]) and any(term in str(col).lower() for term in ['expérience', 'référence', 'historique']):
+        if notna(row[col]) and any(term in str(col).lower() for term in ['expérience', 'référence', 'historique']):
             exp = str(row[col]).strip()
             if exp and len(exp) > 10:
                 return exp
@@ -589,7 +661,7 @@ def extract_contracts(row, column_mapping, all_columns):
     
     # Try mapped columns
     for col in column_mapping.get('contracts', []):
-        if pd.notna(row[col]):
+        if notna(row[col]):
             contract_text = str(row[col]).strip()
             if contract_text and len(contract_text) > 5:
                 contracts.append({
@@ -601,7 +673,7 @@ def extract_contracts(row, column_mapping, all_columns):
     if not contracts:
         contract_keywords = ['contrat', 'marché', 'marche', 'lot', 'prestation', 'projet', 'affaire', 'commande']
         for col in all_columns:
-            if pd.notna(row[col]) and any(keyword in str(col).lower() for keyword in contract_keywords):
+            if notna(row[col]) and any(keyword in str(col).lower() for keyword in contract_keywords):
                 contract_text = str(row[col]).strip()
                 if contract_text and len(contract_text) > 5:
                     contracts.append({
@@ -617,7 +689,7 @@ def extract_capabilities(row, column_mapping, all_columns):
     
     # Try mapped columns
     for col in column_mapping.get('capabilities', []):
-        if pd.notna(row[col]):
+        if notna(row[col]):
             cap_text = str(row[col]).strip()
             if cap_text and len(cap_text) > 5:
                 capabilities.append(cap_text)
@@ -625,7 +697,7 @@ def extract_capabilities(row, column_mapping, all_columns):
     # Check all other columns for capability mentions
     capability_keywords = ['capacité', 'capacite', 'compétence', 'competence', 'savoir', 'expertise', 'moyen']
     for col in all_columns:
-        if pd.notna(row[col]) and any(keyword in str(col).lower() for keyword in capability_keywords):
+        if notna(row[col]) and any(keyword in str(col).lower() for keyword in capability_keywords):
             cap_text = str(row[col]).strip()
             if cap_text and len(cap_text) > 5 and cap_text not in capabilities:
                 capabilities.append(cap_text)
@@ -634,34 +706,35 @@ def extract_capabilities(row, column_mapping, all_columns):
 
 def enrich_company_data(companies):
     """Add inferred data to companies to improve matching"""
-    for company in companies:
-        # Enrich domain information if needed
-        if company['domain'] == "Autre" and company['name']:
-            # Try to infer from name
-            inferred_domain = infer_domain_from_name(company['name'])
-            if inferred_domain != "Autre":
-                company['domain'] = inferred_domain
-                logger.info(f"Inferred domain '{inferred_domain}' for {company['name']}")
-            
-            # Try to infer from experience or contracts
-            if company['domain'] == "Autre" and company['experience'] != "Non spécifié":
-                inferred_domain = infer_domain_from_text(company['experience'])
+    with span('enrich', companies=len(companies)) as trace:
+        for company in companies:
+            # Enrich domain information if needed
+            if company['domain'] == "Autre" and company['name']:
+                # Try to infer from name
+                inferred_domain = infer_domain_from_name(company['name'])
                 if inferred_domain != "Autre":
                     company['domain'] = inferred_domain
-                    logger.info(f"Inferred domain '{inferred_domain}' from experience for {company['name']}")
+                    trace.incr('domain_from_name')
+                
+                # Try to infer from experience or contracts
+                if company['domain'] == "Autre" and company['experience'] != "Non spécifié":
+                    inferred_domain = infer_domain_from_text(company['experience'])
+                    if inferred_domain != "Autre":
+                        company['domain'] = inferred_domain
+                        trace.incr('domain_from_experience')
+                
+                if company['domain'] == "Autre" and company['lots_marches']:
+                    all_contract_text = " ".join([c.get('description', '') for c in company['lots_marches']])
+                    inferred_domain = infer_domain_from_text(all_contract_text)
+                    if inferred_domain != "Autre":
+                        company['domain'] = inferred_domain
+                        trace.incr('domain_from_contracts')
             
-            if company['domain'] == "Autre" and company['lots_marches']:
-                all_contract_text = " ".join([c.get('description', '') for c in company['lots_marches']])
-                inferred_domain = infer_domain_from_text(all_contract_text)
-                if inferred_domain != "Autre":
-                    company['domain'] = inferred_domain
-                    logger.info(f"Inferred domain '{inferred_domain}' from contracts for {company['name']}")
-        
-        # Add keywords for better matching
-        company['keywords'] = generate_company_keywords(company)
-        
-        # Add geographic information
-        company['geo_zone'] = determine_geo_zone(company['location'])
+            # Add geographic information (used by the keyword generation below)
+            company['geo_zone'] = determine_geo_zone(company['location'])
+            
+            # Add keywords for better matching
+            company['keywords'] = generate_company_keywords(company)
 
 def generate_company_keywords(company):
     """Generate keywords for better company matching"""
@@ -727,47 +800,8 @@ def determine_geo_zone(location):
     if location == "Non spécifié":
         return "Non spécifié"
     
-    location_lower = location.lower()
-    
-    # Regions
-    regions = {
-        'Ile-de-France': ['paris', 'ile-de-france', 'idf', '75', '77', '78', '91', '92', '93', '94', '95'],
-        'Nord': ['nord', 'hauts-de-france', 'lille', 'amiens', '59', '62', '80', '60', '02'],
-        'Est': ['est', 'grand est', 'alsace', 'lorraine', 'champagne', 'strasbourg', 'nancy', 'metz', 'reims', 'mulhouse', '67', '68', '57', '54', '55', '88', '08', '51', '52', '10'],
-        'Ouest': ['ouest', 'bretagne', 'normandie', 'pays de la loire', 'rennes', 'nantes', 'caen', 'rouen', 'angers', '35', '44', '29', '56', '22', '50', '14', '61', '53', '72', '49', '85'],
-        'Sud-Ouest': ['sud-ouest', 'nouvelle-aquitaine', 'bordeaux', 'toulouse', 'pau', 'bayonne', '33', '40', '64', '65', '32', '31', '09', '81', '82'],
-        'Sud-Est': ['sud-est', 'paca', 'rhone-alpes', 'auvergne', 'marseille', 'lyon', 'nice', 'grenoble', '13', '84', '04', '05', '06', '83', '69', '38', '73', '74', '01', '26', '07'],
-        'Centre': ['centre', 'centre-val de loire', 'orleans', 'tours', 'bourges', '45', '41', '37', '36', '18', '28'],
-        'Ardennes': ['ardennes', 'charleville', 'sedan', 'chooz', '08']  # Special for Chooz project
-    }
-    
-    for region, keywords in regions.items():
-        if any(keyword in location_lower for keyword in keywords):
-            return region
-    
-    # Try to extract department from postal code
-    postal_match = re.search(r'\b(\d{2})\d{3}\b', location_lower)
-    if postal_match:
-        dept = postal_match.group(1)
-        
-        # Map department to region
-        dept_regions = {
-            # Ile-de-France
-            '75': 'Ile-de-France', '77': 'Ile-de-France', '78': 'Ile-de-France', 
-            '91': 'Ile-de-France', '92': 'Ile-de-France', '93': 'Ile-de-France', 
-            '94': 'Ile-de-France', '95': 'Ile-de-France',
-            # Nord
-            '59': 'Nord', '62': 'Nord', '80': 'Nord', '60': 'Nord', '02': 'Nord',
-            # Est
-            '67': 'Est', '68': 'Est', '57': 'Est', '54': 'Est', '55': 'Est', 
-            '88': 'Est', '08': 'Est', '51': 'Est', '52': 'Est', '10': 'Est',
-            # Ardennes (special case for Chooz)
-            '08': 'Ardennes',
-            # Rest of France by region...
-        }
-        
-        if dept in dept_regions:
-            return dept_regions[dept]
+    # Postal code, department code, then department, commune or area names
+    zone = get_gazetteer().zone_of(location)
     
     # If nothing matches
-    return "France"  # Default to national
\ No newline at end of file
+    return zone or "France"  # Default to national
@@ -0,0 +1,243 @@
+"""
+gazetteer.py - Offline French gazetteer for EDF Panel Entreprises
+
+data/gazetteer.json is loaded once and compiled into dictionary lookups:
+- departments: code -> name, region, zone and centroid
+- postal codes: the department is the first two digits (20xxx is Corsica,
+  split into 2A/2B); float codes read from Excel ("7200.0") are zero-padded
+- place names: normalized department, commune and area names -> department
+  or zone, matched on whole tokens so that short names ('Est', 'Ain') do
+  not match inside other words
+- sites: nuclear sites -> department and coordinates
+
+Zones are the panel's geographic vocabulary (Ile-de-France, Nord, Est,
+Ardennes, Ouest, Sud-Ouest, Sud-Est, Centre). The same index classifies
+company locations at ingest (excel_parser), resolves their coordinates
+(geo_index) and reads the zones named in matching criteria (company_matcher).
+"""
+
+import os
+import re
+import json
+import threading
+import unicodedata
+import logging
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_PATH = os.environ.get(
+    'PANEL_GAZETTEER_FILE',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'gazetteer.json')
+)
+
+# 5-digit postal code, optionally written as an Excel float ("68057.0")
+_POSTAL_CODE_PATTERN = re.compile(r'(?<![\d.])(\d{5})(?:\.0+)?(?!\d)')
+# Whole value that is a postal code which lost its leading zero ("7200.0")
+_SHORT_POSTAL_CODE_PATTERN = re.compile(r'^\s*(\d{4})(?:\.0+)?\s*$')
+# "Department (08)" as built by format_location, or a bare department code
+_DEPARTMENT_CODE_PATTERN = re.compile(r'\((\d{2}|2[AaBb])\)|^\s*(\d{2}|2[AaBb])\s*$')
+
+_NON_ALPHANUMERIC = re.compile(r'[^a-z0-9]+')
+
+# Single-word department names shorter than this are ignored in free text
+MIN_TEXT_NAME_LENGTH = 5
+
+# Distinct strings classified per gazetteer before the cache is reset
+LOOKUP_CACHE_SIZE = 100000
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def fold(text):
+    """Lowercase, accent-free, space-separated tokens ("Côte-d'Or" -> "cote d or")"""
+    text = str(text)
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return _NON_ALPHANUMERIC.sub(' ', text.lower()).strip()
+
+
+class Gazetteer:
+    """Departments, place names and sites of the gazetteer file"""
+
+    def __init__(self, data):
+        self.departments = {
+            code: {'code': code, 'name': name, 'region': region, 'zone': zone, 'lat': lat, 'lon': lon}
+            for code, (name, region, zone, lat, lon) in data.get('departments', {}).items()
+        }
+        self.sites = {
+            name: {'name': name, 'department': department, 'lat': lat, 'lon': lon}
+            for name, (department, lat, lon) in data.get('sites', {}).items()
+        }
+        self.zones = sorted({department['zone'] for department in self.departments.values()})
+
+        # Place name -> ('department', code) or ('zone', zone); department and
+        # commune names take precedence over area names
+        self.places = {}
+        for area, zone in data.get('areas', {}).items():
+            self.places[fold(area)] = ('zone', zone)
+        for commune, code in data.get('communes', {}).items():
+            if code in self.departments:
+                self.places[fold(commune)] = ('department', code)
+        for code, department in self.departments.items():
+            self.places[fold(department['name'])] = ('department', code)
+
+        # Short department names are also common words ("lot", "var", "cher"):
+        # free text only matches them through a department code or commune
+        self.text_places = {
+            name: place for name, place in self.places.items()
+            if place[0] == 'zone' or ' ' in name or len(name) >= MIN_TEXT_NAME_LENGTH
+        }
+
+        self.site_names = {fold(name): site for name, site in self.sites.items()}
+        self._max_tokens = max(
+            (len(name.split()) for name in (*self.places, *self.site_names)), default=1
+        )
+
+        self._location_cache = {}
+
+    # ------------------------------------------------------------------
+    # Locations
+    # ------------------------------------------------------------------
+
+    def find_postal_code(self, location):
+        """
+        Postal code of a location
+
+        Returns:
+            (code, start, end) with the span of the code in the string, or None
+        """
+        match = _POSTAL_CODE_PATTERN.search(location)
+        if not match:
+            match = _SHORT_POSTAL_CODE_PATTERN.match(location)
+            if not match:
+                return None
+            return match.group(1).zfill(5), match.start(), match.end()
+        return match.group(1), match.start(), match.end()
+
+    def postal_department(self, postal_code):
+        """Department code of a 5-digit postal code, or None (overseas, unknown)"""
+        if postal_code.startswith('20'):
+            # Corsica: 200xx-201xx Corse-du-Sud, 202xx-206xx Haute-Corse
+            code = '2A' if postal_code < '20200' else '2B'
+        else:
+            code = postal_code[:2]
+        return code if code in self.departments else None
+
+    def classify(self, location):
+        """
+        (department code, zone) of a location string; either may be None
+        """
+        if not location:
+            return None, None
+        result = self._location_cache.get(location)
+        if result is None:
+            result = self._classify(location)
+            if len(self._location_cache) >= LOOKUP_CACHE_SIZE:
+                self._location_cache.clear()
+            self._location_cache[location] = result
+        return result
+
+    def _classify(self, location):
+        postal = self.find_postal_code(location)
+        if postal:
+            code = self.postal_department(postal[0])
+            if code:
+                return code, self.departments[code]['zone']
+
+        match = _DEPARTMENT_CODE_PATTERN.search(location)
+        if match:
+            code = (match.group(1) or match.group(2)).upper()
+            if code in self.departments:
+                return code, self.departments[code]['zone']
+
+        place = self._first_place(fold(location).split())
+        if place is None:
+            return None, None
+        kind, value = place
+        if kind == 'department':
+            return value, self.departments[value]['zone']
+        return None, value
+
+    def _first_place(self, tokens):
+        # Leftmost, then longest, known place name
+        for start in range(len(tokens)):
+            for length in range(min(self._max_tokens, len(tokens) - start), 0, -1):
+                place = self.places.get(' '.join(tokens[start:start + length]))
+                if place is not None:
+                    return place
+        return None
+
+    def department_of(self, location):
+        """Department code of a location string, or None"""
+        return self.classify(location)[0]
+
+    def zone_of(self, location):
+        """Zone of a location string, or None"""
+        return self.classify(location)[1]
+
+    def coordinates_of(self, location):
+        """(lat, lon) centroid of the department of a location, or None"""
+        code = self.department_of(location)
+        if code is None:
+            return None
+        department = self.departments[code]
+        return department['lat'], department['lon']
+
+    # ------------------------------------------------------------------
+    # Free text (matching criteria)
+    # ------------------------------------------------------------------
+
+    def find_site(self, text):
+        """First gazetteer site named in a text, or None"""
+        tokens = fold(text).split()
+        for start in range(len(tokens)):
+            for length in range(min(self._max_tokens, len(tokens) - start), 0, -1):
+                site = self.site_names.get(' '.join(tokens[start:start + length]))
+                if site is not None:
+                    return site
+        return None
+
+    def zones_in(self, text):
+        """
+        Zones named in a text (area, department, commune or site names), in
+        order of appearance
+        """
+        tokens = fold(text).split()
+        zones = []
+        start = 0
+        while start < len(tokens):
+            for length in range(min(self._max_tokens, len(tokens) - start), 0, -1):
+                name = ' '.join(tokens[start:start + length])
+                place = self.text_places.get(name)
+                site = self.site_names.get(name) if place is None else None
+                if place is not None or site is not None:
+                    if site is not None:
+                        zone = self.departments[site['department']]['zone']
+                    elif place[0] == 'department':
+                        zone = self.departments[place[1]]['zone']
+                    else:
+                        zone = place[1]
+                    if zone not in zones:
+                        zones.append(zone)
+                    start += length
+                    break
+            else:
+                start += 1
+        return zones
+
+
+def get_gazetteer():
+    """Load the gazetteer file once (empty gazetteer if it is missing)"""
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                try:
+                    with open(GAZETTEER_PATH, encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning("Gazetteer unavailable (%s): %s", GAZETTEER_PATH, e)
+                    data = {}
+                _gazetteer = Gazetteer(data)
+    return _gazetteer
@@ -0,0 +1,142 @@
+"""
+geo_index.py - Geographic index of the company panel for EDF Panel Entreprises
+
+Company locations are resolved once per CompanyTable to the centroid of
+their department, using the offline gazetteer (utils.gazetteer). Companies
+are bucketed in a grid of GRID_CELL_DEGREES cells so that a radius query
+("à moins de 150 km du CNPE de Chooz") only computes the distances of the
+companies in the cells overlapping the circle, in a single vectorized
+haversine pass.
+
+The index is built on first use and cached on the table, which is immutable.
+"""
+
+import re
+import math
+import functools
+import threading
+import logging
+
+from utils.gazetteer import get_gazetteer
+from utils.lazy_imports import get_numpy
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+
+# Grid cell size used to prefilter radius queries (about 110 x 75 km in France)
+GRID_CELL_DEGREES = 1.0
+
+_RADIUS_PATTERN = re.compile(r'(\d+(?:[.,]\d+)?)\s*km\b')
+
+_build_lock = threading.Lock()
+
+
+def haversine_km(lat, lon, origin_lat, origin_lon):
+    """
+    Great-circle distances in km from one origin to arrays of coordinates
+    (NaN coordinates give NaN distances)
+    """
+    np = get_numpy()
+    lat1, lon1 = math.radians(origin_lat), math.radians(origin_lon)
+    lat2, lon2 = np.radians(lat), np.radians(lon)
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def parse_radius_criterion(criterion):
+    """
+    Radius query of a geographic criterion ("à moins de 150 km du CNPE de
+    Chooz", "rayon de 80km autour de Gravelines")
+
+    Returns:
+        (site, radius_km), or None when the criterion does not name both a
+        distance and a gazetteer site
+    """
+    return _radius_query(f"{criterion.get('name', '')} {criterion.get('description', '')}")
+
+
+@functools.lru_cache(maxsize=256)
+def _radius_query(text):
+    # Cached: match_geographic parses the same criterion for every company
+    match = _RADIUS_PATTERN.search(text.lower())
+    if not match:
+        return None
+    site = get_gazetteer().find_site(text)
+    if site is None:
+        return None
+    radius = float(match.group(1).replace(',', '.'))
+    return (site, radius) if radius > 0 else None
+
+
+class GeoIndex:
+    """Resolved coordinates and grid buckets of the rows of one CompanyTable"""
+
+    def __init__(self, table):
+        np = get_numpy()
+        gazetteer = get_gazetteer()
+        self.size = len(table)
+
+        # Locations are dictionary-encoded: resolve each distinct value once
+        locations = table.vocabularies['location'].values
+        resolved = [gazetteer.coordinates_of(location) for location in locations]
+        codes = np.frombuffer(table._codes['location'], dtype=np.uint32)
+        # Code 0 ("Non spécifié", or a location kept verbatim) never resolves
+        lookup_lat = np.array([c[0] if c else np.nan for c in resolved])
+        lookup_lon = np.array([c[1] if c else np.nan for c in resolved])
+        self.lat = lookup_lat[codes]
+        self.lon = lookup_lon[codes]
+        self.located = ~np.isnan(self.lat)
+
+        rows = np.flatnonzero(self.located)
+        cells = zip(np.floor(self.lat[rows] / GRID_CELL_DEGREES).astype(int).tolist(),
+                    np.floor(self.lon[rows] / GRID_CELL_DEGREES).astype(int).tolist())
+        buckets = {}
+        for row, cell in zip(rows.tolist(), cells):
+            buckets.setdefault(cell, []).append(row)
+        self.grid = {cell: np.array(members, dtype=np.int64) for cell, members in buckets.items()}
+
+    def rows_within(self, lat, lon, radius_km):
+        """
+        Located rows within radius_km of a point
+
+        Returns:
+            (rows, distances): numpy arrays sorted by row
+        """
+        np = get_numpy()
+        # Cells overlapping the bounding box of the circle
+        lat_span = math.degrees(radius_km / EARTH_RADIUS_KM)
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + lat_span, 89.0))), 1e-6)
+        lon_span = lat_span / cos_lat
+        lat_cells = range(math.floor((lat - lat_span) / GRID_CELL_DEGREES),
+                          math.floor((lat + lat_span) / GRID_CELL_DEGREES) + 1)
+        lon_cells = range(math.floor((lon - lon_span) / GRID_CELL_DEGREES),
+                          math.floor((lon + lon_span) / GRID_CELL_DEGREES) + 1)
+        buckets = [self.grid[(i, j)] for i in lat_cells for j in lon_cells if (i, j) in self.grid]
+        if not buckets:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        candidates = np.sort(np.concatenate(buckets))
+        distances = haversine_km(self.lat[candidates], self.lon[candidates], lat, lon)
+        inside = distances <= radius_km
+        return candidates[inside], distances[inside]
+
+    def distances_from(self, lat, lon):
+        """Distance of every row to a point (NaN for unlocated rows)"""
+        return haversine_km(self.lat, self.lon, lat, lon)
+
+
+def geo_index(table):
+    """Return the (cached) GeoIndex of a CompanyTable"""
+    index = getattr(table, '_geo_index', None)
+    if index is None:
+        with _build_lock:
+            index = getattr(table, '_geo_index', None)
+            if index is None:
+                with span('geo_index.build', companies=len(table)) as trace:
+                    index = GeoIndex(table)
+                    trace.set(located=int(index.located.sum()), cells=len(index.grid))
+                table._geo_index = index
+    return index
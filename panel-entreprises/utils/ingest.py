@@ -0,0 +1,220 @@
+"""
+ingest.py - Multi-workbook panel ingestion for EDF Panel Entreprises
+
+Each (workbook, sheet) pair of the ingestion jobs is parsed by
+excel_parser.load_companies_from_workbook in a process pool
+(PANEL_INGEST_WORKERS, defaults to the number of usable cores), so the sheets
+of one workbook are parsed in parallel too. The results are merged in job
+order into a single panel keyed by the stable company ids built by the
+parser, then near-duplicates are merged by utils.dedupe.
+
+The pool forks: spawn and forkserver would re-import the main module
+(app.py, which loads the panel) in every worker. Forking is only safe from a
+single-threaded process, so:
+- a single-process server calls start_parse_pool() at boot, before starting
+  any thread: the parser processes are forked at once and serve every later
+  parse (boot load, source reloads, imports), from any thread
+- the gunicorn master, which never runs other threads, forks a pool for each
+  parse
+- elsewhere (gunicorn workers, no fork, one core), sheets are parsed
+  in-process, one workbook opened once for all its sheets
+"""
+
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.excel_parser import load_companies_from_workbook
+from utils.dedupe import merge_company_records, dedupe_companies
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Near-duplicate detection across the merged sources (PANEL_DEDUPE=0 to disable)
+DEDUPE_ENABLED = os.environ.get('PANEL_DEDUPE', '1') == '1'
+
+
+def usable_cpu_count():
+    """Cores this process may run on (affinity and cgroup aware where the platform tells)"""
+    if hasattr(os, 'process_cpu_count'):
+        return os.process_cpu_count() or 1
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def fork_context():
+    """
+    multiprocessing fork context, or None when forking is unsafe: no fork
+    on this platform, or other threads running (their locks would be
+    copied held into the children)
+    """
+    logger.warning('THREADS %s', [t.name for t in threading.enumerate()])
+    if 'fork' not in multiprocessing.get_all_start_methods() or threading.active_count() > 1:
+        return None
+    return multiprocessing.get_context('fork')
+
+
+def configured_workers():
+    """Number of parser processes (PANEL_INGEST_WORKERS, else usable cores)"""
+    configured = os.environ.get('PANEL_INGEST_WORKERS')
+    return max(1, int(configured) if configured else usable_cpu_count())
+
+
+def ingest_workers(job_count):
+    """Number of worker processes for job_count jobs"""
+    return max(1, min(configured_workers(), job_count))
+
+
+# Parser processes started by start_parse_pool, and the process owning them
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def start_parse_pool():
+    """
+    Fork the parser processes now, for the parses made later from any
+    thread; call it while the process has a single thread (at boot, before
+    starting threads)
+
+    Returns:
+        Number of parser processes (0 when parses stay in-process: one
+        worker configured, no fork, or threads already running)
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            return _pool._max_workers
+        workers = configured_workers()
+        context = fork_context()
+        if workers < 2 or context is None:
+            return 0
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        _pool_pid = os.getpid()
+        # With fork, every process is started on the first submission: now
+        _pool.submit(os.getpid).result()
+    logger.info("Started %d parser processes", workers)
+    return workers
+
+
+def _parse_pool():
+    # The pool of this process (not one inherited through a fork)
+    return _pool if _pool is not None and _pool_pid == os.getpid() else None
+
+
+def _drop_parse_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_job(job):
+    """Parse the sheets of one workbook job; runs in a worker process"""
+    return load_companies_from_workbook(job['path'], job.get('sheets') or [None], job.get('columns'))
+
+
+def sheet_tasks(jobs):
+    """Split the jobs into one task per (workbook, sheet), in job order"""
+    return [{**job, 'sheets': [sheet]} for job in jobs for sheet in (job.get('sheets') or [None])]
+
+
+def parse_jobs(jobs):
+    """
+    Parse every sheet of every job, in the parser pool when started, else in
+    a pool forked for this parse when there are several sheets and forking
+    is safe (see fork_context), else in-process
+
+    Returns:
+        List of company lists (one per sheet), in job order
+    """
+    tasks = sheet_tasks(jobs)
+    pool = _parse_pool()
+    with span('ingest.parse', jobs=len(jobs), sheets=len(tasks)) as trace:
+        results = None
+        if pool is not None:
+            try:
+                results = list(pool.map(parse_job, tasks))
+                trace.set(workers=min(pool._max_workers, len(tasks)))
+            except BrokenProcessPool as e:
+                logger.error(f"Parser pool broken, parsing in-process: {e}")
+                _drop_parse_pool(pool)
+        elif ingest_workers(len(tasks)) > 1:
+            context = fork_context()
+            if context is not None:
+                workers = ingest_workers(len(tasks))
+                # The children only parse workbooks
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                    results = list(executor.map(parse_job, tasks))
+                trace.set(workers=workers)
+        if results is None:
+            # One workbook opened once for all its sheets
+            results = [parse_job(job) for job in jobs]
+            trace.set(workers=1)
+
+    return [companies for sheets in results for companies in sheets]
+
+
+def parse_workbook(path, sheets=None, columns=None):
+    """
+    Parse the sheets of one workbook (in the parser pool when started, so
+    that a request thread does not hold the interpreter while parsing)
+
+    Returns:
+        One list of companies per sheet
+    """
+    return parse_jobs([{'path': path, 'sheets': sheets or [None], 'columns': columns}])
+
+
+def merge_companies(company_lists):
+    """
+    Merge company lists into one panel, keeping the first occurrence of
+    each id and completing it with later duplicates
+
+    Returns:
+        (companies, duplicate_count)
+    """
+    merged = {}
+    duplicates = 0
+
+    for companies in company_lists:
+        for company in companies:
+            existing = merged.get(company['id'])
+            if existing is None:
+                merged[company['id']] = company
+            else:
+                merge_company_records(existing, company)
+                duplicates += 1
+
+    return list(merged.values()), duplicates
+
+
+def ingest(jobs):
+    """
+    Parse and merge a list of jobs
+
+    Args:
+        jobs: List of {'path', 'sheets', 'columns'} dictionaries
+
+    Returns:
+        Merged list of companies
+    """
+    if not jobs:
+        return []
+
+    with span('ingest', jobs=len(jobs)) as trace:
+        results = parse_jobs(jobs)
+        companies, duplicates = merge_companies(results)
+        if DEDUPE_ENABLED:
+            companies, report, _ = dedupe_companies(companies)
+            duplicates += sum(len(entry['merged']) for entry in report)
+        trace.set(companies=len(companies), duplicates=duplicates)
+
+    logger.info("Ingested %d companies from %d workbooks (%d duplicates merged)",
+                len(companies), len(jobs), duplicates)
+    return companies
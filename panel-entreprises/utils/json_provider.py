@@ -0,0 +1,79 @@
+"""
+json_provider.py - Pluggable JSON serialization for EDF Panel Entreprises
+
+Flask responses (jsonify) and request bodies go through app.json. This
+provider uses orjson when it is installed, which serializes the large
+company and match lists several times faster than the json module, and
+falls back to Flask's stdlib provider otherwise.
+
+Configuration (environment variable):
+    PANEL_JSON_BACKEND: 'orjson', 'json' or 'auto' (default: orjson if installed)
+"""
+
+import os
+import logging
+
+from flask.json.provider import DefaultJSONProvider
+
+logger = logging.getLogger(__name__)
+
+JSON_BACKEND = os.environ.get('PANEL_JSON_BACKEND', 'auto').lower()
+
+
+def load_orjson():
+    """Return the orjson module, or None when it is disabled or not installed"""
+    if JSON_BACKEND == 'json':
+        return None
+    try:
+        import orjson
+    except ImportError:
+        if JSON_BACKEND == 'orjson':
+            logger.warning("PANEL_JSON_BACKEND=orjson but orjson is not installed, using json")
+        return None
+    return orjson
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    DefaultJSONProvider serializing with orjson when available
+
+    Output keeps the stdlib provider conventions (sorted keys, types handled
+    by DefaultJSONProvider.default); calls with extra json.dumps arguments
+    use the stdlib provider.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self._orjson = load_orjson()
+        if self._orjson is not None:
+            self._options = self._orjson.OPT_NON_STR_KEYS | self._orjson.OPT_SERIALIZE_NUMPY
+            if self.sort_keys:
+                self._options |= self._orjson.OPT_SORT_KEYS
+
+    @property
+    def backend(self):
+        """Name of the serializer in use"""
+        return 'orjson' if self._orjson is not None else 'json'
+
+    def dumps_bytes(self, obj):
+        """Serialize obj to UTF-8 encoded JSON"""
+        if self._orjson is None:
+            return super().dumps(obj).encode('utf-8')
+        return self._orjson.dumps(obj, default=self.default, option=self._options)
+
+    def dumps(self, obj, **kwargs):
+        if self._orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if self._orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return self._orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if self._orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        # Bytes straight from orjson: no str round trip
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
@@ -0,0 +1,73 @@
+"""
+lazy_imports.py - Deferred loading of heavy dependencies for EDF Panel Entreprises
+
+Heavy modules (pandas, numpy, openpyxl, PyPDF2, python-docx, requests) are imported
+on first use through the accessors below instead of at module import time,
+which keeps worker cold start short. The time spent in each first import is
+recorded for the startup profile (see utils.boot_profile).
+"""
+
+import sys
+import threading
+import time
+
+_modules = {}
+_import_times = {}
+_lock = threading.Lock()
+
+
+def _load(module_name):
+    module = _modules.get(module_name)
+    if module is not None:
+        return module
+
+    with _lock:
+        module = _modules.get(module_name)
+        if module is None:
+            start = time.perf_counter()
+            # Plain __import__ so that the boot profiler import hook sees it
+            __import__(module_name)
+            module = sys.modules[module_name]
+            _import_times[module_name] = (time.perf_counter() - start) * 1000
+            _modules[module_name] = module
+    return module
+
+
+def get_pandas():
+    """Return the pandas module"""
+    return _load('pandas')
+
+
+def get_numpy():
+    """Return the numpy module"""
+    return _load('numpy')
+
+
+def get_openpyxl():
+    """Return the openpyxl module"""
+    return _load('openpyxl')
+
+
+def get_pypdf2():
+    """Return the PyPDF2 module (raises ImportError if not installed)"""
+    return _load('PyPDF2')
+
+
+def get_docx():
+    """Return the python-docx module (raises ImportError if not installed)"""
+    return _load('docx')
+
+
+def get_requests():
+    """Return the requests module"""
+    return _load('requests')
+
+
+def get_sequence_matcher():
+    """Return difflib.SequenceMatcher"""
+    return _load('difflib').SequenceMatcher
+
+
+def lazy_import_times():
+    """Return the duration (ms) of each first import done through an accessor"""
+    return dict(_import_times)
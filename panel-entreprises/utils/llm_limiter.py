@@ -0,0 +1,209 @@
+"""
+llm_limiter.py - Outbound concurrency limits for LLM calls in EDF Panel Entreprises
+
+Every call to the Prisme webhook goes through one process-wide LLMLimiter:
+- bulkhead: at most max_concurrency HTTP requests are in flight; further
+  callers wait in a FIFO queue for at most queue_timeout seconds, and are
+  rejected at once when max_queue callers are already waiting, so that a
+  burst cannot pile up retries against a rate-limited upstream
+- single flight: concurrent calls with the same key (same prompt, project
+  and URL) share one in-flight call and its answer
+
+Callers are the request threads of the WSGI workers: slots are handed
+over under a threading lock.
+
+Configuration (environment variables):
+    PANEL_LLM_MAX_CONCURRENCY: concurrent webhook requests (default 4)
+    PANEL_LLM_MAX_QUEUE: callers allowed to wait for a slot (default 64)
+    PANEL_LLM_QUEUE_TIMEOUT: seconds a caller waits for a slot (default 30)
+"""
+
+import os
+import time
+import hashlib
+import threading
+import logging
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class LimiterRejected(Exception):
+    """No slot was available: the queue is full or the wait timed out"""
+
+
+def flight_key(*parts):
+    """Hash identifying identical calls (prompt, project, URL...)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class _Waiter:
+    """A caller queued for a slot; wake() is called once the slot is granted"""
+
+    __slots__ = ('wake', 'granted')
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+
+
+class _Flight:
+    """One in-flight call and the callers waiting for its answer"""
+
+    __slots__ = ('done', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+    def answer(self):
+        # Followers see the leader's exception; a cancelled leader
+        # (BaseException) gives them no answer, like a failed call
+        if isinstance(self.error, Exception):
+            raise self.error
+        return self.result
+
+
+class LLMLimiter:
+    """Bulkhead and single-flight coalescing shared by the request threads"""
+
+    def __init__(self, max_concurrency=None, max_queue=None, queue_timeout=None):
+        self.max_concurrency = max(1, max_concurrency or int(os.environ.get('PANEL_LLM_MAX_CONCURRENCY', '4')))
+        self.max_queue = max_queue if max_queue is not None else int(os.environ.get('PANEL_LLM_MAX_QUEUE', '64'))
+        self.queue_timeout = (queue_timeout if queue_timeout is not None
+                              else float(os.environ.get('PANEL_LLM_QUEUE_TIMEOUT', '30')))
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = deque()
+        self._flights = {}
+        self._counters = {
+            'acquired': 0, 'queued': 0, 'rejected': 0, 'timedOut': 0,
+            'maxQueueDepth': 0, 'waitTotalMs': 0.0, 'waitMaxMs': 0.0,
+            'calls': 0, 'coalesced': 0
+        }
+
+    # ------------------------------------------------------------------
+    # Bulkhead
+    # ------------------------------------------------------------------
+
+    def _try_acquire(self, wake):
+        # Returns None when a slot was taken, else the queued waiter
+        with self._lock:
+            if self._active < self.max_concurrency and not self._waiters:
+                self._active += 1
+                self._counters['acquired'] += 1
+                return None
+            if len(self._waiters) >= self.max_queue:
+                self._counters['rejected'] += 1
+                raise LimiterRejected(f"LLM queue full ({len(self._waiters)} waiting)")
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            self._counters['queued'] += 1
+            self._counters['maxQueueDepth'] = max(self._counters['maxQueueDepth'], len(self._waiters))
+            return waiter
+
+    def _granted_or_cancel(self, waiter, start):
+        # Called once the wait ended: True if the slot was handed over
+        with self._lock:
+            wait_ms = (time.perf_counter() - start) * 1000
+            self._counters['waitTotalMs'] += wait_ms
+            self._counters['waitMaxMs'] = max(self._counters['waitMaxMs'], wait_ms)
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            self._counters['timedOut'] += 1
+            return False
+
+    def _release(self):
+        with self._lock:
+            if self._waiters:
+                # Hand the slot over: _active is unchanged
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                self._counters['acquired'] += 1
+                waiter.wake()
+            else:
+                self._active -= 1
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the max_concurrency slots (raises LimiterRejected)"""
+        event = threading.Event()
+        waiter = self._try_acquire(event.set)
+        if waiter is not None:
+            start = time.perf_counter()
+            event.wait(self.queue_timeout)
+            if not self._granted_or_cancel(waiter, start):
+                raise LimiterRejected(f"No LLM slot after {self.queue_timeout:g}s")
+        try:
+            yield
+        finally:
+            self._release()
+
+    # ------------------------------------------------------------------
+    # Single flight
+    # ------------------------------------------------------------------
+
+    def _join(self, key):
+        # Returns (flight, leader)
+        with self._lock:
+            self._counters['calls'] += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self._counters['coalesced'] += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def _finish(self, key, flight, result=None, error=None):
+        with self._lock:
+            del self._flights[key]
+            flight.result = result
+            flight.error = error
+            flight.done.set()
+
+    def coalesce(self, key, call):
+        """Return call(), sharing one execution between concurrent callers of key"""
+        flight, leader = self._join(key)
+        if not leader:
+            flight.done.wait()
+            return flight.answer()
+        try:
+            result = call()
+        except BaseException as e:
+            self._finish(key, flight, error=e)
+            raise
+        self._finish(key, flight, result=result)
+        return result
+
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+
+    def stats(self):
+        """Return slot usage, queue depth, wait times and coalescing counters"""
+        with self._lock:
+            counters = dict(self._counters)
+            waits = counters['queued'] - len(self._waiters)
+            return {
+                'maxConcurrency': self.max_concurrency,
+                'maxQueue': self.max_queue,
+                'queueTimeout': self.queue_timeout,
+                'active': self._active,
+                'queueDepth': len(self._waiters),
+                'inFlight': len(self._flights),
+                **counters,
+                'waitAvgMs': counters['waitTotalMs'] / waits if waits else 0.0
+            }
+
+
+# Process-wide limiter used by utils.mistral_api
+LLM_LIMITER = LLMLimiter()
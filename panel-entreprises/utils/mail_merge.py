@@ -0,0 +1,231 @@
+"""
+mail_merge.py - Mail-merge of consultation letters for EDF Panel Entreprises
+
+One consultation letter is rendered per selected company from a single
+MergeTemplate:
+- the letter text is compiled once: it is laid out as docx paragraphs
+  (utils.document_writers) and the merge fields ({{entreprise}},
+  {{localisation}}, {{email}}...) are left as slots of the resulting
+  document.xml, template headers and footers included
+- rendering a letter only fills the slots with the escaped company values
+  and packs the docx, without any LLM call
+- letters are rendered in chunks by a thread pool shared by the requests
+  (docx compression releases the GIL) and written, in company order, to a
+  ZIP archive streamed as it is built (stream_zip), with a
+  destinataires.csv list of the letters and their addresses
+
+Configuration (environment variables):
+    PANEL_MERGE_WORKERS: rendering threads (default: usable cores)
+    PANEL_MERGE_CHUNK: letters rendered per worker task (default 50)
+"""
+
+import io
+import os
+import re
+import csv
+import zipfile
+import logging
+import threading
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.document_writers import docx_paragraphs, docx_skeleton, xml_text
+from utils.gazetteer import fold
+from utils.ingest import usable_cpu_count
+
+logger = logging.getLogger(__name__)
+
+MERGE_WORKERS = max(1, int(os.environ.get('PANEL_MERGE_WORKERS') or usable_cpu_count()))
+MERGE_CHUNK = int(os.environ.get('PANEL_MERGE_CHUNK', '50'))
+
+
+def _contact(field):
+    return lambda company: (company.get('contact') or {}).get(field, '')
+
+
+# Merge fields and the company value they are replaced with
+MERGE_FIELDS = {
+    'entreprise': lambda company: company.get('name', ''),
+    'localisation': lambda company: company.get('location', ''),
+    'domaine': lambda company: company.get('domain', ''),
+    'email': _contact('email'),
+    'telephone': _contact('phone')
+}
+
+# Recipient block put above the letter body by letter_template
+RECIPIENT_BLOCK = "{{entreprise}}\n{{localisation}}\n{{email}}\n\n"
+
+_FIELD = re.compile(r'\{\{\s*([a-z_]+)\s*\}\}')
+
+
+def letter_template(body):
+    """
+    Merge text of a consultation letter: a body with its own merge fields
+    as is, else the recipient block then the body
+    """
+    if _FIELD.search(body):
+        return body
+    return RECIPIENT_BLOCK + body.lstrip('\n')
+
+
+class MergeTemplate:
+    """A letter compiled once, rendered as a docx package per company"""
+
+    __slots__ = ('parts', 'segments', 'fields')
+
+    def __init__(self, text, title=None, template_path=None):
+        """
+        Args:
+            text: Letter text with {{field}} merge fields
+            title: Optional title paragraph
+            template_path: Optional docx template (see write_docx); its
+                document body may hold merge fields too
+
+        Raises:
+            ValueError: if the text uses unknown merge fields
+        """
+        self.parts, before, after, heading_styles = docx_skeleton(template_path)
+        document_xml = before + ''.join(docx_paragraphs(text, heading_styles, title)) + after
+
+        # Literal XML at even indexes, field names at odd ones
+        self.segments = tuple(_FIELD.split(document_xml))
+        self.fields = frozenset(self.segments[1::2])
+        unknown = self.fields - MERGE_FIELDS.keys()
+        if unknown:
+            raise ValueError(f"Unknown merge fields: {', '.join(sorted(unknown))}")
+
+    def render(self, company):
+        """docx package (bytes) of the letter addressed to company"""
+        values = {field: xml_text(MERGE_FIELDS[field](company) or '') for field in self.fields}
+        segments = self.segments
+        document_xml = ''.join(
+            segment if index % 2 == 0 else values[segment]
+            for index, segment in enumerate(segments)
+        )
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as package:
+            for name, data in self.parts:
+                package.writestr(name, data)
+            package.writestr('word/document.xml', document_xml.encode('utf-8'))
+        return buffer.getvalue()
+
+
+# ----------------------------------------------------------------------
+# Parallel rendering
+# ----------------------------------------------------------------------
+
+def merge_workers(chunk_count):
+    """Number of rendering threads for chunk_count chunks of letters"""
+    return max(1, min(MERGE_WORKERS, chunk_count))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _merge_executor():
+    # One pool for the process, created on first use in the serving
+    # process (after any fork) and shared by every request
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MERGE_WORKERS, thread_name_prefix='mail-merge')
+        return _executor
+
+
+def _render_chunk(template, companies):
+    return [template.render(company) for company in companies]
+
+
+def render_letters(template, companies):
+    """
+    Render the letter of every company (a generator)
+
+    A single chunk of letters is rendered in the calling thread; more are
+    rendered by the shared pool, at most two chunks per worker ahead of the
+    consumer.
+
+    Yields:
+        (company, docx bytes), in company order
+    """
+    chunks = [companies[start:start + MERGE_CHUNK] for start in range(0, len(companies), MERGE_CHUNK)]
+    workers = merge_workers(len(chunks))
+    if workers == 1:
+        for company in companies:
+            yield company, template.render(company)
+        return
+
+    executor = _merge_executor()
+    remaining = iter(chunks)
+    pending = deque(
+        (chunk, executor.submit(_render_chunk, template, chunk))
+        for chunk in islice(remaining, 2 * workers)
+    )
+    try:
+        while pending:
+            chunk, future = pending.popleft()
+            letters = future.result()
+            following = next(remaining, None)
+            if following is not None:
+                pending.append((following, executor.submit(_render_chunk, template, following)))
+            yield from zip(chunk, letters)
+    finally:
+        # A closed stream (client gone) drops the chunks not yet rendered
+        for _, future in pending:
+            future.cancel()
+
+
+def letter_filename(index, company, prefix='LC'):
+    """Archive name of the index-th letter: LC_007_nom_de_l_entreprise.docx"""
+    slug = fold(company.get('name', '')).replace(' ', '_')[:60] or 'entreprise'
+    return f"{prefix}_{index:03d}_{slug}.docx"
+
+
+# ----------------------------------------------------------------------
+# Streamed ZIP archive
+# ----------------------------------------------------------------------
+
+class _ZipSink:
+    """Unseekable file collecting what zipfile writes, drained between entries"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(template, companies, prefix='LC'):
+    """
+    ZIP archive of the merged letters, yielded in chunks as they are
+    rendered (a generator of bytes)
+
+    Letters are stored (docx packages are already compressed) and followed
+    by destinataires.csv: file name, company, location, email and phone.
+    """
+    sink = _ZipSink()
+    recipients = io.StringIO()
+    writer = csv.writer(recipients, delimiter=';')
+    writer.writerow(['fichier', 'entreprise', 'localisation', 'email', 'telephone'])
+
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+        for index, (company, letter) in enumerate(render_letters(template, companies), 1):
+            filename = letter_filename(index, company, prefix)
+            archive.writestr(filename, letter)
+            writer.writerow([filename] + [MERGE_FIELDS[field](company) or '' for field in
+                                          ('entreprise', 'localisation', 'email', 'telephone')])
+            yield sink.drain()
+        # utf-8-sig: Excel opens the list with its accents
+        archive.writestr('destinataires.csv', recipients.getvalue().encode('utf-8-sig'))
+    yield sink.drain()
@@ -1,27 +1,74 @@
 """
 mistral_api.py - Enhanced Mistral API integration for EDF Panel Entreprises
+
+Every call goes through the Prisme webhook (PRISME_API_URL overrides the
+production URL, e.g. to point at scripts/stub_webhook.py) with requests,
+from the threads of the WSGI workers. Calls share the process-wide bulkhead
+and single-flight coalescing of utils.llm_limiter, and the circuit breaker
+of utils.circuit_breaker: while the endpoint is down, calls return None at
+once and the local fallbacks answer (MistralAPI.degraded is then set).
 """
 
-import requests
+import os
 import json
 import time
 import re
 import logging
 from datetime import datetime
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from utils.lazy_imports import get_requests
+from utils.tracing import span
+from utils.llm_limiter import LLM_LIMITER, LimiterRejected, flight_key
+from utils.circuit_breaker import PRISME_BREAKER, CircuitOpen, failed_status
+from utils.prompt_compaction import compact_document
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_API_URL = os.environ.get(
+    'PRISME_API_URL', "https://api.iag.edf.fr/v2/workspaces/HcA-puQ/webhooks/query"
+)
+
+# Timeout of one webhook call, in seconds
+API_TIMEOUT = 60
+
+# Technical terms of the panel's domains and the word stems revealing them
+# (local keyword extraction, and relevance of document sections in prompts)
+TECHNICAL_TERMS = {
+    "électricité": ["électr", "électriq", "courant", "tension", "aliment", "câbl"],
+    "mécanique": ["mécan", "usinage", "tourna", "fraisage", "pièce"],
+    "hydraulique": ["hydraul", "fluid", "eau", "circuit", "pompe", "écoulement"],
+    "maintenance": ["mainten", "entretien", "réparation", "service", "dépannage"],
+    "bâtiment": ["bâtiment", "construction", "génie civil", "maçonnerie"],
+    "échangeur": ["échangeur", "plaque", "thermique", "chaleur", "transfert"],
+    "nettoyage": ["nettoy", "décontam", "lavage", "décapage", "propreté"],
+    "sécurité": ["sécurité", "prévention", "risque", "danger", "protection"]
+}
+
+TECHNICAL_STEMS = tuple(stem for stems in TECHNICAL_TERMS.values() for stem in stems)
+
+# Documents of a consultation pack, as named in generation prompts
+DOCUMENT_DESCRIPTIONS = {
+    "projetMarche": "un projet de marché (clauses administratives et techniques)",
+    "reglementConsultation": "un règlement de consultation",
+    "lettreConsultation": "une lettre de consultation",
+    "grilleEvaluation": "une grille d'évaluation avec les critères d'attribution"
+}
+
+# Line starting a document in the answer to a pack prompt
+_PACK_SEPARATOR = re.compile(r'^[ \t]*=+[ \t]*DOCUMENT[ \t]*:[ \t]*(\w+)[ \t]*=+[ \t]*$', re.MULTILINE)
+
 class MistralAPI:
     """Wrapper for Mistral API with enhanced error handling and retry logic"""
     
-    def __init__(self, api_key, agent_id):
+    def __init__(self, api_key, agent_id, api_url=None):
         self.api_key = api_key
         self.agent_id = agent_id
-        self.api_url = "https://api.iag.edf.fr/v2/workspaces/HcA-puQ/webhooks/query"
+        self.api_url = api_url or DEFAULT_API_URL
         self.max_retries = 3
         self.retry_delay = 2  # seconds
+        # Set when an answer came from the local fallback because the
+        # endpoint gave none (failure, open circuit, saturated limiter)
+        self.degraded = False
     
     def analyze_document(self, document_text):
         """
@@ -33,35 +80,58 @@ class MistralAPI:
         Returns:
             Dictionary with keywords, selection criteria, and attribution criteria
         """
-        logger.info("=== ANALYZING DOCUMENT WITH MISTRAL API ===")
-        logger.info(f"Document length: {len(document_text)} characters")
-        
-        # For very short texts, use fallback
-        if len(document_text.strip()) < 100:
-            logger.warning("Document too short, using fallback analysis")
-            return self._create_fallback_analysis()
-        
-        # Create analysis prompt
-        prompt = self._create_analysis_prompt(document_text)
-        
-        # Call API with retries
-        result = self._call_api(prompt)
-        
+        with span('llm.analyze', chars=len(document_text)) as trace:
+            # For very short texts, use fallback
+            if len(document_text.strip()) < 100:
+                logger.warning("Document too short, using fallback analysis")
+                trace.set(fallback=True)
+                return self._create_fallback_analysis()
+            
+            # Create analysis prompt
+            prompt = self._create_analysis_prompt(document_text)
+            
+            # Call API with retries
+            result = self._call_api(prompt)
+            
+            return self._analysis_from_answer(result, document_text, trace)
+    
+    def local_analysis(self, document_text):
+        """
+        Keywords and criteria extracted locally, without calling the API
+        (the first tier of a tiered analysis, and the fallback analysis)
+        """
+        with span('llm.analyze_local', chars=len(document_text)):
+            if len(document_text.strip()) < 100:
+                return self._create_fallback_analysis()
+            return self._create_fallback_analysis(document_text)
+    
+    def local_document(self, template_type, project_data, selected_companies=None):
+        """
+        Document written from the local templates, without calling the API
+        (the fallback document, and the body of mail-merged letters)
+        """
+        return self._create_fallback_document(template_type, project_data, selected_companies)
+
+    def _analysis_from_answer(self, result, document_text, trace):
+        """Parse the API answer of an analysis, or fall back to local analysis"""
         if result:
             try:
                 # Parse and validate the response
                 parsed_result = self._parse_analysis_response(result)
                 if parsed_result:
-                    logger.info("Analysis successful")
-                    logger.info(f"Keywords: {len(parsed_result.get('keywords', []))} extracted")
-                    logger.info(f"Selection criteria: {len(parsed_result.get('selectionCriteria', []))} extracted")
-                    logger.info(f"Attribution criteria: {len(parsed_result.get('attributionCriteria', []))} extracted")
+                    trace.set(
+                        keywords=len(parsed_result.get('keywords', [])),
+                        selection_criteria=len(parsed_result.get('selectionCriteria', [])),
+                        attribution_criteria=len(parsed_result.get('attributionCriteria', []))
+                    )
                     return parsed_result
             except Exception as e:
                 logger.error(f"Error parsing analysis response: {e}")
         
         # If API call fails or returns invalid response, use fallback
         logger.warning("Using fallback analysis")
+        trace.set(fallback=True)
+        self.degraded = True
         return self._create_fallback_analysis(document_text)
     
     def generate_document(self, template_type, project_data, selected_companies=None):
@@ -76,83 +146,165 @@ class MistralAPI:
         Returns:
             Generated document content
         """
-        logger.info(f"=== GENERATING DOCUMENT: {template_type} ===")
-        
-        # Create document generation prompt
-        prompt = self._create_document_prompt(template_type, project_data, selected_companies)
-        
-        # Call API with retries
-        result = self._call_api(prompt)
+        with span('llm.generate', template=template_type) as trace:
+            # Create document generation prompt
+            prompt = self._create_document_prompt(template_type, project_data, selected_companies)
+            
+            # Call API with retries
+            result = self._call_api(prompt)
+            
+            return self._document_from_answer(result, template_type, project_data, selected_companies, trace)
+    
+    def generate_documents(self, template_types, project_data, selected_companies=None):
+        """
+        Generate several documents with one API call sharing the project context
         
+        Args:
+            template_types: Types of documents to generate
+            project_data: Dictionary with project information
+            selected_companies: List of selected companies
+            
+        Returns:
+            Dictionary of generated content by template type
+        """
+        template_types = list(dict.fromkeys(template_types))
+        with span('llm.generate_pack', templates=len(template_types)) as trace:
+            context = self._project_context(project_data, selected_companies)
+            documents, missing = self._pack_documents(
+                template_types,
+                self._call_api(self._create_pack_prompt(template_types, context)) if len(template_types) > 1 else '',
+                project_data, selected_companies, trace
+            )
+            
+            for template_type in missing:
+                result = self._call_api(self._create_document_prompt(template_type, project_data, selected_companies, context))
+                documents[template_type] = self._document_from_answer(result, template_type, project_data, selected_companies, trace)
+            
+            return {template_type: documents[template_type] for template_type in template_types}
+    
+    def _pack_documents(self, template_types, result, project_data, selected_companies, trace):
+        """
+        Documents found in the answer of a pack prompt, and the types still to
+        generate one by one ('' result: no pack call was made)
+        """
+        if result is None:
+            # No answer at all: separate calls would fail the same way
+            return {
+                template_type: self._document_from_answer(None, template_type, project_data, selected_companies, trace)
+                for template_type in template_types
+            }, []
+        
+        documents = self._documents_from_pack_answer(result, template_types)
+        missing = [template_type for template_type in template_types if template_type not in documents]
+        trace.set(from_pack=len(documents), separate=len(missing))
+        return documents, missing
+    
+    def _document_from_answer(self, result, template_type, project_data, selected_companies, trace):
+        """Format the API answer of a document generation, or fall back to the template"""
         if result:
             # Clean up and format the result
             document_content = self._format_document_content(result, template_type)
             
             if document_content:
-                logger.info(f"Document generated successfully, length: {len(document_content)} characters")
+                trace.set(chars=len(document_content))
                 return document_content
         
         # Fallback if API fails
         logger.warning("Using fallback document generation")
+        trace.set(fallback=True)
+        self.degraded = True
         return self._create_fallback_document(template_type, project_data, selected_companies)
     
-    def _call_api(self, prompt, attempt=1):
+    def _request(self, prompt):
+        """Headers and JSON body of a webhook call"""
+        headers = {
+            "Content-Type": "application/json",
+            "knowledge-project-apikey": self.api_key
+        }
+        data = {
+            "text": prompt,
+            "projectId": self.agent_id
+        }
+        return headers, data
+    
+    def _answer(self, status_code, result, text):
+        """Answer text of a webhook response, or None"""
+        if status_code == 200:
+            answer = result.get("answer", "") if isinstance(result, dict) else ""
+            
+            if answer and len(answer.strip()) > 10:
+                return answer
+            logger.warning(f"API returned empty or very short response: {answer[:50]}")
+        else:
+            logger.error(f"API error: Status {status_code}, {text[:100]}")
+        return None
+    
+    def _flight_key(self, prompt):
+        """Key under which identical concurrent calls are coalesced"""
+        return flight_key(self.api_url, self.api_key, self.agent_id, prompt)
+    
+    def _call_api(self, prompt):
+        """Call the Mistral API, sharing the answer of an identical call in flight"""
+        if PRISME_BREAKER.rejects(count=True):
+            # Endpoint down: fall back at once
+            logger.info("Circuit open, skipping API call")
+            return None
+        return LLM_LIMITER.coalesce(self._flight_key(prompt), lambda: self._call_api_attempts(prompt))
+    
+    def _call_api_attempts(self, prompt, attempt=1):
         """Call the Mistral API with retry logic"""
         try:
-            logger.info(f"API call attempt {attempt}/{self.max_retries}")
+            logger.debug("API call attempt %d/%d", attempt, self.max_retries)
             
-            headers = {
-                "Content-Type": "application/json",
-                "knowledge-project-apikey": self.api_key
-            }
+            headers, data = self._request(prompt)
             
-            data = {
-                "text": prompt,
-                "projectId": self.agent_id
-            }
+            with LLM_LIMITER.slot(), PRISME_BREAKER.attempt() as outcome:
+                response = get_requests().post(
+                    self.api_url, 
+                    headers=headers, 
+                    json=data,
+                    timeout=API_TIMEOUT  # Increase timeout for longer documents
+                )
+                outcome.failed = failed_status(response.status_code)
             
-            response = requests.post(
-                self.api_url, 
-                headers=headers, 
-                json=data,
-                timeout=60  # Increase timeout for longer documents
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                answer = result.get("answer", "")
-                
-                if answer and len(answer.strip()) > 10:
-                    return answer
-                else:
-                    logger.warning(f"API returned empty or very short response: {answer[:50]}")
-            else:
-                logger.error(f"API error: Status {response.status_code}, {response.text[:100]}")
+            answer = self._answer(response.status_code,
+                                  response.json() if response.status_code == 200 else None,
+                                  response.text)
+            if answer:
+                return answer
             
             # Retry if not successful and attempts remain
-            if attempt < self.max_retries:
-                logger.info(f"Retrying in {self.retry_delay} seconds...")
+            if attempt < self.max_retries and not PRISME_BREAKER.rejects():
+                logger.info("Retrying in %s seconds...", self.retry_delay)
                 time.sleep(self.retry_delay)
-                return self._call_api(prompt, attempt + 1)
+                return self._call_api_attempts(prompt, attempt + 1)
             
             return None
+        
+        except LimiterRejected as e:
+            # Saturated: retrying would only lengthen the queue
+            logger.warning(f"API call rejected by the limiter: {e}")
+            return None
+        
+        except CircuitOpen as e:
+            logger.info(f"API call skipped: {e}")
+            return None
             
         except Exception as e:
             logger.error(f"API call error: {e}")
             
             # Retry if attempts remain
-            if attempt < self.max_retries:
-                logger.info(f"Retrying in {self.retry_delay} seconds...")
+            if attempt < self.max_retries and not PRISME_BREAKER.rejects():
+                logger.info("Retrying in %s seconds...", self.retry_delay)
                 time.sleep(self.retry_delay)
-                return self._call_api(prompt, attempt + 1)
+                return self._call_api_attempts(prompt, attempt + 1)
             
             return None
     
     def _create_analysis_prompt(self, document_text):
         """Create prompt for document analysis"""
-        # Limit text length to avoid token limits
-        max_chars = 6000
-        text_sample = document_text[:max_chars] if len(document_text) > max_chars else document_text
+        # Keep the sections richest in requirements within the prompt budget
+        text_sample = compact_document(document_text, vocabulary=TECHNICAL_STEMS)
         
         return f"""Analysez ce cahier des charges EDF pour un projet de moins de 400K€ et extrayez UNIQUEMENT les informations suivantes au format JSON.
 
@@ -274,7 +426,7 @@ Le JSON doit être valide et complet.
     
     def _create_fallback_analysis(self, document_text=None):
         """Create fallback analysis when API fails"""
-        logger.info("Creating fallback analysis")
+        logger.debug("Creating fallback analysis")
         
         # Extract keywords if document text is provided
         keywords = self._extract_keywords_from_text(document_text) if document_text else [
@@ -350,25 +502,13 @@ Le JSON doit être valide et complet.
         if not text:
             return ["EDF", "Projet", "Consultation"]
         
-        # Common technical terms to look for
-        technical_terms = {
-            "électricité": ["électr", "électriq", "courant", "tension", "aliment", "câbl"],
-            "mécanique": ["mécan", "usinage", "tourna", "fraisage", "pièce"],
-            "hydraulique": ["hydraul", "fluid", "eau", "circuit", "pompe", "écoulement"],
-            "maintenance": ["mainten", "entretien", "réparation", "service", "dépannage"],
-            "bâtiment": ["bâtiment", "construction", "génie civil", "maçonnerie"],
-            "échangeur": ["échangeur", "plaque", "thermique", "chaleur", "transfert"],
-            "nettoyage": ["nettoy", "décontam", "lavage", "décapage", "propreté"],
-            "sécurité": ["sécurité", "prévention", "risque", "danger", "protection"]
-        }
-        
         # Lowercase text for matching
         text_lower = text.lower()
         
         # Find matching technical terms
         keywords = ["EDF", "Projet"]
         
-        for term, patterns in technical_terms.items():
+        for term, patterns in TECHNICAL_TERMS.items():
             if any(pattern in text_lower for pattern in patterns):
                 keywords.append(term.capitalize())
         
@@ -408,18 +548,42 @@ Le JSON doit être valide et complet.
         
         return None
     
-    def _create_document_prompt(self, template_type, project_data, selected_companies=None):
-        """Create prompt for document generation"""
-        # Document type descriptions
-        doc_descriptions = {
-            "projetMarche": "un projet de marché (clauses administratives et techniques)",
-            "reglementConsultation": "un règlement de consultation",
-            "lettreConsultation": "une lettre de consultation",
-            "grilleEvaluation": "une grille d'évaluation avec les critères d'attribution"
-        }
+    def _create_document_prompt(self, template_type, project_data, selected_companies=None, context=None):
+        """Create prompt for document generation (context: prebuilt _project_context)"""
+        doc_type = DOCUMENT_DESCRIPTIONS.get(template_type, "un document de consultation")
         
-        doc_type = doc_descriptions.get(template_type, "un document de consultation")
+        if context is None:
+            context = self._project_context(project_data, selected_companies)
         
+        # Build prompt
+        prompt = f"""Générez {doc_type} professionnel pour EDF.
+
+{context}
+Le document doit être structuré, professionnel et conforme aux standards EDF.
+Répondez uniquement avec le contenu du document sans autre commentaire ou code.
+"""
+        
+        return prompt
+    
+    def _create_pack_prompt(self, template_types, context):
+        """Create prompt generating several documents in one answer"""
+        documents_text = "".join(
+            f"- {template_type} : {DOCUMENT_DESCRIPTIONS.get(template_type, 'un document de consultation')}\n"
+            for template_type in template_types
+        )
+        
+        return f"""Générez les documents de consultation suivants, professionnels, pour EDF :
+{documents_text}
+{context}
+Chaque document doit être structuré, professionnel et conforme aux standards EDF.
+Commencez chaque document par une ligne de la forme :
+=== DOCUMENT: identifiant ===
+avec l'identifiant indiqué dans la liste ci-dessus, puis le contenu du document.
+Répondez uniquement avec les documents, sans autre commentaire ou code.
+"""
+    
+    def _project_context(self, project_data, selected_companies=None):
+        """Project, criteria and companies part of document prompts"""
         # Project information
         project_title = project_data.get('title', 'Projet EDF')
         project_description = project_data.get('description', '')
@@ -449,21 +613,30 @@ Le JSON doit être valide et complet.
                 if company.get('selected', True):
                     companies_text += f"- {company.get('name')} ({company.get('location', 'N/A')})\n"
         
-        # Build prompt
-        prompt = f"""Générez {doc_type} professionnel pour EDF.
-
-PROJET: {project_title}
+        return f"""PROJET: {project_title}
 DESCRIPTION: {project_description}
 
 {selection_criteria_text}
 {attribution_criteria_text}
 {companies_text}
-
-Le document doit être structuré, professionnel et conforme aux standards EDF.
-Répondez uniquement avec le contenu du document sans autre commentaire ou code.
 """
-        
-        return prompt
+    
+    def _documents_from_pack_answer(self, result, template_types):
+        """Split the answer of a pack prompt into formatted documents by type"""
+        documents = {}
+        if not result:
+            return documents
+        
+        separators = list(_PACK_SEPARATOR.finditer(result))
+        for i, separator in enumerate(separators):
+            template_type = separator.group(1)
+            if template_type not in template_types or template_type in documents:
+                continue
+            end = separators[i + 1].start() if i + 1 < len(separators) else len(result)
+            content = self._format_document_content(result[separator.end():end], template_type)
+            if len(content) > 10:
+                documents[template_type] = content
+        return documents
     
     def _format_document_content(self, content, template_type):
         """Format and clean the document content"""
@@ -481,7 +654,7 @@ Répondez uniquement avec le contenu du document sans autre commentaire ou code.
     
     def _create_fallback_document(self, template_type, project_data, selected_companies=None):
         """Create fallback document when API fails"""
-        logger.info(f"Creating fallback document for {template_type}")
+        logger.debug("Creating fallback document for %s", template_type)
         
         project_title = project_data.get('title', 'Projet EDF')
         project_description = project_data.get('description', 'Description du projet')
@@ -635,7 +808,7 @@ Barème de notation:
         
         return templates.get(template_type, f"Document {template_type} pour {project_title}")
 
-def analyze_document(document_text, api_key, agent_id=None):
+def analyze_document(document_text, api_key, agent_id=None, api_url=None):
     """
     Analyze a document to extract criteria
     
@@ -647,10 +820,10 @@ def analyze_document(document_text, api_key, agent_id=None):
     Returns:
         Dictionary with keywords, selection criteria, and attribution criteria
     """
-    mistral = MistralAPI(api_key, agent_id)
+    mistral = MistralAPI(api_key, agent_id, api_url)
     return mistral.analyze_document(document_text)
 
-def generate_document(template_type, project_data, api_key, agent_id=None):
+def generate_document(template_type, project_data, api_key, agent_id=None, api_url=None):
     """
     Generate a document based on template type and project data
     
@@ -663,11 +836,11 @@ def generate_document(template_type, project_data, api_key, agent_id=None):
     Returns:
         Generated document content
     """
-    mistral = MistralAPI(api_key, agent_id)
+    mistral = MistralAPI(api_key, agent_id, api_url)
     selected_companies = project_data.get('companies', [])
     return mistral.generate_document(template_type, project_data, selected_companies)
 
-def get_agent_answer(question, api_key, agent_id):
+def get_agent_answer(question, api_key, agent_id, api_url=None):
     """
     Get a direct answer from the Mistral agent
     
@@ -679,5 +852,5 @@ def get_agent_answer(question, api_key, agent_id):
     Returns:
         Agent's answer as text
     """
-    mistral = MistralAPI(api_key, agent_id)
+    mistral = MistralAPI(api_key, agent_id, api_url)
     return mistral._call_api(question) or "Je ne peux pas répondre à cette question pour le moment."
\ No newline at end of file
@@ -0,0 +1,140 @@
+"""
+panel_edits.py - Persistent overlay of the panel edits made through the API for EDF Panel Entreprises
+
+The panel is parsed from the registered workbooks (utils.data_sources), which
+the API never writes to. The companies added, updated, deleted or imported
+through the API are kept as an overlay keyed by company id (ids are stable,
+see excel_parser.stable_company_id):
+- added: full record of each company created by the API
+- updated: changed fields of each workbook company
+- deleted: ids removed from the panel
+
+PanelStore records every edit here before swapping its snapshot and applies
+the overlay again on top of each reload, so a reload never drops an edit.
+The overlay is saved as JSON (PANEL_EDITS_FILE, default
+data/panel_edits.json) under a file lock, after re-reading the file: it
+survives restarts and is shared by the processes of a prefork server.
+"""
+
+import os
+import json
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: single-process serving (waitress), the thread lock is enough
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EDITS_PATH = os.environ.get('PANEL_EDITS_FILE', 'data/panel_edits.json')
+
+
+class PanelEdits:
+    """Overlay of the API edits, saved to a JSON file"""
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_EDITS_PATH
+        self.added = {}
+        self.updated = {}
+        self.deleted = set()
+        self._lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.added) + len(self.updated) + len(self.deleted)
+
+    def load(self):
+        """Read the saved overlay (empty when there is no file)"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            saved = {}
+        self.added = saved.get('added', {})
+        self.updated = saved.get('updated', {})
+        self.deleted = set(saved.get('deleted', []))
+
+    def _save(self):
+        # Written next to the file then renamed: readers never see half a file
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'added': self.added, 'updated': self.updated, 'deleted': sorted(self.deleted)},
+                      f, ensure_ascii=False, indent=1, default=str)
+        os.replace(temp_path, self.path)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(f"{self.path}.lock", 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def record(self, added=(), updated=(), deleted=()):
+        """
+        Record edits and save the overlay (another process may have saved
+        edits meanwhile: the file is read again first)
+
+        Args:
+            added: Companies created
+            updated: (company_id, changed fields) pairs
+            deleted: Ids of the companies removed
+        """
+        with self._locked():
+            self.load()
+            for company in added:
+                company_id = company['id']
+                self.added[company_id] = dict(company)
+                self.updated.pop(company_id, None)
+                self.deleted.discard(company_id)
+            for company_id, changes in updated:
+                target = self.added.get(company_id)
+                if target is None:
+                    target = self.updated.setdefault(company_id, {})
+                target.update((key, value) for key, value in changes.items() if key != 'id')
+            for company_id in deleted:
+                self.added.pop(company_id, None)
+                self.updated.pop(company_id, None)
+                self.deleted.add(company_id)
+            self._save()
+
+    def refresh(self):
+        """Read again the overlay saved by any process"""
+        with self._locked():
+            self.load()
+
+    def apply(self, companies):
+        """
+        The parsed panel with the edits applied: deleted companies left out,
+        changed fields overridden, added companies at the end (an added
+        company found in the workbooks since then overrides its fields)
+
+        Returns:
+            List of companies
+        """
+        if not len(self):
+            return list(companies)
+
+        logger.info("Applying %d panel edits (%d added, %d updated, %d deleted)",
+                    len(self), len(self.added), len(self.updated), len(self.deleted))
+        result = []
+        seen = set()
+        for company in companies:
+            company_id = company['id']
+            if company_id in self.deleted:
+                continue
+            seen.add(company_id)
+            changes = self.updated.get(company_id) or self.added.get(company_id)
+            result.append({**company, **changes, 'id': company_id} if changes else company)
+
+        result.extend(company for company_id, company in self.added.items() if company_id not in seen)
+        return result
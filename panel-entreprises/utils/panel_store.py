@@ -0,0 +1,169 @@
+"""
+panel_store.py - Versioned in-memory company panel for EDF Panel Entreprises
+
+The panel is kept as an immutable (companies, version) snapshot. Every change
+builds a new CompanyTable and swaps the snapshot in one assignment, so readers
+never see a half-updated panel and caches can key their entries on the version.
+
+Edits (add, update, delete, merge) are recorded in a PanelEdits overlay
+before the swap; a reload hands the freshly parsed workbooks to rebase(),
+which applies the overlay again under the same lock, so an edit made while
+the workbooks were being parsed is kept.
+"""
+
+import threading
+import logging
+
+from utils.company_table import CompanyTable
+
+logger = logging.getLogger(__name__)
+
+
+class PanelStore:
+    """Holds the company panel and bumps a version number on every change"""
+
+    def __init__(self, companies=None, edits=None):
+        """
+        Args:
+            companies: Panel parsed from the workbooks
+            edits: Optional PanelEdits overlay, applied to companies and
+                kept up to date by the changes
+        """
+        self._lock = threading.Lock()
+        self._edits = edits
+        if edits is not None:
+            companies = edits.apply(companies or [])
+        self._snapshot = (CompanyTable.from_companies(companies or []), 1)
+        self._listeners = []
+
+    @property
+    def companies(self):
+        """Current CompanyTable (sequence of read-only company records)"""
+        return self._snapshot[0]
+
+    @property
+    def version(self):
+        """Dataset version, incremented on every change"""
+        return self._snapshot[1]
+
+    def snapshot(self):
+        """Return a consistent (companies, version) pair"""
+        return self._snapshot
+
+    def subscribe(self, callback):
+        """
+        Register a callback called as callback(companies, version) after each change
+        """
+        self._listeners.append(callback)
+
+    def rebase(self, companies):
+        """
+        Swap the whole panel for a freshly parsed one (reload), with the
+        edits recorded by any process applied again
+        """
+        with self._lock:
+            if self._edits is not None:
+                self._edits.refresh()
+                companies = self._edits.apply(companies)
+            self._snapshot = (CompanyTable.from_companies(companies), self._snapshot[1] + 1)
+            snapshot = self._snapshot
+        self._notify(snapshot)
+        return snapshot[1]
+
+    def add(self, company):
+        """Append one company"""
+        return self.extend([company])
+
+    def extend(self, companies):
+        """Append several companies"""
+        with self._lock:
+            current, version = self._snapshot
+            self._record(added=companies)
+            self._snapshot = (current.with_appended(companies), version + 1)
+            snapshot = self._snapshot
+        self._notify(snapshot)
+        return snapshot[1]
+
+    def update(self, company_id, changes):
+        """
+        Update one company's fields
+
+        Returns:
+            The updated company, or None if the id is unknown
+        """
+        with self._lock:
+            current, version = self._snapshot
+            row = current.row_of(company_id)
+            if row is None:
+                return None
+            updated = {**current[row], **changes, 'id': company_id}
+            self._record(updated=[(company_id, changes)])
+            self._snapshot = (current.with_replaced(row, updated), version + 1)
+            snapshot = self._snapshot
+        self._notify(snapshot)
+        return updated
+
+    def delete(self, company_id):
+        """
+        Remove one company
+
+        Returns:
+            True if a company was removed
+        """
+        with self._lock:
+            current, version = self._snapshot
+            row = current.row_of(company_id)
+            if row is None:
+                return False
+            self._record(deleted=[company_id])
+            self._snapshot = (current.without(row), version + 1)
+            snapshot = self._snapshot
+        self._notify(snapshot)
+        return True
+
+    def merge(self, added, updated, removed, expected_version):
+        """
+        Apply an import in one swap (see utils.dedupe.dedupe_new)
+
+        Args:
+            added: Companies to append
+            updated: {row: company} replacing rows of the expected version
+            removed: Rows of the expected version to remove
+            expected_version: Version the rows refer to
+
+        Returns:
+            The new version, or None if the panel changed since
+            expected_version (the caller recomputes the import)
+        """
+        with self._lock:
+            current, version = self._snapshot
+            if version != expected_version:
+                return None
+            self._record(
+                added=added,
+                updated=[(current[row]['id'], company) for row, company in updated.items()],
+                deleted=[current[row]['id'] for row in removed]
+            )
+            self._snapshot = (current.with_changes(updated, removed, added), version + 1)
+            snapshot = self._snapshot
+        self._notify(snapshot)
+        return snapshot[1]
+
+    def find(self, company_id):
+        """Return the company with this id, or None"""
+        companies = self.companies
+        row = companies.row_of(company_id)
+        return companies[row] if row is not None else None
+
+    def _record(self, **edits):
+        # Saved before the swap: a failed save leaves the panel unchanged
+        if self._edits is not None:
+            self._edits.record(**edits)
+
+    def _notify(self, snapshot):
+        companies, version = snapshot
+        for callback in self._listeners:
+            try:
+                callback(companies, version)
+            except Exception as e:
+                logger.error(f"Panel listener error: {e}")
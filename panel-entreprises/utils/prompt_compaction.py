@@ -0,0 +1,211 @@
+"""
+prompt_compaction.py - Relevance-aware compaction of documents sent to the LLM for EDF Panel Entreprises
+
+A cahier des charges is mostly cover pages, tables of contents and general
+clauses; the requirements (critères, exigences, qualifications, capacités)
+are often far past the first pages. Instead of keeping the head of the
+document, compact_document:
+- splits the text into sections at headings (numbered titles, "Article 4",
+  upper-case lines), and long sections into paragraphs
+- scores every section by requirement density: requirement cues and
+  technical vocabulary per word, tables of contents scoring almost nothing
+- keeps the start of the document (title and context), then packs the
+  best sections into the character budget, in document order
+
+Documents within the budget are returned unchanged.
+
+Configuration (environment variables):
+    PANEL_PROMPT_BUDGET_CHARS: characters of document text in a prompt (default 6000)
+"""
+
+import os
+import re
+
+from utils.gazetteer import fold
+from utils.tracing import span
+
+PROMPT_BUDGET_CHARS = int(os.environ.get('PANEL_PROMPT_BUDGET_CHARS', '6000'))
+
+# Characters of the start of the document always kept (title, context)
+HEAD_CHARS = 400
+
+# Sections longer than this are split into paragraphs
+MAX_SECTION_CHARS = 1500
+
+# Smallest part of a section worth keeping when it does not fit whole
+MIN_PART_CHARS = 300
+
+# Sections shorter than this (in words) are scored as if they had this length
+MIN_SCORED_WORDS = 30
+
+GAP_MARKER = '\n[...]\n'
+
+# Word stems of requirements, accent-free (matched at the start of words)
+REQUIREMENT_CUES = (
+    'critere', 'exigen', 'qualification', 'qualifie', 'capacite', 'certifi',
+    'habilit', 'agrement', 'agree', 'mase', 'iso', 'cefri', 'obligatoire',
+    'requis', 'imperati', 'doit', 'doivent', 'minimum', 'minimal', 'reference',
+    'experience', 'competence', 'moyens', 'effectif', 'chiffre d affaires',
+    'attribution', 'selection', 'ponderation', 'notation', 'bareme', 'delai',
+    'penalit', 'garantie', 'assurance', 'justifi'
+)
+
+# Lines of a table of contents ("3. Exigences ........ 12", "Exigences<tab>12")
+_TOC_LINE = re.compile(r'(?:\.{4,}|…{2,}|_{4,}|\t)\s*\d+\s*$')
+
+_HEADING = re.compile(
+    r'^\s*(?:(?:\d+(?:\.\d+)*\.?|[IVX]+\.|[A-H][.)])\s+\S|(?:article|chapitre|section|annexe|partie|titre)\b)',
+    re.IGNORECASE
+)
+
+_SENTENCE_END = re.compile(r'[.;:!?]\s|\n')
+
+
+def _is_heading(line):
+    stripped = line.strip()
+    if not stripped or len(stripped) > 120:
+        return False
+    if _HEADING.match(stripped):
+        return True
+    letters = [c for c in stripped if c.isalpha()]
+    return len(letters) >= 4 and len(stripped) <= 80 and all(c.isupper() for c in letters)
+
+
+def segment_document(text):
+    """
+    Split a document into sections
+
+    Returns:
+        list of (start, end) character offsets, in document order, covering
+        the text
+    """
+    sections = []
+    start = 0
+    position = 0
+    for line in text.splitlines(keepends=True):
+        if position > start and _is_heading(line):
+            sections.append((start, position))
+            start = position
+        position += len(line)
+    if position > start:
+        sections.append((start, position))
+
+    # Long sections: split at blank lines, then at line ends
+    parts = []
+    for start, end in sections:
+        while end - start > MAX_SECTION_CHARS:
+            window = text[start:start + MAX_SECTION_CHARS]
+            cut = window.rfind('\n\n')
+            if cut < MAX_SECTION_CHARS // 3:
+                cut = window.rfind('\n')
+            if cut < MAX_SECTION_CHARS // 3:
+                cut = MAX_SECTION_CHARS
+            else:
+                cut += 1
+            parts.append((start, start + cut))
+            start += cut
+        if end > start:
+            parts.append((start, end))
+    return parts
+
+
+def term_pattern(stems):
+    """Regex matching accent-free stems at the start of words"""
+    stems = sorted({fold(stem) for stem in stems if fold(stem)}, key=len, reverse=True)
+    return re.compile(r'\b(?:' + '|'.join(re.escape(stem) for stem in stems) + r')')
+
+
+_CUE_PATTERN = term_pattern(REQUIREMENT_CUES)
+
+
+def score_section(text, vocabulary_pattern=None):
+    """
+    Requirement density of a section: requirement cues (counted twice) and
+    vocabulary terms per word, near zero for tables of contents
+    """
+    folded = fold(text)
+    words = folded.count(' ') + 1 if folded else 0
+    if not words:
+        return 0.0
+    hits = 2 * len(_CUE_PATTERN.findall(folded))
+    if vocabulary_pattern is not None:
+        hits += len(vocabulary_pattern.findall(folded))
+
+    lines = [line for line in text.splitlines() if line.strip()]
+    toc_lines = sum(1 for line in lines if _TOC_LINE.search(line))
+    if lines and toc_lines * 3 >= len(lines):
+        hits *= 0.1
+    return hits / max(words, MIN_SCORED_WORDS)
+
+
+def _truncate(text, length):
+    # Cut at the last sentence or line end within length
+    if len(text) <= length:
+        return text
+    cut = 0
+    for match in _SENTENCE_END.finditer(text, 0, length):
+        cut = match.end()
+    return text[:cut or length].rstrip()
+
+
+def compact_document(text, budget=None, vocabulary=()):
+    """
+    Most relevant part of a document within a character budget
+
+    Args:
+        text: Document text
+        budget: Characters kept (default PANEL_PROMPT_BUDGET_CHARS)
+        vocabulary: Word stems of the project's domain, scored with the
+            requirement cues
+
+    Returns:
+        The text itself if it fits, else the start of the document and the
+        best scored sections in document order, gaps marked with [...]
+    """
+    budget = budget or PROMPT_BUDGET_CHARS
+    if len(text) <= budget:
+        return text
+
+    with span('llm.compact_prompt', chars=len(text), budget=budget) as trace:
+        vocabulary_pattern = term_pattern(vocabulary) if vocabulary else None
+        sections = segment_document(text)
+
+        # The head is kept whatever its score
+        head_end = min(HEAD_CHARS, budget // 4)
+        head = _truncate(text, head_end)
+        kept = {}
+        remaining = budget - len(head) - len(GAP_MARKER)
+
+        ranked = sorted(
+            ((score_section(text[start:end], vocabulary_pattern), start, end)
+             for start, end in sections if end > len(head)),
+            key=lambda item: (-item[0], item[1])
+        )
+        for score, start, end in ranked:
+            if score <= 0 or remaining < MIN_PART_CHARS:
+                break
+            start = max(start, len(head))
+            part = text[start:end].strip()
+            cost = len(part) + len(GAP_MARKER)
+            if cost > remaining:
+                part = _truncate(part, remaining - len(GAP_MARKER))
+                if len(part) < MIN_PART_CHARS:
+                    continue
+                cost = len(part) + len(GAP_MARKER)
+                end = start + len(part)    # the rest of the section is a gap
+            kept[start] = (end, part)
+            remaining -= cost
+
+        pieces = [head]
+        position = len(head)
+        for start in sorted(kept):
+            end, part = kept[start]
+            pieces.append(GAP_MARKER if start > position else '\n')
+            pieces.append(part)
+            position = end
+        if position < len(text):
+            pieces.append(GAP_MARKER)
+        compacted = ''.join(pieces)
+
+        trace.set(sections=len(sections), kept=len(kept), compacted_chars=len(compacted))
+        return compacted
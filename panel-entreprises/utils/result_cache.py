@@ -0,0 +1,80 @@
+"""
+result_cache.py - LRU cache of matching results for EDF Panel Entreprises
+
+Results are keyed by a canonical hash of the selected criteria, the matching
+parameters and the panel version, so any change to the panel makes older
+entries unreachable (and they are dropped when the panel notifies a change).
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Criterion fields that influence scoring
+CRITERION_KEY_FIELDS = ('id', 'name', 'description', 'weight')
+
+
+def criteria_fingerprint(criteria, max_results, min_score, dataset_version):
+    """
+    Build a canonical hash for a matching request
+
+    Unselected criteria are ignored because match_companies drops them too.
+    Criterion order is kept as it drives the order of matchDetails.
+    """
+    selected = [
+        {field: criterion.get(field) for field in CRITERION_KEY_FIELDS}
+        for criterion in criteria
+        if criterion.get('selected', True)
+    ]
+    payload = json.dumps(
+        [selected, max_results, min_score, dataset_version],
+        sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MatchResultCache:
+    """Thread-safe LRU cache for match_companies results"""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or int(os.environ.get('PANEL_RESULT_CACHE_SIZE', '256'))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached result or None (marks the entry as recently used)"""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        """Store a result, evicting the least recently used entries"""
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self, *args):
+        """Drop every entry (usable as a PanelStore listener)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return cache size and hit/miss counters"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'maxEntries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses
+            }
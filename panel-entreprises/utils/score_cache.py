@@ -0,0 +1,60 @@
+"""
+score_cache.py - Session-scoped criterion score vectors for EDF Panel Entreprises
+
+A search session (one document being refined in the search page) keeps the
+score vector of every criterion it has evaluated. Re-running the search after
+toggling or reweighting criteria then only recomputes the weighted sum.
+"""
+
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+
+class CriterionScoreCache:
+    """LRU of search sessions, each holding score vectors for one panel version"""
+
+    def __init__(self, max_sessions=None, ttl_seconds=None):
+        self.max_sessions = max_sessions or int(os.environ.get('PANEL_SCORE_SESSIONS', '128'))
+        self.ttl_seconds = ttl_seconds or int(os.environ.get('PANEL_SCORE_SESSION_TTL', '3600'))
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_search_id():
+        """Generate an identifier for a new search session"""
+        return uuid.uuid4().hex
+
+    def vectors(self, search_id, dataset_version):
+        """
+        Return the score vector dict of a session, to pass to match_companies
+
+        The dict is reset when the panel version changed since it was filled,
+        because vectors are aligned with the positions of the panel companies.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(search_id)
+            if session is None or session['version'] != dataset_version:
+                session = {'version': dataset_version, 'vectors': {}}
+                self._sessions[search_id] = session
+            session['last_used'] = now
+            self._sessions.move_to_end(search_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session['vectors']
+
+    def clear(self, *args):
+        """Drop every session (usable as a PanelStore listener)"""
+        with self._lock:
+            self._sessions.clear()
+
+    def _expire(self, now):
+        while self._sessions:
+            search_id, session = next(iter(self._sessions.items()))
+            if now - session['last_used'] <= self.ttl_seconds:
+                break
+            del self._sessions[search_id]
@@ -0,0 +1,131 @@
+"""
+topk.py - Threshold-algorithm top-K retrieval for EDF Panel Entreprises
+
+Fagin's threshold algorithm over per-criterion sorted score lists:
+- each precomputed criterion score vector (certification, geographic,
+  capacity and domain criteria) and the bonus vector are sorted once into a
+  list of rows by decreasing score, cached with the vectors in the search
+  session (utils.score_cache)
+- the lists are read in parallel, in rounds of doubling depth (sorted
+  access); the caller scores the rows seen for the first time (random
+  access)
+- a row not seen yet scores at most the last score read in every list, so
+  the weighted aggregate of those scores bounds every unseen row; the scan
+  stops when that threshold cannot beat the rows already kept
+
+TopKSelection holds the kept scores and decides when a bound excludes a
+row, taking the diversity groups of apply_diversity_rules into account.
+"""
+
+import heapq
+from collections import Counter
+
+# Depth of the first round of sorted access (the depth doubles every round)
+FIRST_ROUND_DEPTH = 32
+
+
+def sorted_access_list(vector):
+    """
+    Rows of a score vector by decreasing score, ties by row; rows whose
+    score is None (failed) are left out
+
+    Returns:
+        (rows, scores): two aligned lists
+    """
+    order = sorted((row for row, score in enumerate(vector) if score is not None),
+                   key=lambda row: -vector[row])
+    return order, [vector[row] for row in order]
+
+
+def cached_sorted_access_list(cache, key, vector):
+    """Return the sorted_access_list of a vector, cached under ('sorted', key)"""
+    cache_key = ('sorted', key)
+    access_list = cache.get(cache_key)
+    if access_list is None:
+        access_list = cache[cache_key] = sorted_access_list(vector)
+    return access_list
+
+
+def threshold_rounds(lists, seen, first_depth=FIRST_ROUND_DEPTH):
+    """
+    Read lists in parallel, in rounds of doubling depth
+
+    Args:
+        lists: (rows, scores) sorted access lists over the same rows
+        seen: set of rows already scored; rows read are added to it
+        first_depth: depth reached by the first round
+
+    Yields:
+        (rows, last_scores): the rows read for the first time in the round,
+        in reading order, and the score at the depth reached in each list;
+        last_scores is None once a list is exhausted (every row was read)
+    """
+    depth = 0
+    round_depth = max(1, first_depth)
+    length = min((len(rows) for rows, _ in lists), default=0)
+
+    while depth < length:
+        end = min(depth + round_depth, length)
+        new_rows = []
+        for position in range(depth, end):
+            for rows, _ in lists:
+                row = rows[position]
+                if row not in seen:
+                    seen.add(row)
+                    new_rows.append(row)
+        depth = end
+        round_depth *= 2
+        if depth < length:
+            yield new_rows, [scores[depth - 1] for _, scores in lists]
+        else:
+            yield new_rows, None
+
+
+class TopKSelection:
+    """
+    Exact final scores kept so far, and the rule deciding whether a company
+    bounded by some score can still be returned
+
+    A company is excluded when its bound is below min_score, or when
+    keep_count qualified companies and one qualified company of its group
+    score strictly above it: the top-K selection keeps the keep_count
+    (2 * max_results) best companies, and apply_diversity_rules picks at most
+    the best company of a group before filling from that top-K.
+    """
+
+    def __init__(self, keep_count, min_score, groups):
+        self.keep_count = keep_count
+        self.min_score = min_score
+        self.best = []          # min-heap of the keep_count best final scores
+        self.group_best = {}    # best final score per group
+        self.unseen = Counter(groups)
+
+    def excludes(self, bound, group):
+        """True if a company of this group scoring at most bound cannot be returned"""
+        if bound < self.min_score:
+            return True
+        return (self.keep_count > 0 and len(self.best) == self.keep_count
+                and bound < self.best[0] and bound < self.group_best.get(group, -1))
+
+    def add(self, score, group):
+        """Record the exact final score of a company"""
+        if score < self.min_score:
+            return
+        if len(self.best) < self.keep_count:
+            heapq.heappush(self.best, score)
+        elif self.keep_count > 0 and score > self.best[0]:
+            heapq.heapreplace(self.best, score)
+        if score > self.group_best.get(group, -1):
+            self.group_best[group] = score
+
+    def seen(self, group):
+        """Record that a company of this group was read"""
+        self.unseen[group] -= 1
+        if not self.unseen[group]:
+            del self.unseen[group]
+
+    def complete(self, threshold):
+        """True if no unseen company scoring at most threshold can be returned"""
+        if threshold < self.min_score:
+            return True
+        return all(self.excludes(threshold, group) for group in self.unseen)
@@ -0,0 +1,143 @@
+"""
+tracing.py - Lightweight sampled tracing for EDF Panel Entreprises
+
+Spans wrap the expensive stages (parse, enrich, match, llm). Every span feeds
+cheap in-memory aggregates; only sampled or slow spans are written to the log,
+and messages are formatted lazily by the logging module.
+
+Configuration (environment variables):
+    PANEL_TRACE_SAMPLE_RATE: fraction of root spans written to the log (default 0.1)
+    PANEL_TRACE_SLOW_MS: spans slower than this are always logged (default 2000)
+"""
+
+import os
+import random
+import threading
+import contextvars
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger('panel.trace')
+
+_config = {
+    'sample_rate': float(os.environ.get('PANEL_TRACE_SAMPLE_RATE', '0.1')),
+    'slow_threshold_ms': float(os.environ.get('PANEL_TRACE_SLOW_MS', '2000'))
+}
+
+# Active spans of the current thread or asyncio task (a tuple, innermost last)
+_active = contextvars.ContextVar('panel_trace_spans', default=())
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def configure(sample_rate=None, slow_threshold_ms=None):
+    """
+    Update tracing settings at runtime
+
+    Args:
+        sample_rate: Fraction (0..1) of root spans to log
+        slow_threshold_ms: Duration above which a span is always logged
+    """
+    if sample_rate is not None:
+        _config['sample_rate'] = max(0.0, min(1.0, float(sample_rate)))
+    if slow_threshold_ms is not None:
+        _config['slow_threshold_ms'] = float(slow_threshold_ms)
+
+
+class Span:
+    """A timed unit of work with attributes and aggregated counters"""
+
+    __slots__ = ('name', 'attrs', 'counters', 'sampled', 'start')
+
+    def __init__(self, name, attrs, sampled):
+        self.name = name
+        self.attrs = attrs
+        self.counters = {}
+        self.sampled = sampled
+        self.start = time.perf_counter()
+
+    def set(self, **attrs):
+        """Attach attributes reported when the span ends"""
+        self.attrs.update(attrs)
+
+    def incr(self, counter, amount=1):
+        """Increment a counter; use this instead of logging inside loops"""
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def event(self, msg, *args):
+        """Log a detail message for sampled spans only (formatted lazily)"""
+        if self.sampled and logger.isEnabledFor(logging.DEBUG):
+            logger.debug('[%s] ' + msg, self.name, *args)
+
+
+def current_span():
+    """Return the innermost active span of this thread or task, if any"""
+    stack = _active.get()
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Trace a stage of work
+
+    Child spans inherit the sampling decision of their parent so that a
+    sampled request is logged as a whole.
+    """
+    stack = _active.get()
+    if stack:
+        sampled = stack[-1].sampled
+    else:
+        sampled = random.random() < _config['sample_rate']
+
+    current = Span(name, attrs, sampled)
+    token = _active.set(stack + (current,))
+    failed = False
+    try:
+        yield current
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        _active.reset(token)
+        duration_ms = (time.perf_counter() - current.start) * 1000
+        _record(name, duration_ms, failed)
+
+        if failed:
+            logger.warning('span %s failed after %.1fms attrs=%s counters=%s',
+                           name, duration_ms, current.attrs, current.counters)
+        elif sampled or duration_ms >= _config['slow_threshold_ms']:
+            logger.info('span %s %.1fms attrs=%s counters=%s',
+                        name, duration_ms, current.attrs, current.counters)
+
+
+def _record(name, duration_ms, failed):
+    with _stats_lock:
+        entry = _stats.get(name)
+        if entry is None:
+            entry = _stats[name] = {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+        entry['count'] += 1
+        entry['total_ms'] += duration_ms
+        if duration_ms > entry['max_ms']:
+            entry['max_ms'] = duration_ms
+        if failed:
+            entry['errors'] += 1
+
+
+def get_stats():
+    """Return per-span aggregates: count, errors, total/avg/max duration in ms"""
+    with _stats_lock:
+        return {
+            name: {
+                **entry,
+                'avg_ms': entry['total_ms'] / entry['count'] if entry['count'] else 0.0
+            }
+            for name, entry in _stats.items()
+        }
+
+
+def reset_stats():
+    """Clear collected aggregates"""
+    with _stats_lock:
+        _stats.clear()
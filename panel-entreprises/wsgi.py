@@ -0,0 +1,68 @@
+"""
+wsgi.py - Point d'entrée de production pour EDF Panel Entreprises
+
+gunicorn (voir gunicorn.conf.py) importe ce module une seule fois dans le
+processus maître (preload_app). Une fois les sockets ouverts (hook
+when_ready, prepare_master), le panel est chargé, ses index construits, puis
+les objets existants sont gelés (gc.freeze) avant le fork. Les workers
+partagent ainsi ces pages mémoire en copy-on-write : le ramasse-miettes ne
+les parcourt plus et ne les recopie donc pas.
+
+Quand une source change, ou qu'un worker modifie le panel par l'API
+(modification enregistrée dans le fichier partagé de PanelEdits), le maître
+recharge le panel (reload_panel, sur SIGHUP) puis remplace ses workers : le
+panel reste chargé une seule fois et tous les workers servent la même
+version.
+
+Sans gunicorn, `python wsgi.py` sert l'application avec waitress (un
+processus, PANEL_THREADS threads).
+"""
+
+import os
+import gc
+import logging
+
+from app import app, SOURCE_WATCHER, load_initial_panel, warm_up
+
+logger = logging.getLogger(__name__)
+
+application = app
+
+
+def prepare_master():
+    """
+    Charge le panel dans le maître gunicorn (hook when_ready : sockets
+    ouverts, workers pas encore forkés), construit ses index puis gèle les
+    objets partagés par les workers
+    """
+    load_initial_panel()
+    warm_up()
+    gc.collect()
+    gc.freeze()
+    logger.info(f"{gc.get_freeze_count()} objets gelés avant le fork")
+
+
+def reload_panel():
+    """
+    Recharge le panel dans le maître gunicorn (hook on_reload, après un
+    SIGHUP) : sources reparsées, index reconstruits et objets regelés avant
+    le fork des nouveaux workers ; les anciens terminent leurs requêtes
+    """
+    # Dégeler pour que l'ancien panel puisse être libéré
+    gc.unfreeze()
+    if SOURCE_WATCHER.reload():
+        warm_up()
+    gc.collect()
+    gc.freeze()
+    logger.info(f"{gc.get_freeze_count()} objets gelés avant le fork")
+
+
+if __name__ == '__main__':
+    try:
+        from waitress import serve
+    except ImportError:
+        raise SystemExit("waitress n'est pas installé : lancer `gunicorn -c gunicorn.conf.py`")
+    
+    host, _, port = os.environ.get('PANEL_BIND', '0.0.0.0:5001').rpartition(':')
+    serve(application, host=host or '0.0.0.0', port=int(port),
+          threads=int(os.environ.get('PANEL_THREADS', '8')))